@@ -1,3 +1,11 @@
-from .celery import celery_app
-
 __all__ = ("celery_app",)
+
+
+def __getattr__(name):
+    # The Celery app is only needed to send tasks, so it is loaded on first
+    # access instead of at every import of the project.
+    if name == "celery_app":
+        from .celery import celery_app
+
+        return celery_app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
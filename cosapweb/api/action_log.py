@@ -0,0 +1,100 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from .models import Action
+
+logger = logging.getLogger(__name__)
+
+
+class ActionLogWriter:
+    """
+    Buffers `Action` rows and writes them with a single `bulk_create`.
+
+    Actions are buffered only once the surrounding transaction commits, so
+    rolled back changes leave no audit entries. The buffer is flushed after
+    `flush_interval` seconds or as soon as it holds `batch_size` actions.
+    """
+
+    def __init__(self, flush_interval: float, batch_size: int):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def log(self, associated_user, action_type, action_detail):
+        action = Action(
+            associated_user=associated_user,
+            action_type=action_type,
+            action_detail=action_detail,
+            created_at=timezone.now(),
+        )
+        transaction.on_commit(lambda: self._add(action))
+
+    def _add(self, action):
+        with self._lock:
+            self._buffer.append(action)
+            if len(self._buffer) >= self.batch_size:
+                flush_now = True
+            else:
+                flush_now = False
+                if self._timer is None:
+                    self._timer = threading.Timer(
+                        self.flush_interval, self._flush_from_timer
+                    )
+                    self._timer.daemon = True
+                    self._timer.start()
+
+        if flush_now:
+            self.flush()
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # Every timer runs in a new thread with its own connection
+            connections.close_all()
+
+    def flush(self):
+        with self._lock:
+            actions, self._buffer = self._buffer, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if not actions:
+            return
+
+        try:
+            with transaction.atomic():
+                Action.objects.bulk_create(actions, batch_size=self.batch_size)
+        except IntegrityError:
+            # Users deleted since their actions were logged fail the batch
+            self._write_one_by_one(actions)
+        except Exception as e:
+            logger.error(f"Could not write {len(actions)} actions: {e}")
+
+    def _write_one_by_one(self, actions):
+        failed = 0
+        for action in actions:
+            # Rolled back batches may have set primary keys
+            action.pk = None
+            try:
+                with transaction.atomic():
+                    action.save(force_insert=True)
+            except IntegrityError:
+                failed += 1
+        if failed:
+            logger.error(f"Could not write {failed} of {len(actions)} actions")
+
+
+action_log = ActionLogWriter(
+    flush_interval=settings.ACTION_LOG_FLUSH_INTERVAL,
+    batch_size=settings.ACTION_LOG_BATCH_SIZE,
+)
+atexit.register(action_log.flush)
@@ -4,7 +4,7 @@ from django_drf_filepond.models import TemporaryUpload
 
 from .models import (SNV, Action, Affiliation, CustomUser, File, Project,
                      ProjectFiles, ProjectSNVs, ProjectSummary, ProjectTask,
-                     Report)
+                     ProjectVariant, Report, StorageUsage, TaskStageMetric)
 
 admin.site.register(CustomUser, UserAdmin)
 admin.site.register(Affiliation)
@@ -14,6 +14,9 @@ admin.site.register(Report)
 admin.site.register(Action)
 admin.site.register(SNV)
 admin.site.register(ProjectSNVs)
+admin.site.register(ProjectVariant)
 admin.site.register(ProjectFiles)
 admin.site.register(ProjectTask)
 admin.site.register(ProjectSummary)
+admin.site.register(TaskStageMetric)
+admin.site.register(StorageUsage)
@@ -0,0 +1,194 @@
+import base64
+import functools
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.http import (Http404, HttpResponse, JsonResponse,
+                         StreamingHttpResponse)
+
+from ..authentication import get_token
+from ..common.instrumentation import count
+from ..common.metrics import FILE_BYTES_SERVED, IGV_RANGE_SIZE
+from ..common.utils import create_chonky_filemap, get_project_dir
+from .demo_cache import get_demo_project_ids, get_demo_variants
+from .models import Project
+from .permissions import get_accessible_file_path, has_project_access
+from .tiering import (RestorePending, apply_manifest, record_file_access,
+                      restore_file, restore_pending_response, touch_project)
+from .variants import get_project_variants
+
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class AsyncFileStreamResponse(StreamingHttpResponse):
+    """
+    Streams part of a file. Under `cosapweb.asgi` the file is read in worker
+    threads through `aiter_chunks`, so the event loop never waits on disk;
+    WSGI servers iterate it synchronously like any streaming response.
+    """
+
+    def __init__(self, path, offset=0, length=None, **kwargs):
+        self.path = path
+        self.offset = offset
+        self.length = os.path.getsize(path) - offset if length is None else length
+        super().__init__(self._iter_chunks(), **kwargs)
+        self["Content-Length"] = self.length
+
+    def _iter_chunks(self):
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    async def aiter_chunks(self):
+        f = await sync_to_async(open, thread_sensitive=False)(self.path, "rb")
+        try:
+            await sync_to_async(f.seek, thread_sensitive=False)(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = await sync_to_async(f.read, thread_sensitive=False)(
+                    min(STREAM_CHUNK_SIZE, remaining)
+                )
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            await sync_to_async(f.close, thread_sensitive=False)()
+
+
+def token_required(view):
+    """
+    Authenticates async views with the same tokens as the REST API.
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        keyword, _, key = request.headers.get("Authorization", "").partition(" ")
+        token = None
+        if keyword in ("Token", "Bearer") and key:
+            token = await sync_to_async(get_token)(key.strip())
+
+        if token is None or not token.user.is_active:
+            return JsonResponse(
+                {"detail": "Invalid or missing authentication token."}, status=401
+            )
+
+        request.user = token.user
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+async def _get_file_path(request, b64_string):
+    decoded_path = base64.b64decode(b64_string).decode("utf-8")
+    file_path = await sync_to_async(get_accessible_file_path)(request, decoded_path)
+    if not file_path:
+        raise Http404
+
+    # Files are restored off the thread shared by database work
+    available, usage_delta = await sync_to_async(
+        restore_file, thread_sensitive=False
+    )(file_path)
+    await sync_to_async(record_file_access)(file_path, usage_delta)
+    if not available:
+        raise Http404
+    return file_path
+
+
+@token_required
+async def download(request, b64_string):
+    try:
+        file_path = await _get_file_path(request, b64_string)
+    except RestorePending:
+        return restore_pending_response()
+
+    response = AsyncFileStreamResponse(
+        file_path, content_type="application/octet-stream"
+    )
+    count("fs_bytes", response.length)
+    FILE_BYTES_SERVED.labels("download").inc(response.length)
+    response["Content-Disposition"] = (
+        f"attachment; filename={os.path.basename(file_path)}"
+    )
+    return response
+
+
+@token_required
+async def igv_data(request, b64_string):
+    try:
+        file_path = await _get_file_path(request, b64_string)
+    except RestorePending:
+        return restore_pending_response()
+
+    range_header = request.headers.get("Range")
+    if file_path.endswith(".bai") or not range_header:
+        response = AsyncFileStreamResponse(
+            file_path, content_type="application/octet-stream"
+        )
+        count("fs_bytes", response.length)
+        return response
+
+    m = re.search(r"(\d+)-(\d*)", range_header)
+    if not m:
+        return HttpResponse(
+            f"Error: unexpected range header syntax: {range_header}", status=400
+        )
+
+    size = os.path.getsize(file_path)
+    offset = int(m.group(1))
+    length = min(int(m.group(2) or size - 1), size - 1) - offset + 1
+    if length <= 0:
+        return HttpResponse(status=416, headers={"Content-Range": f"bytes */{size}"})
+
+    response = AsyncFileStreamResponse(
+        file_path,
+        offset=offset,
+        length=length,
+        content_type="application/octet-stream",
+    )
+    response["Content-Range"] = f"bytes {offset}-{offset + length - 1}/{size}"
+    response.status_code = 206
+    count("fs_bytes", length)
+    FILE_BYTES_SERVED.labels("igv").inc(length)
+    IGV_RANGE_SIZE.observe(length)
+    return response
+
+
+@token_required
+async def project_variants(request, pk):
+    if not await sync_to_async(has_project_access)(request, pk):
+        raise Http404
+
+    if pk in await sync_to_async(get_demo_project_ids)():
+        variants = await sync_to_async(get_demo_variants)(pk)
+    else:
+        project = await sync_to_async(Project.objects.get)(id=pk)
+        variants = await sync_to_async(get_project_variants)(project)
+
+    return JsonResponse(variants, safe=False)
+
+
+@token_required
+async def project_file_map(request, project_id):
+    if not await sync_to_async(has_project_access)(request, project_id):
+        raise Http404
+
+    project = await sync_to_async(Project.objects.select_related("user").get)(
+        id=project_id
+    )
+    await sync_to_async(touch_project)(project.id)
+    project_dir = get_project_dir(project)
+    file_map = await sync_to_async(create_chonky_filemap, thread_sensitive=False)(
+        project_dir, project.name
+    )
+    file_map = await sync_to_async(apply_manifest, thread_sensitive=False)(
+        file_map, project_dir
+    )
+    return JsonResponse(file_map, safe=False)
@@ -0,0 +1,323 @@
+import os
+import random
+import shutil
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+
+from ..common.cache import bump_cache_version
+from ..common.utils import get_project_dir, get_user_dir
+from .models import (SNV, USER, File, Project, ProjectFiles, ProjectSNVData,
+                     ProjectSNVs, ProjectSummary, ProjectVariant)
+from .permissions import PROJECT_ACL_CACHE
+from .response_cache import PROJECT_LIST_CACHE
+
+# Synthetic data is recognised by these markers, so it can be removed
+# without touching real users and variants.
+BENCHMARK_EMAIL_DOMAIN = "benchmark.cosap.invalid"
+BENCHMARK_SNV_MARKER = "cosap-benchmark"
+
+BATCH_SIZE = 10000
+
+CHROMOSOMES = [f"chr{i}" for i in range(1, 23)] + ["chrX", "chrY"]
+BASES = "ACGT"
+GENES = [f"BENCH{i}" for i in range(1, 501)]
+CLASSIFICATIONS = ["Pathogenic", "Likely pathogenic", "VUS", "Benign"]
+ALGORITHMS = {
+    "aligner": ["bwa"],
+    "variantCaller": ["mutect", "varscan"],
+    "variantAnnotator": ["ensembl_vep"],
+}
+
+
+def get_benchmark_users():
+    return USER.objects.filter(email__endswith=f"@{BENCHMARK_EMAIL_DOMAIN}")
+
+
+def _bulk_create(model, objects):
+    for start in range(0, len(objects), BATCH_SIZE):
+        model.objects.bulk_create(objects[start : start + BATCH_SIZE])
+
+
+def _write_sized_file(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    block = os.urandom(min(size, 1024 * 1024))
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+
+def _write_vcf(path, rng, lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write("##fileformat=VCFv4.2\n")
+        f.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n")
+        for _ in range(lines):
+            f.write(
+                f"{rng.choice(CHROMOSOMES)}\t{rng.randint(1, 10**8)}\t.\t"
+                f"{rng.choice(BASES)}\t{rng.choice(BASES)}\t50\tPASS\t.\n"
+            )
+
+
+def get_project_tree_paths(project):
+    """
+    Returns the paths of the BAM and VCF of a synthetic project tree relative
+    to MEDIA_ROOT, or None if the project has no tree.
+    """
+    project_dir = get_project_dir(project)
+    paths = {
+        "bam": os.path.join(project_dir, "mapped", "TUMOR.bam"),
+        "vcf": os.path.join(project_dir, "variants", "TUMOR.vcf"),
+    }
+    if not os.path.isfile(paths["bam"]):
+        return None
+
+    media_root = os.path.dirname(get_user_dir(project.user))
+    return {name: os.path.relpath(path, media_root) for name, path in paths.items()}
+
+
+def create_project_tree(project, rng, depth, bam_size):
+    """
+    Writes a pipeline-like output tree for a project: nested stage
+    directories with small files, a BAM with its index and a VCF.
+    """
+    project_dir = get_project_dir(project)
+    stage_dir = project_dir
+    for level in range(depth):
+        stage_dir = os.path.join(stage_dir, f"stage_{level}")
+        for i in range(5):
+            _write_sized_file(os.path.join(stage_dir, f"log_{i}.txt"), 1024)
+
+    bam_path = os.path.join(project_dir, "mapped", "TUMOR.bam")
+    _write_sized_file(bam_path, bam_size)
+    _write_sized_file(bam_path + ".bai", 64 * 1024)
+    _write_vcf(os.path.join(project_dir, "variants", "TUMOR.vcf"), rng, 20000)
+
+
+def generate_benchmark_data(
+    users=1000,
+    projects_per_user=3,
+    files_per_user=6,
+    snvs=1_000_000,
+    variants_per_project=500,
+    project_dirs=20,
+    dir_depth=6,
+    bam_size=16 * 1024 * 1024,
+    seed=0,
+    log=print,
+):
+    """
+    Creates synthetic users with tokens, files, projects with collaborators,
+    summaries and variants, and output trees on disk for the first
+    `project_dirs` projects. Signals are bypassed with bulk inserts.
+    """
+    rng = random.Random(seed)
+    password = make_password(None)
+
+    log(f"Creating {users} users...")
+    with transaction.atomic():
+        _bulk_create(
+            USER,
+            [
+                USER(
+                    email=f"user{i}@{BENCHMARK_EMAIL_DOMAIN}",
+                    username=f"benchmark{i}",
+                    password=password,
+                )
+                for i in range(users)
+            ],
+        )
+        user_list = list(get_benchmark_users().order_by("id"))
+        _bulk_create(
+            Token,
+            [Token(key=Token.generate_key(), user=user) for user in user_list],
+        )
+
+    log(f"Creating {users * files_per_user} files...")
+    with transaction.atomic():
+        files = []
+        for user in user_list:
+            for i in range(files_per_user):
+                sample_type = File.TUMOR if i % 2 else File.NORMAL
+                name = f"{sample_type.lower()}_{i // 2}_R{i % 2 + 1}.fastq.gz"
+                files.append(
+                    File(
+                        user=user,
+                        name=name,
+                        file_type="FQ",
+                        sample_type=sample_type,
+                        file=f"{user.id}_{user.email}/files/{name}",
+                    )
+                )
+        _bulk_create(File, files)
+
+    log(f"Creating {users * projects_per_user} projects...")
+    with transaction.atomic():
+        _bulk_create(
+            Project,
+            [
+                Project(
+                    user=user,
+                    name=f"benchmark_{user.id}_{i}",
+                    project_type=rng.choice([Project.SOMATIC, Project.GERMLINE]),
+                    status=rng.choice([Project.COMPLETED] * 3 + [Project.FAILED]),
+                    progress=100,
+                    algorithms=ALGORITHMS,
+                )
+                for user in user_list
+                for i in range(projects_per_user)
+            ],
+        )
+        projects = list(
+            Project.objects.filter(user__in=get_benchmark_users())
+            .select_related("user")
+            .order_by("id")
+        )
+        file_ids = {}
+        for file_id, user_id in File.objects.filter(
+            user__in=get_benchmark_users()
+        ).values_list("id", "user_id"):
+            file_ids.setdefault(user_id, []).append(file_id)
+
+        _bulk_create(
+            Project.collaborators.through,
+            [
+                Project.collaborators.through(
+                    project_id=project.id, customuser_id=rng.choice(user_list).id
+                )
+                for project in projects
+            ],
+        )
+        _bulk_create(ProjectFiles, [ProjectFiles(project=p) for p in projects])
+        project_files = ProjectFiles.objects.filter(
+            project__user__in=get_benchmark_users()
+        )
+        _bulk_create(
+            ProjectFiles.files.through,
+            [
+                ProjectFiles.files.through(projectfiles_id=pf_id, file_id=file_id)
+                for pf_id, user_id in project_files.values_list(
+                    "id", "project__user_id"
+                )
+                for file_id in file_ids.get(user_id, [])[:4]
+            ],
+        )
+        _bulk_create(
+            ProjectSummary,
+            [
+                ProjectSummary(
+                    project=project,
+                    mapped_reads=rng.uniform(0.9, 1.0),
+                    mean_coverage=rng.uniform(30, 200),
+                    number_of_variants=variants_per_project,
+                    number_of_significant_variants=variants_per_project // 10,
+                    number_of_vus=variants_per_project // 5,
+                )
+                for project in projects
+                if project.status == Project.COMPLETED
+            ],
+        )
+
+    log(f"Creating {snvs} SNVs...")
+    for start in range(0, snvs, BATCH_SIZE):
+        SNV.objects.bulk_create(
+            [
+                SNV(
+                    chromosome=chromosome,
+                    position=position,
+                    location=f"{chromosome}:{position}",
+                    ref=rng.choice(BASES),
+                    alt=rng.choice(BASES),
+                    gene_symbol=rng.choice(GENES),
+                    classification=rng.choice(CLASSIFICATIONS),
+                    gnomad_af=rng.random() / 10,
+                    rs_id=f"rs{rng.randint(1, 10**9)}" if rng.random() < 0.5 else None,
+                    cosmic_id=(
+                        f"COSV{rng.randint(1, 10**8)}" if rng.random() < 0.2 else None
+                    ),
+                    other_info=BENCHMARK_SNV_MARKER,
+                )
+                for chromosome, position in (
+                    (rng.choice(CHROMOSOMES), rng.randint(1, 10**8))
+                    for _ in range(min(BATCH_SIZE, snvs - start))
+                )
+            ]
+        )
+    snv_ids = list(
+        SNV.objects.filter(other_info=BENCHMARK_SNV_MARKER).values_list("id", flat=True)
+    )
+
+    log(f"Linking {variants_per_project} variants to every project...")
+    _bulk_create(ProjectSNVs, [ProjectSNVs(project=p) for p in projects])
+    project_snvs = dict(
+        ProjectSNVs.objects.filter(project__user__in=get_benchmark_users()).values_list(
+            "project_id", "id"
+        )
+    )
+    links, data, variants = [], [], []
+    for project in projects:
+        for snv_id in rng.sample(snv_ids, min(variants_per_project, len(snv_ids))):
+            allele_frequency = rng.random()
+            links.append(
+                ProjectSNVs.snvs.through(
+                    projectsnvs_id=project_snvs[project.id], snv_id=snv_id
+                )
+            )
+            data.append(
+                ProjectSNVData(
+                    project_id=project.id,
+                    snv_id=snv_id,
+                    allele_frequency=allele_frequency,
+                )
+            )
+            variants.append(
+                ProjectVariant(
+                    project_id=project.id,
+                    snv_id=snv_id,
+                    allele_frequency=allele_frequency,
+                    depth=rng.randint(10, 500),
+                    caller="mutect",
+                    filter="PASS",
+                )
+            )
+        if len(data) >= BATCH_SIZE:
+            _bulk_create(ProjectSNVs.snvs.through, links)
+            _bulk_create(ProjectSNVData, data)
+            _bulk_create(ProjectVariant, variants)
+            links, data, variants = [], [], []
+    _bulk_create(ProjectSNVs.snvs.through, links)
+    _bulk_create(ProjectSNVData, data)
+    _bulk_create(ProjectVariant, variants)
+
+    log(f"Writing output trees of {project_dirs} projects...")
+    for project in projects[:project_dirs]:
+        create_project_tree(project, rng, dir_depth, bam_size)
+    for project in projects[project_dirs:]:
+        os.makedirs(get_project_dir(project), exist_ok=True)
+
+    bump_cache_version(PROJECT_ACL_CACHE)
+    bump_cache_version(PROJECT_LIST_CACHE)
+    return len(projects)
+
+
+def delete_benchmark_data(log=print):
+    """
+    Removes all synthetic users with their projects, files and directories,
+    and the synthetic SNVs.
+    """
+    users = list(get_benchmark_users())
+    log(f"Deleting data of {len(users)} users...")
+    Project.objects.filter(user__in=users).delete()
+    File.objects.filter(user__in=users).delete()
+    for user in users:
+        shutil.rmtree(get_user_dir(user), ignore_errors=True)
+    get_benchmark_users().delete()
+
+    log("Deleting SNVs...")
+    SNV.objects.filter(other_info=BENCHMARK_SNV_MARKER).delete()
+
+    bump_cache_version(PROJECT_ACL_CACHE)
+    bump_cache_version(PROJECT_LIST_CACHE)
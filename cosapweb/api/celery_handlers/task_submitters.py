@@ -1,6 +1,5 @@
 import os
 
-from ...celery import celery_app
 from ...common.utils import (get_project_dir, match_read_pairs,
                              wait_file_update_complete)
 from ..models import Project, ProjectFiles
@@ -10,6 +9,7 @@ def submit_cosap_dna_job(project_id: int):
     """
     Takes a Project object and submits a COSAP DNA pipeline job to Celery.
     """
+    from ...celery import celery_app
 
     project = Project.objects.get(id=project_id)
     project_file_obj = ProjectFiles.objects.get(project=project)
@@ -62,10 +62,48 @@ def submit_cosap_dna_job(project_id: int):
     return cosap_dna_task.id
 
 
+def revoke_cosap_dna_job(task_ids: list):
+    """
+    Revokes COSAP DNA pipeline tasks and terminates them if they are running.
+
+    SIGTERM is delivered to the worker process executing the task. The tool
+    containers started by the pipeline are not stopped from here: the COSAP
+    worker has to stop them when it receives SIGTERM, otherwise they keep
+    running until they finish.
+    """
+    if not task_ids:
+        return
+
+    from ...celery import celery_app
+
+    celery_app.control.revoke(task_ids, terminate=True, signal="SIGTERM")
+
+
+def get_cosap_queue_depth(queue_name: str = "cosap_worker"):
+    """
+    Returns the number of messages waiting in the broker queue of the COSAP
+    worker, or None if the broker cannot be reached.
+    """
+    from ...celery import celery_app
+
+    try:
+        with celery_app.connection_for_write(connect_timeout=1) as connection:
+            connection.ensure_connection(max_retries=1)
+            _, message_count, _ = connection.default_channel.queue_declare(
+                queue=queue_name, passive=True
+            )
+    except Exception:
+        return None
+
+    return message_count
+
+
 def submit_cosap_parse_project_data_task(path):
     """
     Sends parse project results to cosap worker and retrieve data as dict.
     """
+    from ...celery import celery_app
+
     parse_project_task = celery_app.send_task(
         "parse_project_results",
         args=[path],
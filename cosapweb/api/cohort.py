@@ -0,0 +1,179 @@
+import hashlib
+
+from ..common.cache import get_cache_versions, shared_cache_get, shared_cache_set
+from .models import SNV, ProjectVariant
+from .variants import get_variant_cache_name
+
+COHORT_CACHE = "cohort"
+COHORT_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Variants found in most projects that are listed with their projects
+RECURRENT_VARIANTS = 100
+# Columns of the project by variant matrix multiplied at once
+MATRIX_BLOCK_SIZE = 1 << 16
+
+
+def get_variant_key(chromosome, position, location, ref, alt) -> int:
+    """
+    Hashes a variant to a signed 64 bit integer that is the same in every
+    process. "chr1" and "1" are the same chromosome.
+    """
+    if chromosome and position is not None:
+        location = f"{chromosome.removeprefix('chr')}:{position}"
+    digest = hashlib.blake2b(f"{location}:{ref}>{alt}".encode(), digest_size=8)
+    return int.from_bytes(digest.digest(), "little", signed=True)
+
+
+def load_variant_keys(project_id, version):
+    """
+    Returns the sorted variant keys of a project, and the id of an SNV for
+    each key, as int64 arrays.
+    """
+    import numpy as np
+
+    cache_key = f"{COHORT_CACHE}:keys:{project_id}:{version}"
+    cached = shared_cache_get(cache_key)
+    if cached is not None:
+        return tuple(np.frombuffer(buffer, dtype=np.int64) for buffer in cached)
+
+    rows = list(
+        ProjectVariant.objects.filter(project_id=project_id).values_list(
+            "snv_id",
+            "snv__chromosome",
+            "snv__position",
+            "snv__location",
+            "snv__ref",
+            "snv__alt",
+        )
+    )
+    keys = np.fromiter(
+        (get_variant_key(*row[1:]) for row in rows), dtype=np.int64, count=len(rows)
+    )
+    snv_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    keys, first = np.unique(keys, return_index=True)
+    snv_ids = snv_ids[first]
+
+    shared_cache_set(
+        cache_key, (keys.tobytes(), snv_ids.tobytes()), COHORT_CACHE_TIMEOUT
+    )
+    return keys, snv_ids
+
+
+def compare_projects(projects) -> dict:
+    """
+    Compares the variants of projects. Returns matrices of the number of
+    variants shared by each pair of projects and of their Jaccard indices,
+    how many variants recur in exactly 1, 2, ... projects, and the variants
+    recurring in most projects.
+
+    Results are cached until the variants of one of the projects change.
+    """
+    projects = sorted(projects, key=lambda project: project.id)
+    versions = get_cache_versions(
+        [get_variant_cache_name(project.id) for project in projects]
+    )
+    project_set = ",".join(
+        f"{project.id}:{versions[get_variant_cache_name(project.id)]}"
+        for project in projects
+    )
+    digest = hashlib.sha1(project_set.encode()).hexdigest()
+    cache_key = f"{COHORT_CACHE}:compare:{digest}"
+    result = shared_cache_get(cache_key)
+    if result is not None:
+        return result
+
+    key_sets = [
+        load_variant_keys(project.id, versions[get_variant_cache_name(project.id)])
+        for project in projects
+    ]
+    result = _compare_key_sets([project.id for project in projects], key_sets)
+    result["projects"] = [
+        {
+            "id": project.id,
+            "name": project.name,
+            "algorithms": project.algorithms,
+            "variant_count": len(keys),
+        }
+        for project, (keys, _) in zip(projects, key_sets)
+    ]
+
+    shared_cache_set(cache_key, result, COHORT_CACHE_TIMEOUT)
+    return result
+
+
+def _compare_key_sets(project_ids, key_sets) -> dict:
+    import numpy as np
+
+    project_count = len(key_sets)
+    sizes = np.array([len(keys) for keys, _ in key_sets], dtype=np.int64)
+    all_keys = np.concatenate([keys for keys, _ in key_sets])
+    all_snv_ids = np.concatenate([snv_ids for _, snv_ids in key_sets])
+    # Index of the project of every element of all_keys
+    owners = np.repeat(np.arange(project_count), sizes)
+
+    unique_keys, first, inverse, recurrence = np.unique(
+        all_keys, return_index=True, return_inverse=True, return_counts=True
+    )
+
+    # Overlaps are the product of the project by variant membership matrix
+    # with its transpose, restricted to variants of at least two projects
+    # and computed in blocks of columns to bound memory.
+    shared = recurrence >= 2
+    columns = (np.cumsum(shared) - 1)[inverse]
+    is_shared = shared[inverse]
+    columns, rows = columns[is_shared], owners[is_shared]
+    shared_count = int(shared.sum())
+    overlap = np.zeros((project_count, project_count), dtype=np.float64)
+    for start in range(0, shared_count, MATRIX_BLOCK_SIZE):
+        width = min(MATRIX_BLOCK_SIZE, shared_count - start)
+        in_block = (columns >= start) & (columns < start + width)
+        membership = np.zeros((project_count, width), dtype=np.float32)
+        membership[rows[in_block], columns[in_block] - start] = 1
+        overlap += membership @ membership.T
+    overlap = overlap.round().astype(np.int64)
+    np.fill_diagonal(overlap, sizes)
+
+    union = sizes[:, None] + sizes[None, :] - overlap
+    jaccard = np.divide(
+        overlap,
+        union,
+        out=np.zeros(overlap.shape, dtype=np.float64),
+        where=union > 0,
+    )
+
+    # Elements grouped by variant, to find the projects of recurrent ones
+    by_variant = np.argsort(inverse, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(recurrence)])
+    top = np.argsort(-recurrence, kind="stable")[:RECURRENT_VARIANTS]
+    top = top[recurrence[top] >= 2]
+    snvs = SNV.objects.in_bulk(
+        [int(all_snv_ids[first[variant]]) for variant in top]
+    )
+    recurrent_variants = []
+    for variant in top:
+        snv = snvs.get(int(all_snv_ids[first[variant]]))
+        if snv is None:
+            continue
+
+        members = owners[by_variant[offsets[variant] : offsets[variant + 1]]]
+        recurrent_variants.append(
+            {
+                "snv": snv.id,
+                "location": snv.location,
+                "ref": snv.ref,
+                "alt": snv.alt,
+                "gene_symbol": snv.gene_symbol,
+                "count": int(recurrence[variant]),
+                "projects": [project_ids[member] for member in members],
+            }
+        )
+
+    # Number of variants found in exactly 1, 2, ... projects
+    recurrence_counts = np.bincount(recurrence, minlength=project_count + 1)[1:]
+    return {
+        "variant_count": len(unique_keys),
+        "overlap": overlap.tolist(),
+        "jaccard": jaccard.round(4).tolist(),
+        "recurrence": recurrence_counts.tolist(),
+        "recurrent_variants": recurrent_variants,
+    }
@@ -0,0 +1,72 @@
+from ..common.cache import get_cache_version, shared_cache_get, shared_cache_set
+from ..db_routers import primary_if_recent
+from .models import File, Project
+from .serializers import ProjectSerializer
+from .variants import get_project_variants
+
+# Demo projects and files are visible to every user, so their payloads are
+# built once per change of demo content and shared by all users.
+DEMO_CACHE = "demo_content"
+DEMO_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def _get_or_build(name, build_payload):
+    version = get_cache_version(DEMO_CACHE)
+    cache_key = f"{DEMO_CACHE}:{name}:{version}"
+    payload = shared_cache_get(cache_key)
+    if payload is None:
+        with primary_if_recent(version):
+            payload = build_payload()
+        shared_cache_set(cache_key, payload, DEMO_CACHE_TIMEOUT)
+    return payload
+
+
+def get_demo_project_ids() -> frozenset:
+    return _get_or_build(
+        "project_ids",
+        lambda: frozenset(
+            Project.objects.filter(is_demo=True).values_list("id", flat=True)
+        ),
+    )
+
+
+def get_demo_file_ids() -> frozenset:
+    return frozenset(file["id"] for file in get_demo_files())
+
+
+def get_demo_project_entries() -> list:
+    """
+    Returns demo projects serialized like the entries of the project list.
+    """
+
+    def build_payload():
+        projects = (
+            Project.objects.filter(is_demo=True)
+            .select_related("user")
+            .prefetch_related("collaborators")
+        )
+        serializer = ProjectSerializer(projects, many=True)
+        return [dict(project) for project in serializer.data]
+
+    return _get_or_build("project_entries", build_payload)
+
+
+def get_demo_files() -> list:
+    """
+    Returns id, uuid, name, sample_type and file_type of demo files by id.
+    """
+    return _get_or_build(
+        "files",
+        lambda: list(
+            File.objects.filter(is_demo=True)
+            .order_by("id")
+            .values("id", "uuid", "name", "sample_type", "file_type")
+        ),
+    )
+
+
+def get_demo_variants(project_id) -> list:
+    return _get_or_build(
+        f"variants:{project_id}",
+        lambda: get_project_variants(Project.objects.get(id=project_id)),
+    )
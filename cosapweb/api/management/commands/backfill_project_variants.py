@@ -0,0 +1,40 @@
+from django.core.management import BaseCommand
+
+from cosapweb.api.models import Project
+from cosapweb.api.variants import (backfill_project_variants,
+                                   backfill_snv_locations)
+
+
+class Command(BaseCommand):
+    """Copies project variants from ProjectSNVs and ProjectSNVData into
+    ProjectVariant, and fills the chromosome and position of SNVs saved
+    before they were parsed from the location. Safe to run again, variants
+    copied before are kept.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--project", type=int, action="append", help="Id of a project to backfill."
+        )
+
+    def handle(self, *args, **options):
+        snvs = backfill_snv_locations()
+        self.stdout.write(f"Parsed the locations of {snvs} SNVs.")
+
+        projects = Project.all_objects.order_by("id")
+        if options["project"]:
+            projects = projects.filter(id__in=options["project"])
+
+        backfilled, variants = 0, 0
+        for project in projects.iterator():
+            count = backfill_project_variants(project)
+            if count:
+                self.stdout.write(f"{project}: {count} variants")
+                backfilled += 1
+                variants += count
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Backfilled {variants} variants of {backfilled} projects."
+            )
+        )
@@ -0,0 +1,86 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from django.core.management import BaseCommand
+
+# Runs in a fresh interpreter, so nothing imported by this command is reused
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+setup_done = time.perf_counter()
+from django.test import Client
+Client().get(sys.argv[1], HTTP_HOST="localhost")
+request_done = time.perf_counter()
+print(json.dumps({
+    "setup_ms": (setup_done - start) * 1000,
+    "first_request_ms": (request_done - setup_done) * 1000,
+    "modules": len(sys.modules),
+    "heavy_modules": sorted(m for m in sys.argv[2:] if m in sys.modules),
+}))
+"""
+
+# Modules that only some endpoints need and should not be loaded at startup
+LAZY_MODULES = ["pysam", "sentry_sdk", "celery", "multiprocessing.pool", "numpy"]
+
+# Median milliseconds of Django setup and the first request
+STARTUP_BUDGET_MS = 1500
+
+
+class Command(BaseCommand):
+    """Measures cold start time: Django setup and the first request,
+    including the URL configuration and views it loads, in fresh processes.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument(
+            "--path",
+            default="/projects/",
+            help="Path of the first request, sent without credentials.",
+        )
+        parser.add_argument(
+            "--budget-ms",
+            type=float,
+            default=STARTUP_BUDGET_MS,
+            help="Fail if the median startup time exceeds this many milliseconds, "
+            "0 to disable.",
+        )
+
+    def handle(self, *args, **options):
+        results = []
+        for _ in range(options["runs"]):
+            start = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", PROBE, options["path"], *LAZY_MODULES],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            result = json.loads(output.splitlines()[-1])
+            result["process_ms"] = (time.perf_counter() - start) * 1000
+            results.append(result)
+
+        summary = {
+            key: round(statistics.median(result[key] for result in results), 1)
+            for key in ("setup_ms", "first_request_ms", "process_ms", "modules")
+        }
+        summary["startup_ms"] = round(
+            summary["setup_ms"] + summary["first_request_ms"], 1
+        )
+        summary["heavy_modules"] = results[-1]["heavy_modules"]
+        self.stdout.write(json.dumps(summary))
+
+        budget = options["budget_ms"]
+        if budget and summary["startup_ms"] > budget:
+            self.stderr.write(
+                self.style.ERROR(
+                    f"Startup took {summary['startup_ms']} ms, "
+                    f"over the budget of {budget:g} ms."
+                )
+            )
+            raise SystemExit(1)
@@ -0,0 +1,346 @@
+import base64
+import json
+import os
+import random
+import statistics
+import subprocess
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django_drf_filepond.models import TemporaryUpload
+from rest_framework.authtoken.models import Token
+
+from cosapweb.api.benchmark_data import (get_benchmark_users,
+                                         get_project_tree_paths)
+from cosapweb.api.models import SNV, File, Project
+
+SCENARIOS = [
+    "project_list",
+    "project_retrieve",
+    "variants",
+    "file_map",
+    "igv_range",
+    "download",
+    "chunked_upload",
+    "project_create",
+]
+
+
+def submit_job_stub(project_id):
+    """
+    Stands in for the Celery worker: accepts every job without running it.
+    """
+    return str(uuid.uuid4())
+
+
+def get_git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}+dirty" if dirty else commit
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+        "p50_ms": round(percentile(0.5), 2),
+        "p95_ms": round(percentile(0.95), 2),
+        "p99_ms": round(percentile(0.99), 2),
+    }
+
+
+class Command(BaseCommand):
+    """Measures latency and throughput of the main endpoints against the
+    synthetic data of `generate_benchmark_data`, with the Celery worker
+    replaced by a stub, and appends the results to a history file so runs
+    of different commits can be compared.
+
+    Requests go through the full middleware and view stack in this process,
+    so the numbers exclude the HTTP server and network.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument(
+            "--scenarios",
+            default=",".join(SCENARIOS),
+            help=f"Comma separated subset of: {', '.join(SCENARIOS)}.",
+        )
+        parser.add_argument("--range-kb", type=int, default=256)
+        parser.add_argument("--upload-size-mb", type=int, default=8)
+        parser.add_argument("--chunk-size-mb", type=int, default=1)
+        parser.add_argument(
+            "--clear-cache",
+            action="store_true",
+            help="Clear the shared cache before every scenario.",
+        )
+        parser.add_argument(
+            "--history",
+            default=os.path.join(settings.BASE_DIR, "benchmark_history.jsonl"),
+        )
+        parser.add_argument("--label", default="", help="Stored with the results.")
+
+    def handle(self, *args, **options):
+        scenarios = options["scenarios"].split(",")
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        self.options = options
+        self.load_dataset()
+        max_project_id = Project.objects.order_by("-id").values_list("id", flat=True)
+        max_file_id = File.objects.order_by("-id").values_list("id", flat=True)
+        max_project_id, max_file_id = max_project_id.first(), max_file_id.first()
+
+        results = {}
+        try:
+            with mock.patch(
+                "cosapweb.api.views.submit_cosap_dna_job", submit_job_stub
+            ), mock.patch("cosapweb.api.views.revoke_cosap_dna_job"):
+                for name in scenarios:
+                    if options["clear_cache"]:
+                        cache.clear()
+                    results[name] = self.run_scenario(getattr(self, name))
+                    self.stdout.write(f"{name}: {json.dumps(results[name])}")
+        finally:
+            self.delete_created(max_project_id or 0, max_file_id or 0)
+
+        entry = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": get_git_commit(),
+            "label": options["label"],
+            "dataset": self.dataset,
+            "concurrency": options["concurrency"],
+            "results": results,
+        }
+        self.compare(entry)
+        with open(options["history"], "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def load_dataset(self):
+        users = get_benchmark_users()
+        self.tokens = dict(
+            Token.objects.filter(user__in=users).values_list("user_id", "key")
+        )
+        if not self.tokens:
+            raise CommandError(
+                "No benchmark data, create it with generate_benchmark_data."
+            )
+
+        self.projects = list(
+            Project.objects.filter(user__in=users).values_list("id", "user_id")
+        )
+        self.tree_projects = []
+        for project in (
+            Project.objects.filter(user__in=users).select_related("user").order_by("id")
+        ):
+            paths = get_project_tree_paths(project)
+            if paths is None:
+                break
+            self.tree_projects.append((project.id, project.user_id, paths))
+
+        self.user_files = {}
+        for user_id, file_uuid in File.objects.filter(user__in=users).values_list(
+            "user_id", "uuid"
+        ):
+            self.user_files.setdefault(user_id, []).append(file_uuid)
+
+        self.dataset = {
+            "users": len(self.tokens),
+            "projects": len(self.projects),
+            "project_trees": len(self.tree_projects),
+            "snvs": SNV.objects.count(),
+        }
+
+    def delete_created(self, max_project_id, max_file_id):
+        """
+        Deletes projects and files created by the scenarios.
+        """
+        users = get_benchmark_users()
+        Project.objects.filter(user__in=users, id__gt=max_project_id).delete()
+        files = File.objects.filter(user__in=users, id__gt=max_file_id)
+        upload_ids = list(files.values_list("uuid", flat=True))
+        files.delete()
+        for upload in TemporaryUpload.objects.filter(upload_id__in=upload_ids):
+            upload.delete()
+
+    def run_scenario(self, send_request):
+        requests = self.options["requests"]
+        concurrency = self.options["concurrency"]
+        latencies, errors = [], []
+
+        def worker(count, seed):
+            client = Client(HTTP_HOST="localhost")
+            rng = random.Random(seed)
+            try:
+                for _ in range(count):
+                    start = time.perf_counter()
+                    response = send_request(client, rng)
+                    if response.streaming:
+                        for _ in response.streaming_content:
+                            pass
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code >= 400:
+                        errors.append(response.status_code)
+            finally:
+                connections.close_all()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            futures = [
+                executor.submit(worker, requests // concurrency, seed)
+                for seed in range(concurrency)
+            ]
+            for future in futures:
+                future.result()
+        return summarize(latencies, len(errors), time.perf_counter() - start)
+
+    def compare(self, entry):
+        """
+        Prints the change from the last run on the same dataset.
+        """
+        previous = None
+        if os.path.exists(self.options["history"]):
+            with open(self.options["history"]) as f:
+                for line in f:
+                    past = json.loads(line)
+                    if (
+                        past["dataset"] == entry["dataset"]
+                        and past["concurrency"] == entry["concurrency"]
+                    ):
+                        previous = past
+        if previous is None:
+            return
+
+        self.stdout.write(
+            f"Compared to {previous['commit']} ({previous['timestamp']}):"
+        )
+        for name, result in entry["results"].items():
+            past = previous["results"].get(name)
+            if past is None:
+                continue
+            p50 = (result["p50_ms"] - past["p50_ms"]) / past["p50_ms"] * 100
+            throughput = (
+                (result["throughput"] - past["throughput"]) / past["throughput"] * 100
+            )
+            self.stdout.write(
+                f"  {name}: p50 {p50:+.1f}%, throughput {throughput:+.1f}%"
+            )
+
+    def auth(self, user_id):
+        return {"HTTP_AUTHORIZATION": f"Token {self.tokens[user_id]}"}
+
+    def project_list(self, client, rng):
+        return client.get("/projects/", **self.auth(rng.choice(list(self.tokens))))
+
+    def project_retrieve(self, client, rng):
+        project_id, user_id = rng.choice(self.projects)
+        return client.get(f"/projects/{project_id}/", **self.auth(user_id))
+
+    def variants(self, client, rng):
+        project_id, user_id = rng.choice(self.projects)
+        return client.get(f"/variants/{project_id}/", **self.auth(user_id))
+
+    def file_map(self, client, rng):
+        project_id, user_id, _ = rng.choice(self.tree_projects)
+        return client.get(
+            f"/files/{project_id}/",
+            {"return_type": "projectFileMap"},
+            **self.auth(user_id),
+        )
+
+    def igv_range(self, client, rng):
+        project_id, user_id, paths = rng.choice(self.tree_projects)
+        path = os.path.join(settings.MEDIA_ROOT, paths["bam"])
+        length = self.options["range_kb"] * 1024
+        offset = rng.randrange(max(1, os.path.getsize(path) - length))
+        b64_path = base64.b64encode(paths["bam"].encode()).decode()
+        return client.get(
+            f"/igv/{b64_path}",
+            HTTP_RANGE=f"bytes={offset}-{offset + length - 1}",
+            **self.auth(user_id),
+        )
+
+    def download(self, client, rng):
+        project_id, user_id, paths = rng.choice(self.tree_projects)
+        b64_path = base64.b64encode(paths["vcf"].encode()).decode()
+        return client.get(f"/file/{b64_path}", **self.auth(user_id))
+
+    def chunked_upload(self, client, rng):
+        user_id = rng.choice(list(self.tokens))
+        size = self.options["upload_size_mb"] * 1024 * 1024
+        chunk_size = self.options["chunk_size_mb"] * 1024 * 1024
+        response = client.post(
+            "/files/",
+            {"filepond": "{}", "sample_type": "TUMOR"},
+            HTTP_UPLOAD_LENGTH=str(size),
+            **self.auth(user_id),
+        )
+        if response.status_code != 200:
+            return response
+
+        upload_id = response.content.decode()
+        chunk = os.urandom(chunk_size)
+        for offset in range(0, size, chunk_size):
+            response = client.patch(
+                f"/files/patch/{upload_id}",
+                chunk[: size - offset],
+                content_type="application/offset+octet-stream",
+                HTTP_UPLOAD_OFFSET=str(offset),
+                HTTP_UPLOAD_LENGTH=str(size),
+                HTTP_UPLOAD_NAME="benchmark_R1.fastq.gz",
+                **self.auth(user_id),
+            )
+            if response.status_code != 200:
+                break
+        return response
+
+    def project_create(self, client, rng):
+        user_id = rng.choice(list(self.tokens))
+        return client.post(
+            "/projects/",
+            {
+                "name": f"benchmark_new_{uuid.uuid4().hex[:8]}",
+                "project_type": Project.SOMATIC,
+                "algorithms": json.dumps(
+                    {
+                        "aligner": ["bwa"],
+                        "variantCaller": ["mutect"],
+                        "variantAnnotator": ["ensembl_vep"],
+                    }
+                ),
+                "tumor_files": json.dumps(self.user_files.get(user_id, [])[:2]),
+            },
+            **self.auth(user_id),
+        )
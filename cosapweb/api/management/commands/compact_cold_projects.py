@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from cosapweb.api.tiering import compact_project, get_cold_projects
+
+
+class Command(BaseCommand):
+    """Compacts the output files of finished projects that were not accessed
+    for a number of days and reports the space saved. Compacted files are
+    restored transparently when they are read again.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.TIERING_COLD_AFTER_DAYS
+        )
+        parser.add_argument(
+            "--limit", type=int, help="Compact at most this many projects."
+        )
+        parser.add_argument(
+            "--reference",
+            default=settings.TIERING_CRAM_REFERENCE,
+            help="Reference FASTA for BAM to CRAM conversion, BAMs are kept "
+            "as they are without it.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the size of the files that would be compacted.",
+        )
+
+    def handle(self, *args, **options):
+        projects = get_cold_projects(options["days"])[: options["limit"]]
+        compacted, total_before, total_after = 0, 0, 0
+        for project in projects:
+            bytes_before, bytes_after = compact_project(
+                project, reference=options["reference"], dry_run=options["dry_run"]
+            )
+            self.stdout.write(
+                f"{project}: {bytes_before} bytes"
+                + ("" if options["dry_run"] else f" compacted to {bytes_after}")
+            )
+            compacted += 1
+            total_before += bytes_before
+            total_after += bytes_after
+
+        if options["dry_run"]:
+            message = f"{total_before} bytes of {compacted} cold projects to compact."
+        else:
+            message = (
+                f"Compacted {compacted} cold projects, "
+                f"{total_before - total_after} bytes saved."
+            )
+        self.stdout.write(self.style.SUCCESS(message))
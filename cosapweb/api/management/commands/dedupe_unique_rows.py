@@ -0,0 +1,72 @@
+import uuid
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Max, Min
+
+from cosapweb.api.models import File, ProjectSNVData
+
+
+class Command(BaseCommand):
+    """Removes the duplicate rows that keep the unique constraints on file
+    uuids and on the project and SNV of ProjectSNVData from being applied.
+    Run it before migrating to them. Duplicate files keep their rows and get
+    new uuids, the oldest file keeps the uuid. Of duplicate ProjectSNVData
+    rows only the newest is kept.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Only report the number of duplicate rows.",
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options["dry_run"]
+        with transaction.atomic():
+            files = self.dedupe_file_uuids(dry_run)
+            snv_data = self.dedupe_project_snv_data(dry_run)
+
+        action = "Found" if dry_run else "Fixed"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{action} {files} files with duplicate uuids and "
+                f"{snv_data} duplicate ProjectSNVData rows."
+            )
+        )
+
+    def dedupe_file_uuids(self, dry_run) -> int:
+        duplicates = (
+            File.objects.values("uuid")
+            .annotate(count=Count("id"), first_id=Min("id"))
+            .filter(count__gt=1)
+        )
+        changed = 0
+        for duplicate in duplicates:
+            files = File.objects.filter(uuid=duplicate["uuid"]).exclude(
+                id=duplicate["first_id"]
+            )
+            for file_id in files.values_list("id", flat=True):
+                if not dry_run:
+                    File.objects.filter(id=file_id).update(uuid=uuid.uuid4())
+                changed += 1
+        return changed
+
+    def dedupe_project_snv_data(self, dry_run) -> int:
+        duplicates = (
+            ProjectSNVData.objects.filter(project__isnull=False, snv__isnull=False)
+            .values("project", "snv")
+            .annotate(count=Count("id"), last_id=Max("id"))
+            .filter(count__gt=1)
+        )
+        deleted = 0
+        for duplicate in duplicates:
+            rows = ProjectSNVData.objects.filter(
+                project=duplicate["project"], snv=duplicate["snv"]
+            ).exclude(id=duplicate["last_id"])
+            deleted += duplicate["count"] - 1
+            if not dry_run:
+                # Deleted without signals, ProjectVariant mirrors the kept row
+                rows._raw_delete(rows.db)
+        return deleted
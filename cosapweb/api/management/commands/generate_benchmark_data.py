@@ -0,0 +1,59 @@
+from django.core.management import BaseCommand, CommandError
+
+from cosapweb.api.benchmark_data import (delete_benchmark_data,
+                                         generate_benchmark_data,
+                                         get_benchmark_users)
+
+
+class Command(BaseCommand):
+    """Creates synthetic users, projects, files, variants and project
+    directories for the `benchmark` command, or deletes them with --delete.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--projects-per-user", type=int, default=3)
+        parser.add_argument("--files-per-user", type=int, default=6)
+        parser.add_argument("--snvs", type=int, default=1_000_000)
+        parser.add_argument("--variants-per-project", type=int, default=500)
+        parser.add_argument(
+            "--project-dirs",
+            type=int,
+            default=20,
+            help="Number of projects that get output files on disk.",
+        )
+        parser.add_argument("--dir-depth", type=int, default=6)
+        parser.add_argument(
+            "--bam-size-mb", type=int, default=16, help="Size of the fake BAM files."
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--delete", action="store_true", help="Delete existing synthetic data."
+        )
+
+    def handle(self, *args, **options):
+        if options["delete"]:
+            delete_benchmark_data(log=self.stdout.write)
+            self.stdout.write(self.style.SUCCESS("Benchmark data deleted."))
+            return
+
+        if get_benchmark_users().exists():
+            raise CommandError(
+                "Benchmark data already exists, delete it first with --delete."
+            )
+
+        project_count = generate_benchmark_data(
+            users=options["users"],
+            projects_per_user=options["projects_per_user"],
+            files_per_user=options["files_per_user"],
+            snvs=options["snvs"],
+            variants_per_project=options["variants_per_project"],
+            project_dirs=options["project_dirs"],
+            dir_depth=options["dir_depth"],
+            bam_size=options["bam_size_mb"] * 1024 * 1024,
+            seed=options["seed"],
+            log=self.stdout.write,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(f"Benchmark data created, {project_count} projects.")
+        )
@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from cosapweb.api.reclaimer import ProjectReclaimer
+
+
+class Command(BaseCommand):
+    """Removes the directories and rows of deleted projects at a bounded
+    rate and reports the reclaimed bytes.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit", type=int, help="Reclaim at most this many projects."
+        )
+        parser.add_argument(
+            "--bytes-per-second", type=int, default=settings.RECLAIM_BYTES_PER_SECOND
+        )
+        parser.add_argument(
+            "--files-per-second", type=int, default=settings.RECLAIM_FILES_PER_SECOND
+        )
+
+    def handle(self, *args, **options):
+        reclaimer = ProjectReclaimer(
+            bytes_per_second=options["bytes_per_second"],
+            files_per_second=options["files_per_second"],
+        )
+        projects, reclaimed_bytes = reclaimer.reclaim_all(
+            limit=options["limit"], log=self.stdout.write
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reclaimed {reclaimed_bytes} bytes of {projects} deleted projects."
+            )
+        )
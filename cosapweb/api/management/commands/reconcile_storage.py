@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+
+from cosapweb.api.storage import reconcile_user_usage
+
+
+class Command(BaseCommand):
+    """Rescans the upload and project directories of users, replaces their
+    recorded storage usage and reports how far the records had drifted.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="Email of a single user to reconcile.")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.order_by("id")
+        if options["user"]:
+            users = users.filter(email=options["user"])
+            if not users.exists():
+                raise CommandError(f"No user with email {options['user']}.")
+
+        reconciled, total_drift = 0, 0
+        for user in users.iterator():
+            drift = reconcile_user_usage(user)
+            if drift:
+                self.stdout.write(f"{user.email}: off by {drift:+d} bytes")
+            reconciled += 1
+            total_drift += abs(drift)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reconciled {reconciled} users, {total_drift} bytes of drift."
+            )
+        )
@@ -6,18 +6,45 @@ from django.db.utils import OperationalError
 
 
 class Command(BaseCommand):
-    """Django command to pause execution until db is available
+    """Django command to pause execution until the databases accept queries
     https://stackoverflow.com/questions/52621819/django-unit-test-wait-for-database
     """
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=120,
+            help="Seconds to wait before giving up.",
+        )
+
     def handle(self, *args, **options):
         self.stdout.write("Waiting for database...")
-        db_conn = None
-        while not db_conn:
-            try:
-                db_conn = connections["default"]
-            except OperationalError:
-                self.stdout.write("Database unavailable, waititng 1 second...")
-                time.sleep(1)
+        deadline = time.monotonic() + options["timeout"]
+
+        for alias in connections:
+            delay = 0.5
+            while True:
+                try:
+                    connection = connections[alias]
+                    connection.ensure_connection()
+                    with connection.cursor() as cursor:
+                        cursor.execute("SELECT 1")
+                    break
+                except OperationalError:
+                    connections[alias].close()
+                    if time.monotonic() + delay > deadline:
+                        self.stderr.write(
+                            self.style.ERROR(
+                                f"Database {alias} unavailable, giving up."
+                            )
+                        )
+                        raise SystemExit(1)
+
+                    self.stdout.write(
+                        f"Database {alias} unavailable, waiting {delay:g} seconds..."
+                    )
+                    time.sleep(delay)
+                    delay = min(delay * 2, 10)
 
         self.stdout.write(self.style.SUCCESS("Database available!"))
@@ -0,0 +1,42 @@
+from rest_framework.permissions import SAFE_METHODS
+
+from ..db_routers import is_pinned_to_primary, replica_available, use_replica
+
+
+class ReplicaReadMixin:
+    """
+    Runs the read-only actions listed in `replica_actions` against the read
+    replica, unless the user has written recently.
+    """
+
+    replica_actions = ("list", "retrieve")
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        self._replica_context = None
+        if (
+            replica_available()
+            and request.method in SAFE_METHODS
+            and getattr(self, "action", None) in self.replica_actions
+            and not is_pinned_to_primary(request.user)
+        ):
+            self._replica_context = use_replica()
+            self._replica_context.__enter__()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        self.exit_replica()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            # Unhandled exceptions skip finalize_response
+            self.exit_replica()
+
+    def exit_replica(self):
+        replica_context = getattr(self, "_replica_context", None)
+        if replica_context is not None:
+            self._replica_context = None
+            replica_context.__exit__(None, None, None)
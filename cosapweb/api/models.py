@@ -5,9 +5,12 @@ from django.apps import apps
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import AbstractUser, UserManager
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.utils import timezone
 from django_countries.fields import CountryField
 from rest_framework.authtoken.models import Token
 
@@ -52,6 +55,15 @@ class CustomUser(AbstractUser):
 USER = get_user_model()
 
 
+class ProjectManager(models.Manager):
+    """
+    Hides projects that were deleted but whose files are not reclaimed yet.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class Project(models.Model):
 
     SOMATIC = "SM"
@@ -80,10 +92,33 @@ class Project(models.Model):
     progress = models.SmallIntegerField(default=0)
     algorithms = models.JSONField(default=dict)
     is_demo = models.BooleanField(default=False)
+    # Set when the project is deleted, see cosapweb.api.reclaimer
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # Set and refreshed by the process reclaiming a deleted project
+    reclaiming_at = models.DateTimeField(null=True, blank=True)
+    # Maintained for storage tiering, see cosapweb.api.tiering
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+    compacted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = ProjectManager()
+    all_objects = models.Manager()
+
+    # Fields whose changes invalidate caches, see cosapweb.api.signals
+    TRACKED_FIELDS = ["user_id", "status", "is_demo", "deleted_at"]
 
     def __str__(self):
         return f"{self.id} - {self.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value
+            for name, value in zip(field_names, values)
+            if name in cls.TRACKED_FIELDS
+        }
+        return instance
+
 
 class ProjectSummary(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
@@ -101,6 +136,9 @@ class ProjectSummary(models.Model):
 
 class SNV(models.Model):
     location = models.CharField(max_length=256)
+    # Parsed from `location` when saved, for range searches
+    chromosome = models.CharField(max_length=64, null=True, blank=True)
+    position = models.BigIntegerField(null=True, blank=True)
     ref = models.CharField(max_length=256)
     alt = models.CharField(max_length=256)
     function = models.TextField(max_length=256, null=True, blank=True)
@@ -127,6 +165,14 @@ class SNV(models.Model):
     def __str__(self) -> str:
         return f"{self.location} - {self.gene_symbol}"
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["gene_symbol"], name="snv_gene_symbol_idx"),
+            models.Index(fields=["rs_id"], name="snv_rs_id_idx"),
+            models.Index(fields=["cosmic_id"], name="snv_cosmic_id_idx"),
+            models.Index(fields=["chromosome", "position"], name="snv_position_idx"),
+        ]
+
 
 class ProjectSNVs(models.Model):
     project = models.ForeignKey(Project, null=True, on_delete=models.CASCADE)
@@ -144,6 +190,64 @@ class ProjectSNVData(models.Model):
     def __str__(self) -> str:
         return f"{self.project.id}_{self.project.name} - snv data"
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["project", "snv"], name="unique_project_snv_data"
+            )
+        ]
+
+
+class ProjectVariant(models.Model):
+    """
+    A variant called in a project with its project specific values. Variant
+    reads use this table alone, ProjectSNVs and ProjectSNVData are mirrored
+    into it for writers that still use them, see cosapweb.api.variants.
+    """
+
+    project = models.ForeignKey(
+        Project, on_delete=models.CASCADE, related_name="variants"
+    )
+    snv = models.ForeignKey(
+        SNV, on_delete=models.CASCADE, related_name="project_variants"
+    )
+    allele_frequency = models.FloatField(null=True, blank=True)
+    depth = models.IntegerField(null=True, blank=True)
+    caller = models.CharField(max_length=64, null=True, blank=True)
+    filter = models.CharField(max_length=256, null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f"{self.project_id} - {self.snv_id}"
+
+    class Meta:
+        constraints = [
+            # Also serves reads of the variants of a project
+            models.UniqueConstraint(
+                fields=["project", "snv"], name="unique_project_variant"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["snv", "project"], name="project_variant_snv_idx")
+        ]
+
+
+class ProjectVariantAggregate(models.Model):
+    """
+    Variant counts of a project by gene, classification, consequence,
+    chromosome and allele frequency, computed when its variants change, see
+    cosapweb.api.variants.
+    """
+
+    project = models.OneToOneField(
+        Project, on_delete=models.CASCADE, related_name="variant_aggregate"
+    )
+    variant_count = models.IntegerField(default=0)
+    facets = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self) -> str:
+        return f"{self.project_id} - variant aggregate"
+
 
 class SV(models.Model):
     pass
@@ -180,7 +284,9 @@ class File(models.Model):
     SAMPLE_TYPES = [(TUMOR, "tumor"), (NORMAL, "normal")]
 
     user = models.ForeignKey(USER, null=True, on_delete=models.SET_NULL)
-    uuid = models.CharField(max_length=256, default=uuid.uuid4, editable=True)
+    uuid = models.CharField(
+        max_length=256, default=uuid.uuid4, editable=True, unique=True
+    )
     uploaded_at = models.DateTimeField(auto_now_add=True)
     name = models.CharField(max_length=256, blank=True, null=True)
     file_type = models.CharField(max_length=64, blank=True, null=True)
@@ -193,6 +299,32 @@ class File(models.Model):
     def __str__(self):
         return f"{self.id}-{self.name}"
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "sample_type"], name="file_user_sample_type_idx"
+            ),
+            models.Index(fields=["user", "file_type"], name="file_user_file_type_idx"),
+            # File catalog pages, most recently uploaded first
+            models.Index(
+                fields=["user", "-uploaded_at", "-id"], name="file_user_uploaded_idx"
+            ),
+            models.Index(
+                fields=["-uploaded_at", "-id"],
+                condition=models.Q(is_demo=True),
+                name="file_demo_uploaded_idx",
+            ),
+            # Case insensitive prefix search compares UPPER(name)
+            models.Index(
+                OpClass(Upper("name"), name="text_pattern_ops"),
+                name="file_name_prefix_idx",
+            ),
+            # Fuzzy search, needs the pg_trgm extension
+            GinIndex(
+                fields=["name"], opclasses=["gin_trgm_ops"], name="file_name_trgm_idx"
+            ),
+        ]
+
 
 class ProjectFiles(models.Model):
     project = models.ForeignKey(Project, on_delete=models.SET_NULL, null=True)
@@ -242,18 +374,75 @@ class Action(models.Model):
     )
     action_type = models.CharField(choices=ACTION_TYPES, max_length=2)
     action_detail = models.CharField(max_length=256, null=True, blank=True)
-    created_at = models.DateTimeField(auto_now=True)
+    # Set once when the action happens, so the activity feed order is stable
+    created_at = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
         return f"{self.action_type}_{self.action_detail}"
 
     class Meta:
         ordering = ["created_at"]
+        indexes = [
+            models.Index(
+                fields=["associated_user", "-created_at", "-id"],
+                include=["action_type", "action_detail"],
+                name="action_user_feed_idx",
+            )
+        ]
 
 
 class ProjectTask(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     task_id = models.CharField(max_length=256)
+    input_size = models.BigIntegerField(default=0)
 
     def __str__(self):
         return f"{self.project.name} - task_id:{self.task_id}"
+
+
+class TaskStageMetric(models.Model):
+    project_task = models.ForeignKey(
+        ProjectTask, on_delete=models.CASCADE, related_name="stage_metrics"
+    )
+    stage = models.CharField(max_length=256)
+    wall_time = models.FloatField()
+    cpu_time = models.FloatField(null=True, blank=True)
+    output_size = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.project_task.task_id} - {self.stage}"
+
+
+class StorageUsage(models.Model):
+    """
+    Disk usage of a project directory, or of the uploaded files of a user
+    when `project` is empty. Kept up to date incrementally, see
+    cosapweb.api.storage.
+    """
+
+    user = models.ForeignKey(
+        USER, on_delete=models.CASCADE, related_name="storage_usage"
+    )
+    project = models.OneToOneField(
+        Project,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE,
+        related_name="storage_usage",
+    )
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.user_id} - {self.project_id or 'files'}: {self.bytes_used}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user"],
+                condition=models.Q(project__isnull=True),
+                name="unique_user_files_usage",
+            )
+        ]
@@ -0,0 +1,33 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class ActionCursorPagination(CursorPagination):
+    """
+    Newest first activity feed pagination.
+    """
+
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 200
+    ordering = ("-created_at", "-id")
+
+
+class FileCatalogCursorPagination(CursorPagination):
+    """
+    Most recently uploaded first file catalog pagination.
+    """
+
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+    ordering = ("-uploaded_at", "-id")
+
+
+class VariantSearchPagination(PageNumberPagination):
+    """
+    Variant search results pagination, with the total number of matches.
+    """
+
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
@@ -1,7 +1,23 @@
+import os
+from typing import NamedTuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.auth.models import User
+from django.db.models import Exists, OuterRef, Q
 from django.http import Http404
 from rest_framework import permissions
 
+from ..common.cache import (bump_cache_version, get_cache_versions,
+                            shared_cache_get, shared_cache_set)
+from ..db_routers import primary_if_recent
+from .models import Project
+
+USER = get_user_model()
+
+PROJECT_ACL_CACHE = "project_acl"
+PROJECT_ACL_CACHE_TIMEOUT = 60 * 60
+
 
 class OnlyAdminToList(permissions.BasePermission):
     """
@@ -28,3 +44,138 @@ class IsOwnerOrDoesNotExist(permissions.BasePermission):
                 raise Http404()
 
         return False
+
+
+class ProjectAccess(NamedTuple):
+    # Name of the owner's directory under MEDIA_ROOT
+    owner_dir: str
+    # True if the user owns the project or is a collaborator in it
+    is_member: bool
+
+
+def _get_django_request(request):
+    # DRF requests wrap the Django request, memoize on the wrapped one so
+    # that DRF and plain Django views share the result.
+    return getattr(request, "_request", request)
+
+
+def _resolve_project_acl(user) -> dict:
+    is_collaborator = Exists(USER.objects.filter(id=user.id, projects=OuterRef("pk")))
+    rows = (
+        Project.objects.annotate(is_collaborator=is_collaborator)
+        .filter(Q(user=user) | Q(is_collaborator=True) | Q(is_demo=True))
+        .values_list("id", "user_id", "user__email", "is_collaborator")
+    )
+    return {
+        project_id: ProjectAccess(
+            owner_dir=f"{owner_id}_{owner_email}" if owner_id else None,
+            is_member=owner_id == user.id or is_collaborator,
+        )
+        for project_id, owner_id, owner_email, is_collaborator in rows
+    }
+
+
+def get_project_acl_cache_name(user_id) -> str:
+    """
+    Name of the cache version bumped when the projects a user can see change.
+    Changes to demo projects bump the version of PROJECT_ACL_CACHE instead.
+    """
+    return f"{PROJECT_ACL_CACHE}:{user_id}"
+
+
+def invalidate_project_acls(user_ids):
+    for user_id in set(user_ids):
+        bump_cache_version(get_project_acl_cache_name(user_id))
+
+
+def get_project_acl(request) -> dict:
+    """
+    Returns {project_id: ProjectAccess} for every project the requesting user
+    can see: owned, collaborated and demo projects.
+
+    Resolved with a single query, memoized on the request and cached until
+    a project of the user, its collaborators or a demo project changes.
+    """
+    django_request = _get_django_request(request)
+    acl = getattr(django_request, "_project_acl", None)
+    if acl is not None:
+        return acl
+
+    user = request.user
+    cache_names = [PROJECT_ACL_CACHE, get_project_acl_cache_name(user.id)]
+    versions = get_cache_versions(cache_names)
+    cache_key = f"{PROJECT_ACL_CACHE}:{user.id}:" + ":".join(
+        str(versions[name]) for name in cache_names
+    )
+    acl = shared_cache_get(cache_key)
+    if acl is None:
+        with primary_if_recent(max(versions.values())):
+            acl = _resolve_project_acl(user)
+        shared_cache_set(cache_key, acl, PROJECT_ACL_CACHE_TIMEOUT)
+
+    django_request._project_acl = acl
+    return acl
+
+
+def get_accessible_project_ids(request):
+    return list(get_project_acl(request))
+
+
+def has_project_access(request, project_id, member=False) -> bool:
+    """
+    Checks whether the requesting user can see a project. With `member`,
+    demo projects the user does not own or collaborate in are excluded.
+    """
+    if request.user.is_superuser:
+        return True
+
+    try:
+        access = get_project_acl(request).get(int(project_id))
+    except (TypeError, ValueError):
+        return False
+
+    return access is not None and (access.is_member or not member)
+
+
+def _get_project_dir_id(parts):
+    # Project directories are named "<project id>_<project name>"
+    if len(parts) < 2 or "_" not in parts[1]:
+        return None
+
+    project_id = parts[1].split("_", 1)[0]
+    return int(project_id) if project_id.isdigit() else None
+
+
+def get_accessible_file_path(request, relative_path):
+    """
+    Converts a path relative to MEDIA_ROOT to an absolute path if the
+    requesting user may read it, otherwise returns None.
+
+    Users can read everything under their own directory and the directories
+    of projects they have access to.
+    """
+    media_root = os.path.realpath(settings.MEDIA_ROOT)
+    absolute_path = os.path.realpath(os.path.join(media_root, relative_path))
+    if os.path.commonpath([media_root, absolute_path]) != media_root:
+        return None
+
+    if request.user.is_superuser:
+        return absolute_path
+
+    parts = os.path.relpath(absolute_path, media_root).split(os.sep)
+    project_id = _get_project_dir_id(parts)
+    user = request.user
+    if parts[0] == f"{user.id}_{user.email}":
+        # Directories of deleted projects stay until they are reclaimed
+        if project_id is None or project_id in get_project_acl(request):
+            return absolute_path
+        return None
+
+    if project_id is None:
+        return None
+
+    access = get_project_acl(request).get(project_id)
+    if access is None or access.owner_dir != parts[0]:
+        return None
+
+    return absolute_path
@@ -0,0 +1,194 @@
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..common.metrics import STORAGE_RECLAIMED_BYTES
+from ..common.utils import get_project_dir
+from .models import Project, ProjectSNVData, ProjectVariant
+
+logger = logging.getLogger(__name__)
+
+# Claims of projects that were not refreshed for this long are taken over,
+# as the process that made them has likely stopped
+CLAIM_TIMEOUT = timedelta(minutes=10)
+CLAIM_REFRESH_SECONDS = 60
+
+
+class ProjectReclaimer:
+    """
+    Removes the directories and rows of deleted projects.
+
+    Files are unlinked one by one, sleeping whenever more than
+    `bytes_per_second` bytes or `files_per_second` files were removed on
+    average, so reclamation does not saturate shared storage. Each project
+    is claimed first, so the background thread and the
+    reclaim_deleted_projects command never reclaim the same project.
+    """
+
+    def __init__(self, bytes_per_second: int, files_per_second: int):
+        self.bytes_per_second = bytes_per_second
+        self.files_per_second = files_per_second
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = False
+
+    def schedule(self):
+        """
+        Reclaims deleted projects in a background thread once the current
+        transaction commits. At most one thread runs per process.
+        """
+        transaction.on_commit(self._start)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                self._pending = True
+                return
+
+            self._thread = threading.Thread(
+                target=self._run, name="project-reclaimer", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    self.reclaim_all()
+                except Exception as e:
+                    logger.error(f"Could not reclaim deleted projects: {e}")
+
+                with self._lock:
+                    if not self._pending:
+                        self._thread = None
+                        return
+                    self._pending = False
+        finally:
+            connections.close_all()
+
+    def reclaim_all(self, limit=None, log=logger.info):
+        """
+        Reclaims deleted projects, oldest first, and returns the number of
+        projects and bytes reclaimed.
+        """
+        projects = (
+            Project.all_objects.filter(deleted_at__isnull=False)
+            .select_related("user")
+            .order_by("deleted_at")
+        )
+        reclaimed_projects, reclaimed_bytes = 0, 0
+        for project in projects[:limit]:
+            if not self._claim(project):
+                continue
+
+            project_name = str(project)
+            try:
+                project_bytes = self.reclaim(project)
+            except Exception as e:
+                logger.error(f"Could not reclaim project {project_name}: {e}")
+                self._release_claim(project)
+                continue
+
+            log(f"Reclaimed {project_bytes} bytes of project {project_name}")
+            reclaimed_projects += 1
+            reclaimed_bytes += project_bytes
+        return reclaimed_projects, reclaimed_bytes
+
+    def reclaim(self, project) -> int:
+        reclaimed_bytes = 0
+        # Directories are named after the owner, which may have been deleted
+        if project.user is not None:
+            reclaimed_bytes = self._remove_tree(
+                get_project_dir(project), lambda: self._refresh_claim(project)
+            )
+        with transaction.atomic():
+            self._delete_variants(project)
+            project.delete()
+        STORAGE_RECLAIMED_BYTES.inc(reclaimed_bytes)
+        return reclaimed_bytes
+
+    def _claim(self, project) -> bool:
+        """
+        Claims a deleted project unless another process holds a claim on it
+        that is younger than CLAIM_TIMEOUT.
+        """
+        now = timezone.now()
+        claimed = (
+            Project.all_objects.filter(id=project.id, deleted_at__isnull=False)
+            .filter(
+                Q(reclaiming_at__isnull=True) | Q(reclaiming_at__lt=now - CLAIM_TIMEOUT)
+            )
+            .update(reclaiming_at=now)
+        )
+        return claimed == 1
+
+    def _refresh_claim(self, project):
+        Project.all_objects.filter(id=project.id).update(reclaiming_at=timezone.now())
+
+    def _release_claim(self, project):
+        Project.all_objects.filter(id=project.id).update(reclaiming_at=None)
+
+    def _delete_variants(self, project):
+        # Deleted in bulk before the project, whose cascade would load them
+        # and send the signals that mirror every ProjectSNVData row into
+        # ProjectVariant rows deleted along with it
+        for model in (ProjectSNVData, ProjectVariant):
+            rows = model.objects.filter(project=project)
+            rows._raw_delete(rows.db)
+
+    def _remove_tree(self, path, refresh_claim) -> int:
+        start = last_refresh = time.monotonic()
+        removed_bytes, removed_files = 0, 0
+        for root, dirs, files in os.walk(path, topdown=False):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    size = os.lstat(file_path).st_size
+                    os.unlink(file_path)
+                except FileNotFoundError:
+                    continue
+
+                removed_bytes += size
+                removed_files += 1
+                self._throttle(start, removed_bytes, removed_files)
+                if time.monotonic() - last_refresh > CLAIM_REFRESH_SECONDS:
+                    refresh_claim()
+                    last_refresh = time.monotonic()
+
+            for name in dirs:
+                dir_path = os.path.join(root, name)
+                try:
+                    if os.path.islink(dir_path):
+                        os.unlink(dir_path)
+                    else:
+                        os.rmdir(dir_path)
+                except FileNotFoundError:
+                    pass
+
+        try:
+            os.rmdir(path)
+        except FileNotFoundError:
+            pass
+        return removed_bytes
+
+    def _throttle(self, start, removed_bytes, removed_files):
+        expected_duration = max(
+            removed_bytes / self.bytes_per_second,
+            removed_files / self.files_per_second,
+        )
+        delay = expected_duration - (time.monotonic() - start)
+        if delay > 0:
+            time.sleep(delay)
+
+
+project_reclaimer = ProjectReclaimer(
+    bytes_per_second=settings.RECLAIM_BYTES_PER_SECOND,
+    files_per_second=settings.RECLAIM_FILES_PER_SECOND,
+)
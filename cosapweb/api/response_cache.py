@@ -0,0 +1,68 @@
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from ..common.cache import (bump_cache_version, get_cache_versions,
+                            shared_cache_get, shared_cache_set)
+from ..db_routers import primary_if_recent
+
+# Bumped for every user when projects are created in bulk, see
+# get_project_list_cache_name for the versions of single users
+PROJECT_LIST_CACHE = "project_list"
+# Superusers list every project and share one version
+ALL_PROJECTS = "all"
+
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+
+def get_project_cache_name(project_id) -> str:
+    """
+    Name of the cache version bumped when a single project changes.
+    """
+    return f"project:{project_id}"
+
+
+def get_project_list_cache_name(user_id) -> str:
+    """
+    Name of the cache version bumped when a project listed for a user, or
+    for every project with ALL_PROJECTS, changes.
+    """
+    return f"{PROJECT_LIST_CACHE}:{user_id}"
+
+
+def invalidate_project_lists(user_ids):
+    for user_id in {*user_ids, ALL_PROJECTS}:
+        bump_cache_version(get_project_list_cache_name(user_id))
+
+
+def cached_response(request, cache_names, key, build_payload):
+    """
+    Returns a response for a payload cached under the current versions of
+    `cache_names`, building it with `build_payload` on a miss.
+
+    The versions are also used for ETag and Last-Modified, so clients that
+    already have the current payload get a 304 without it being loaded.
+    """
+    versions = get_cache_versions(cache_names)
+    version = "-".join(str(versions[name]) for name in cache_names)
+    etag = f'"{key}-{version}"'
+    last_modified = max(versions.values()) // 10**9
+
+    not_modified = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if not_modified is not None:
+        return not_modified
+
+    cache_key = f"response:{key}:{version}"
+    payload = shared_cache_get(cache_key)
+    if payload is None:
+        with primary_if_recent(max(versions.values())):
+            payload = build_payload()
+        shared_cache_set(cache_key, payload, RESPONSE_CACHE_TIMEOUT)
+
+    response = Response(payload)
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Cache-Control"] = "private, no-cache"
+    return response
@@ -3,7 +3,10 @@ from django.contrib.auth import (authenticate, get_user_model,
 from rest_framework import serializers
 from rest_framework.authtoken.models import Token
 
-from cosapweb.api.models import Action, Affiliation, File, Project
+from cosapweb.api.models import (SNV, Action, Affiliation, File, Project,
+                                 ProjectVariant)
+from cosapweb.api.permissions import has_project_access
+from cosapweb.api.storage import get_user_storage
 
 USER = get_user_model()
 
@@ -17,6 +20,7 @@ class AffiliationSerializer(serializers.ModelSerializer):
 class UserSerializer(serializers.ModelSerializer):
     # TODO: A user should be allowed to remove or add a relationship to an org.
     affiliations = AffiliationSerializer(many=True, read_only=True)
+    storage = serializers.SerializerMethodField()
 
     class Meta:
         model = USER
@@ -28,9 +32,13 @@ class UserSerializer(serializers.ModelSerializer):
             "last_login",
             "date_joined",
             "affiliations",
+            "storage",
         ]
         read_only_fields = ["last_login", "date_joined"]
 
+    def get_storage(self, user):
+        return get_user_storage(user)
+
 
 class RegistrationSerializer(serializers.ModelSerializer):
     """
@@ -88,11 +96,9 @@ class FileSerializer(serializers.ModelSerializer):
 
     def validate(self, attrs):
         # Users can add samples only to projects they have access to
-        user = self.context.get("request").user
+        request = self.context.get("request")
         project = attrs["project"]
-        if project.user != user and project not in Project.objects.filter(
-            collaborators=user
-        ):
+        if not has_project_access(request, project.id, member=True):
             raise serializers.ValidationError(
                 {"project": "You don't have access to this project!"}
             )
@@ -100,6 +106,21 @@ class FileSerializer(serializers.ModelSerializer):
         return attrs
 
 
+class FileCatalogSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = File
+        fields = [
+            "id",
+            "uuid",
+            "name",
+            "file_type",
+            "sample_type",
+            "uploaded_at",
+            "is_demo",
+        ]
+        read_only_fields = fields
+
+
 class ProjectSerializer(serializers.ModelSerializer):
     user = serializers.SlugRelatedField(slug_field="email", read_only=True)
     collaborators = serializers.SlugRelatedField(
@@ -146,3 +167,42 @@ class ActionSerializer(serializers.ModelSerializer):
         model = Action
         fields = ["id", "associated_user", "action_type", "action_detail", "created_at"]
         read_only_fields = ["associated_user", "action_type", "created_at"]
+
+
+class SNVSearchSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SNV
+        fields = [
+            "id",
+            "location",
+            "chromosome",
+            "position",
+            "ref",
+            "alt",
+            "gene_symbol",
+            "aa_change",
+            "hgvsc",
+            "consequence",
+            "classification",
+            "rs_id",
+            "cosmic_id",
+        ]
+        read_only_fields = fields
+
+
+class ProjectVariantSearchSerializer(serializers.ModelSerializer):
+    project_name = serializers.CharField(source="project.name", read_only=True)
+    snv = SNVSearchSerializer(read_only=True)
+
+    class Meta:
+        model = ProjectVariant
+        fields = [
+            "project",
+            "project_name",
+            "snv",
+            "allele_frequency",
+            "depth",
+            "caller",
+            "filter",
+        ]
+        read_only_fields = fields
@@ -3,13 +3,41 @@ import shutil
 from pathlib import PurePosixPath
 
 from django.conf import settings
-from django.db.models.signals import post_delete, post_save
+from django.db import connections, transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_migrate, pre_save)
+from django.db.models import Q
 from django.dispatch import receiver
 from django_drf_filepond.models import TemporaryUpload, TemporaryUploadChunked
 from rest_framework.authtoken.models import Token
 
+from ..authentication import invalidate_token
+from ..common.cache import bump_cache_version
 from ..common.utils import get_project_dir, get_user_files_dir
-from .models import Action, File, Project, Report
+from .action_log import action_log
+from .demo_cache import DEMO_CACHE, get_demo_file_ids, get_demo_project_ids
+from .models import (SNV, File, Project, ProjectSNVData, ProjectSNVs,
+                     ProjectSummary, ProjectVariant, Report)
+from .permissions import PROJECT_ACL_CACHE, invalidate_project_acls
+from .response_cache import get_project_cache_name, invalidate_project_lists
+from .storage import add_user_files_usage, reconcile_project_usage
+from .variants import (FINISHED_STATUSES, add_legacy_project_snvs,
+                       invalidate_variant_aggregates, parse_location,
+                       set_legacy_allele_frequency)
+
+
+@receiver(pre_migrate)
+def create_trigram_extension(sender, using, **kwargs):
+    """
+    Creates the pg_trgm extension needed by the trigram index on file names
+    before the migrations of the app run.
+    """
+    connection = connections[using]
+    if sender.name != "cosapweb.api" or connection.vendor != "postgresql":
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -21,6 +49,326 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
         Token.objects.create(user=instance)
 
 
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_tokens(sender, instance=None, created=False, **kwargs):
+    """
+    Drops cached tokens of a user when the user changes, so password
+    changes and deactivations take effect immediately.
+    """
+    if created:
+        return
+
+    for key in Token.objects.filter(user=instance).values_list("key", flat=True):
+        invalidate_token(key)
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+@receiver(pre_save, sender=Project)
+def track_project_changes(sender, instance, **kwargs):
+    """
+    Records the previous values of the tracked fields that changed in
+    `_changed_fields`, for the receivers of post_save. Previous values that
+    were not loaded are None.
+    """
+    deferred = instance.get_deferred_fields()
+    loaded = {} if instance._state.adding else getattr(instance, "_loaded_values", {})
+    instance._changed_fields = {
+        name: loaded.get(name)
+        for name in Project.TRACKED_FIELDS
+        if name not in deferred
+        and (name not in loaded or loaded[name] != getattr(instance, name))
+    }
+    instance._loaded_values = {
+        name: getattr(instance, name)
+        for name in Project.TRACKED_FIELDS
+        if name not in deferred
+    }
+
+
+def _get_member_ids(project, previous_owner_id=None):
+    member_ids = set(project.collaborators.values_list("id", flat=True))
+    return member_ids | {project.user_id, previous_owner_id} - {None}
+
+
+@receiver(pre_delete, sender=Project)
+def collect_project_members(sender, instance, **kwargs):
+    # Collaborators are deleted with the project, before post_delete
+    instance._member_ids = _get_member_ids(instance)
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_project_acl(sender, instance, **kwargs):
+    """
+    Invalidates the cached project access lists of the owner and the
+    collaborators of a project when it is created, deleted, changes owner
+    or is soft deleted, and of every user when demo projects change.
+    """
+    if kwargs["signal"] is post_delete:
+        member_ids, was_demo = instance._member_ids, False
+    else:
+        changed_fields = instance._changed_fields
+        if not {"user_id", "is_demo", "deleted_at"} & changed_fields.keys():
+            return
+        member_ids = _get_member_ids(instance, changed_fields.get("user_id"))
+        was_demo = changed_fields.get("is_demo")
+
+    if instance.is_demo or was_demo:
+        bump_cache_version(PROJECT_ACL_CACHE)
+    invalidate_project_acls(member_ids)
+
+
+@receiver(m2m_changed, sender=Project.collaborators.through)
+def collect_cleared_collaborators(sender, instance, action, reverse, **kwargs):
+    # Collaborators removed by clear() are not passed to post_clear
+    if action != "pre_clear":
+        return
+
+    if reverse:
+        instance._cleared_project_ids = set(
+            instance.projects.values_list("id", flat=True)
+        )
+    else:
+        instance._cleared_collaborator_ids = set(
+            instance.collaborators.values_list("id", flat=True)
+        )
+
+
+@receiver(m2m_changed, sender=Project.collaborators.through)
+def invalidate_collaborator_acl(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Invalidates the cached project access lists of added and removed
+    collaborators.
+    """
+    if not action.startswith("post_"):
+        return
+
+    if reverse:
+        # Projects were added to or removed from the user
+        user_ids = {instance.id}
+    elif action == "post_clear":
+        user_ids = instance._cleared_collaborator_ids
+    else:
+        user_ids = pk_set
+    invalidate_project_acls(user_ids)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_owner_acl(sender, instance, created, update_fields, **kwargs):
+    """
+    Invalidates the cached project access lists that include the email of
+    a user, which is part of the directories of their projects.
+    """
+    if created or (update_fields and "email" not in update_fields):
+        return
+
+    projects = Project.objects.filter(user=instance)
+    member_ids = set(
+        projects.filter(collaborators__isnull=False).values_list(
+            "collaborators", flat=True
+        )
+    )
+    if projects.filter(is_demo=True).exists():
+        bump_cache_version(PROJECT_ACL_CACHE)
+    invalidate_project_acls(member_ids | {instance.id})
+
+
+def _get_project_member_ids(project_ids) -> set:
+    owner_ids = Project.all_objects.filter(id__in=project_ids).values_list(
+        "user_id", flat=True
+    )
+    collaborator_ids = Project.collaborators.through.objects.filter(
+        project_id__in=project_ids
+    ).values_list("customuser_id", flat=True)
+    return {*owner_ids, *collaborator_ids} - {None}
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_project_list_responses(sender, instance, **kwargs):
+    """
+    Invalidates the cached project lists of the owner and the collaborators
+    of a changed project.
+    """
+    if kwargs["signal"] is post_delete:
+        member_ids = instance._member_ids
+    else:
+        member_ids = _get_member_ids(instance, instance._changed_fields.get("user_id"))
+    invalidate_project_lists(member_ids)
+
+
+@receiver(m2m_changed, sender=Project.collaborators.through)
+def invalidate_collaborator_project_lists(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """
+    Invalidates the cached project lists of the members of projects whose
+    collaborators changed, including the removed collaborators.
+    """
+    if not action.startswith("post_"):
+        return
+
+    if reverse:
+        project_ids = instance._cleared_project_ids if pk_set is None else pk_set
+        user_ids = {instance.id}
+    else:
+        project_ids = [instance.id]
+        user_ids = instance._cleared_collaborator_ids if pk_set is None else pk_set
+    invalidate_project_lists(_get_project_member_ids(project_ids) | set(user_ids))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_member_project_lists(sender, instance, created, update_fields, **kwargs):
+    """
+    Invalidates the cached project lists that show the email of a user.
+    """
+    if created or (update_fields and "email" not in update_fields):
+        return
+
+    project_ids = Project.objects.filter(
+        Q(user=instance) | Q(collaborators=instance)
+    ).values_list("id", flat=True)
+    invalidate_project_lists(_get_project_member_ids(project_ids) | {instance.id})
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(m2m_changed, sender=Project.collaborators.through)
+@receiver(post_save, sender=ProjectSummary)
+@receiver(post_delete, sender=ProjectSummary)
+def invalidate_project_detail_responses(sender, instance, **kwargs):
+    """
+    Invalidates the cached detail response of the changed project.
+    """
+    if not kwargs.get("action", "post_").startswith("post_"):
+        return
+
+    if isinstance(instance, Project):
+        project_ids = [instance.id]
+    elif isinstance(instance, ProjectSummary):
+        project_ids = [instance.project_id]
+    else:
+        # Collaborators were changed from the user side of the relation
+        project_ids = kwargs.get("pk_set") or []
+
+    for project_id in project_ids:
+        bump_cache_version(get_project_cache_name(project_id))
+
+
+@receiver(m2m_changed, sender=ProjectSNVs.snvs.through)
+def mirror_project_snvs(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Mirrors variants linked through ProjectSNVs into ProjectVariant. Runs
+    before the demo content is invalidated.
+    """
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+
+    if reverse:
+        # The SNV was linked to or unlinked from ProjectSNVs
+        project_snvs = ProjectSNVs.objects.filter(snvs=instance)
+        if pk_set is not None:
+            project_snvs = ProjectSNVs.objects.filter(id__in=pk_set)
+        links = {
+            project_id: [instance.id]
+            for project_id in project_snvs.values_list("project_id", flat=True)
+        }
+    else:
+        links = {instance.project_id: pk_set}
+
+    for project_id, snv_ids in links.items():
+        if project_id is None:
+            continue
+        if action == "post_add":
+            add_legacy_project_snvs(project_id, snv_ids)
+        elif action in ("post_remove", "pre_clear"):
+            variants = ProjectVariant.objects.filter(project_id=project_id)
+            if snv_ids is not None:
+                variants = variants.filter(snv_id__in=snv_ids)
+            variants.delete()
+            invalidate_variant_aggregates([project_id])
+
+
+@receiver(post_save, sender=ProjectSNVData)
+@receiver(post_delete, sender=ProjectSNVData)
+def mirror_project_snv_data(sender, instance, **kwargs):
+    """
+    Mirrors allele frequencies recorded in ProjectSNVData into ProjectVariant.
+    """
+    allele_frequency = instance.allele_frequency
+    if kwargs["signal"] is post_delete:
+        allele_frequency = None
+    set_legacy_allele_frequency(
+        instance.project_id, instance.snv_id, allele_frequency
+    )
+
+
+@receiver(pre_save, sender=SNV)
+def set_snv_position(sender, instance, **kwargs):
+    """
+    Parses the chromosome and position of an SNV from its location.
+    """
+    chromosome, instance.position = parse_location(instance.location)
+    instance.chromosome = chromosome or ""
+
+
+@receiver(post_save, sender=SNV)
+def invalidate_snv_variant_aggregates(sender, instance, created, **kwargs):
+    """
+    Drops the variant aggregates of the projects of a changed SNV.
+    """
+    if not created:
+        invalidate_variant_aggregates(
+            ProjectVariant.objects.filter(snv=instance).values_list(
+                "project_id", flat=True
+            )
+        )
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+@receiver(post_save, sender=ProjectSNVData)
+@receiver(post_delete, sender=ProjectSNVData)
+@receiver(m2m_changed, sender=ProjectSNVs.snvs.through)
+@receiver(post_save, sender=SNV)
+def invalidate_demo_content(sender, instance, **kwargs):
+    """
+    Rebuilds the shared demo payloads when demo projects, demo files or
+    the variants of demo projects change.
+    """
+    if not kwargs.get("action", "post_").startswith("post_"):
+        return
+
+    if isinstance(instance, Project):
+        # Demo project ids that are not cached are read after the change
+        was_demo = getattr(instance, "_changed_fields", {}).get("is_demo")
+        is_demo_content = (
+            instance.is_demo or was_demo or instance.id in get_demo_project_ids()
+        )
+    elif isinstance(instance, File):
+        is_demo_content = instance.is_demo or instance.id in get_demo_file_ids()
+    elif isinstance(instance, ProjectSNVData):
+        is_demo_content = instance.project_id in get_demo_project_ids()
+    elif isinstance(instance, ProjectSNVs):
+        is_demo_content = instance.project_id in get_demo_project_ids()
+    elif kwargs.get("created"):
+        # New SNVs are not part of any project yet
+        is_demo_content = False
+    else:
+        is_demo_content = ProjectSNVs.objects.filter(
+            project__is_demo=True, snvs=instance
+        ).exists()
+
+    if is_demo_content:
+        bump_cache_version(DEMO_CACHE)
+
+
 @receiver(post_delete, sender=File)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
     """
@@ -29,7 +377,23 @@ def auto_delete_file_on_delete(sender, instance, **kwargs):
     """
     if instance.file:
         if os.path.isfile(instance.file.path):
+            size = os.path.getsize(instance.file.path)
             os.remove(instance.file.path)
+            add_user_files_usage(instance.user, -size, -1)
+
+
+@receiver(post_save, sender=Project)
+def reconcile_finished_project_usage(sender, instance, **kwargs):
+    """
+    Records the disk usage of a project directory when its pipeline
+    finishes, as the workers write its outputs outside of this app.
+    """
+    if (
+        "status" in instance._changed_fields
+        and instance.status in FINISHED_STATUSES
+        and instance.deleted_at is None
+    ):
+        transaction.on_commit(lambda: reconcile_project_usage(instance))
 
 
 @receiver(post_delete, sender=Project)
@@ -38,6 +402,11 @@ def auto_delete_project_dir_on_delete(sender, instance, **kwargs):
     Deletes project directory from filesystem
     when corresponding `Project` object is deleted.
     """
+    # Directories of deleted projects are removed by cosapweb.api.reclaimer
+    # at a bounded rate before their rows
+    if instance.deleted_at is not None:
+        return
+
     project_dir = get_project_dir(instance)
     if os.path.isdir(project_dir):
         shutil.rmtree(project_dir)
@@ -99,12 +468,11 @@ def auto_create_action(sender, instance, created, **kwargs):
     elif isinstance(instance, Report):
         action_type = "RC"
 
-    action_obj = Action.objects.create(
+    action_log.log(
         associated_user=instance.user,
         action_type=action_type,
         action_detail=instance.__str__(),
     )
-    action_obj.save()
 
 
 @receiver(post_delete, sender=TemporaryUploadChunked)
@@ -123,6 +491,7 @@ def save_tmp_upload(sender, instance, **kwargs):
         get_user_files_dir(fl.user), f"{fl.id}_{upload_file_name}"
     )
     shutil.move(tu.get_file_path(), permanent_file_path)
+    add_user_files_usage(fl.user, os.path.getsize(permanent_file_path), 1)
 
     fl.name = upload_file_name
     fl.file = permanent_file_path
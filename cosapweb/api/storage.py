@@ -0,0 +1,129 @@
+import os
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from ..common.utils import get_directory_usage, get_project_dir, get_user_dir
+from .models import Project, StorageUsage
+
+
+def _add_usage(user_id, project_id, bytes_delta, files_delta):
+    if user_id is None or (bytes_delta == 0 and files_delta == 0):
+        return
+
+    usage = StorageUsage.objects.filter(user_id=user_id, project_id=project_id)
+    changes = {
+        "bytes_used": F("bytes_used") + bytes_delta,
+        "file_count": F("file_count") + files_delta,
+    }
+    if usage.update(**changes):
+        return
+
+    try:
+        with transaction.atomic():
+            StorageUsage.objects.create(
+                user_id=user_id,
+                project_id=project_id,
+                bytes_used=bytes_delta,
+                file_count=files_delta,
+            )
+    except IntegrityError:
+        # Created concurrently by another request
+        usage.update(**changes)
+
+
+def add_user_files_usage(user, bytes_delta, files_delta=0):
+    """
+    Records a change of the size of the uploaded files of a user.
+    """
+    _add_usage(getattr(user, "id", None), None, bytes_delta, files_delta)
+
+
+def add_project_usage(project, bytes_delta, files_delta=0):
+    """
+    Records a change of the size of a project directory.
+    """
+    _add_usage(project.user_id, project.id, bytes_delta, files_delta)
+
+
+def annotate_user_storage(users):
+    """
+    Adds the totals of `get_user_storage` to a queryset of users, so lists
+    of users do not query them one by one.
+    """
+    return users.annotate(
+        storage_bytes_used=Sum("storage_usage__bytes_used"),
+        storage_file_count=Sum("storage_usage__file_count"),
+    )
+
+
+def get_user_storage(user) -> dict:
+    """
+    Returns the disk usage of a user's uploads and projects with their quota.
+    """
+    if hasattr(user, "storage_bytes_used"):
+        usage = {
+            "bytes_used": user.storage_bytes_used,
+            "file_count": user.storage_file_count,
+        }
+    else:
+        usage = StorageUsage.objects.filter(user=user).aggregate(
+            bytes_used=Sum("bytes_used"), file_count=Sum("file_count")
+        )
+    return {
+        "bytes_used": usage["bytes_used"] or 0,
+        "file_count": usage["file_count"] or 0,
+        "quota_bytes": settings.STORAGE_QUOTA_BYTES,
+    }
+
+
+def get_project_storage(project) -> dict:
+    usage = (
+        StorageUsage.objects.filter(project=project)
+        .values("bytes_used", "file_count", "reconciled_at")
+        .first()
+    )
+    return usage or {"bytes_used": 0, "file_count": 0, "reconciled_at": None}
+
+
+def exceeds_quota(user, additional_bytes) -> bool:
+    quota = settings.STORAGE_QUOTA_BYTES
+    if quota is None:
+        return False
+    return get_user_storage(user)["bytes_used"] + additional_bytes > quota
+
+
+def _set_usage(user_id, project_id, path):
+    bytes_used, file_count = get_directory_usage(path)
+    usage, _ = StorageUsage.objects.update_or_create(
+        user_id=user_id,
+        project_id=project_id,
+        defaults={
+            "bytes_used": bytes_used,
+            "file_count": file_count,
+            "reconciled_at": timezone.now(),
+        },
+    )
+    return usage
+
+
+def reconcile_project_usage(project) -> StorageUsage:
+    """
+    Replaces the recorded usage of a project with a scan of its directory.
+    """
+    return _set_usage(project.user_id, project.id, get_project_dir(project))
+
+
+def reconcile_user_usage(user) -> int:
+    """
+    Replaces the recorded usage of a user's uploads and projects with scans
+    of their directories and returns how many bytes the records were off.
+    Changes made while the directories are scanned may be missed.
+    """
+    recorded = get_user_storage(user)["bytes_used"]
+    _set_usage(user.id, None, os.path.join(get_user_dir(user), "files"))
+    for project in Project.all_objects.filter(user=user).select_related("user"):
+        reconcile_project_usage(project)
+    return get_user_storage(user)["bytes_used"] - recorded
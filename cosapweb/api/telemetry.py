@@ -0,0 +1,103 @@
+from collections import defaultdict
+from statistics import median
+
+from .models import ProjectTask, TaskStageMetric
+from .storage import add_project_usage
+
+# Number of most recent comparable runs used for an estimate
+ESTIMATE_HISTORY_SIZE = 50
+
+
+def get_files_size(files) -> int:
+    """
+    Returns the total size in bytes of the given `File` objects.
+    Files that are missing on the filesystem are counted as empty.
+    """
+    total_size = 0
+    for file in files:
+        try:
+            total_size += file.file.size
+        except (OSError, ValueError):
+            continue
+    return total_size
+
+
+def record_stage_metric(
+    project_task, stage, wall_time, cpu_time=None, output_size=0
+) -> TaskStageMetric:
+    """
+    Records resource usage of a finished pipeline stage.
+    A stage reported twice for the same task overwrites the previous record.
+    The output size is also added to the storage usage of the project.
+    """
+    previous_output_size = (
+        TaskStageMetric.objects.filter(project_task=project_task, stage=stage)
+        .values_list("output_size", flat=True)
+        .first()
+    )
+    metric, _ = TaskStageMetric.objects.update_or_create(
+        project_task=project_task,
+        stage=stage,
+        defaults={
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "output_size": output_size,
+        },
+    )
+    add_project_usage(project_task.project, output_size - (previous_output_size or 0))
+    return metric
+
+
+def _get_comparable_tasks(project_type, algorithms):
+    tasks = ProjectTask.objects.filter(
+        project__project_type=project_type,
+        input_size__gt=0,
+        stage_metrics__isnull=False,
+    ).distinct()
+
+    same_algorithms = tasks.filter(project__algorithms=algorithms)
+    if same_algorithms.exists():
+        return same_algorithms, "project_type_and_algorithms"
+    return tasks, "project_type"
+
+
+def estimate_project_resources(project_type, algorithms, input_size) -> dict:
+    """
+    Predicts wall time and output size of a project from past runs.
+
+    Every past run is reduced to seconds and output bytes per input byte for
+    each stage, and the median of these rates is scaled by `input_size`.
+    Runs with the same project type and algorithms are preferred; if there is
+    none, runs with the same project type are used instead.
+    """
+    tasks, basis = _get_comparable_tasks(project_type, algorithms)
+    task_ids = list(
+        tasks.order_by("-id").values_list("id", flat=True)[:ESTIMATE_HISTORY_SIZE]
+    )
+
+    time_rates = defaultdict(list)
+    size_rates = defaultdict(list)
+    metrics = TaskStageMetric.objects.filter(project_task_id__in=task_ids).values(
+        "stage", "wall_time", "output_size", "project_task__input_size"
+    )
+    for metric in metrics:
+        task_input_size = metric["project_task__input_size"]
+        time_rates[metric["stage"]].append(metric["wall_time"] / task_input_size)
+        size_rates[metric["stage"]].append(metric["output_size"] / task_input_size)
+
+    stages = {
+        stage: {
+            "duration": median(time_rates[stage]) * input_size,
+            "output_size": int(median(size_rates[stage]) * input_size),
+        }
+        for stage in time_rates
+    }
+
+    return {
+        "input_size": input_size,
+        "duration": sum(stage["duration"] for stage in stages.values()),
+        "output_size": sum(stage["output_size"] for stage in stages.values()),
+        "stages": stages,
+        "based_on": basis if task_ids else None,
+        "sample_count": len(task_ids),
+    }
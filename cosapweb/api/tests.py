@@ -1,3 +1,1718 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import (AsyncClient, RequestFactory, SimpleTestCase,
+                         TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from ..authentication import _local_token_cache, get_token
+from ..common.cache import bump_cache_version, get_cache_version
+from ..common.utils import get_project_dir, get_user_dir
+from .benchmark_data import generate_benchmark_data, get_benchmark_users
+from .demo_cache import (DEMO_CACHE, get_demo_files, get_demo_project_entries,
+                         get_demo_project_ids, get_demo_variants)
+from .management.commands.bench_startup import STARTUP_BUDGET_MS
+from .models import (SNV, USER, Action, File, Project, ProjectSNVData,
+                     ProjectSNVs, ProjectTask, ProjectVariant,
+                     ProjectVariantAggregate, TaskStageMetric)
+from . import tiering
+from .action_log import ActionLogWriter
+from .permissions import (get_accessible_file_path, get_project_acl,
+                          has_project_access, invalidate_project_acls)
+from .reclaimer import CLAIM_TIMEOUT, ProjectReclaimer
+from .storage import annotate_user_storage, get_user_storage
+from .variants import (get_variant_cache_name, get_variant_facets,
+                       ingest_project_variants)
+
+# Data of a TestCase is only visible to the default connection, so tests
+# that do not check replica routing read from the primary
+primary_reads = override_settings(DATABASE_ROUTERS=[])
+
+
+@primary_reads
+class ScaledDataTestCase(TestCase):
+    """
+    Runs tests against a scaled down benchmark data set, with a client
+    authenticated as one of its users.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root)
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_benchmark_data(
+            users=20,
+            projects_per_user=3,
+            files_per_user=6,
+            snvs=2000,
+            variants_per_project=50,
+            project_dirs=0,
+            log=lambda message: None,
+        )
+        cls.user = get_benchmark_users().order_by("id").first()
+        cls.project = Project.objects.filter(user=cls.user).order_by("id").first()
+        Action.objects.bulk_create(
+            [
+                Action(
+                    associated_user=user,
+                    action_type=Action.PROJECT_CREATION,
+                    action_detail=f"project {i}",
+                )
+                for user in get_benchmark_users()
+                for i in range(30)
+            ]
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient(HTTP_HOST="localhost")
+        self.client.force_authenticate(self.user)
+
+    def get_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [query["sql"] for query in queries]
+
+
+class QueryCountTests(ScaledDataTestCase):
+    """
+    Checks that the number of queries of hot endpoints does not grow with
+    the number of projects, files, collaborators and variants.
+    """
+
+    def test_project_list(self):
+        # Project ACL, user projects, their collaborators and demo projects
+        with self.assertNumQueries(4):
+            response = self.client.get("/projects/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_project_detail(self):
+        # Project ACL, project, collaborators and summary
+        with self.assertNumQueries(4):
+            response = self.client.get(f"/projects/{self.project.id}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_file_list(self):
+        # User files and demo files
+        with self.assertNumQueries(2):
+            response = self.client.get("/files/?sample_type=tumor")
+        self.assertEqual(response.status_code, 200)
+
+    def test_actions(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/actions/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_user_list(self):
+        # Users with their storage totals, and their affiliations
+        admin = USER.objects.create_user(email="admin@example.com", is_staff=True)
+        self.client.force_authenticate(admin)
+        with self.assertNumQueries(2):
+            response = self.client.get("/users/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_project_variants(self):
+        # Project ACL, demo projects, project and variants
+        with self.assertNumQueries(4):
+            response = self.client.get(f"/variants/{self.project.id}/")
+        self.assertEqual(response.status_code, 200)
+
+
+class IndexUsageTests(ScaledDataTestCase):
+    """
+    Checks the query plans of hot endpoints for the indexes they rely on.
+    """
+
+    def explain(self, sql) -> str:
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # Small test tables are cheaper to scan than to search
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {sql}")
+            else:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return "\n".join(str(row[-1]) for row in cursor.fetchall())
+
+    def get_plans(self, path, table) -> list:
+        return [
+            self.explain(sql)
+            for sql in self.get_queries(path)
+            if f'FROM "{table}"' in sql
+        ]
+
+    def is_full_scan(self, plan, table) -> bool:
+        if connection.vendor == "postgresql":
+            return f"Seq Scan on {table}" in plan
+        return any(
+            line.strip().startswith(f"SCAN {table}") for line in plan.splitlines()
+        )
+
+    def assertUsesIndex(self, path, table, index):
+        plans = self.get_plans(path, table)
+        self.assertTrue(plans, f"{path} does not query {table}")
+        self.assertTrue(
+            any(index in plan for plan in plans),
+            f"{path} does not use {index}:\n" + "\n".join(plans),
+        )
+
+    def assertNoFullScan(self, path, table):
+        plans = self.get_plans(path, table)
+        self.assertTrue(plans, f"{path} does not query {table}")
+        for plan in plans:
+            self.assertFalse(
+                self.is_full_scan(plan, table), f"{path} scans {table}:\n{plan}"
+            )
+
+    def test_file_list_by_sample_type(self):
+        self.assertUsesIndex(
+            "/files/?sample_type=tumor", "api_file", "file_user_sample_type_idx"
+        )
+
+    def test_file_list_by_file_type(self):
+        self.assertUsesIndex(
+            "/files/?file_type=fq", "api_file", "file_user_file_type_idx"
+        )
+
+    def test_actions(self):
+        self.assertUsesIndex("/actions/", "api_action", "action_user_feed_idx")
+
+    def test_project_variants(self):
+        # Searched by the unique constraint on project and SNV, whose index
+        # is not named after it on SQLite
+        self.assertNoFullScan(f"/variants/{self.project.id}/", "api_projectvariant")
+
+    def test_project_detail(self):
+        self.assertNoFullScan(f"/projects/{self.project.id}/", "api_projectsummary")
+
+    # SQLite does not use indexes for the bare boolean in `user OR is_demo`
+    @skipUnless(connection.vendor == "postgresql", "Needs PostgreSQL indexes")
+    def test_file_catalog(self):
+        self.assertNoFullScan("/files/catalog/", "api_file")
+        self.assertNoFullScan("/files/catalog/?file_type=fq", "api_file")
+
+    @skipUnless(connection.vendor == "postgresql", "Needs PostgreSQL indexes")
+    def test_file_catalog_search(self):
+        self.assertUsesIndex(
+            "/files/catalog/?search=tumor_1", "api_file", "file_name_prefix_idx"
+        )
+        self.assertUsesIndex(
+            "/files/catalog/?search=tumr_1&search_mode=fuzzy",
+            "api_file",
+            "file_name_trgm_idx",
+        )
+
+
+@primary_reads
+class ProjectResponseCacheTests(TestCase):
+    """
+    Checks conditional requests to the cached project list and detail, and
+    that changes only invalidate the lists of the users who see them.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.owner = USER.objects.create_user(email="owner@example.com")
+        self.collaborator = USER.objects.create_user(email="collaborator@example.com")
+        self.other = USER.objects.create_user(email="other@example.com")
+        self.project = Project.objects.create(
+            user=self.owner,
+            name="project",
+            project_type=Project.SOMATIC,
+            status=Project.IN_PROGRESS,
+        )
+        self.project.collaborators.add(self.collaborator)
+
+    def get(self, user, path, **headers):
+        client = APIClient(HTTP_HOST="localhost")
+        client.force_authenticate(user)
+        return client.get(path, **headers)
+
+    def get_list_etags(self) -> list:
+        return [
+            self.get(user, "/projects/")["ETag"]
+            for user in (self.owner, self.collaborator, self.other)
+        ]
+
+    def test_project_list_not_modified(self):
+        response = self.get(self.owner, "/projects/")
+        self.assertEqual(response.status_code, 200)
+
+        response = self.get(
+            self.owner, "/projects/", HTTP_IF_NONE_MATCH=response["ETag"]
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_project_detail_not_modified(self):
+        path = f"/projects/{self.project.id}/"
+        etag = self.get(self.owner, path)["ETag"]
+        response = self.get(self.collaborator, path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.project.status = Project.COMPLETED
+        self.project.save()
+        response = self.get(self.owner, path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["metadata"]["status"], Project.COMPLETED)
+
+    def test_project_change_invalidates_member_lists(self):
+        owner_etag, collaborator_etag, other_etag = self.get_list_etags()
+        self.project.progress = 50
+        self.project.save()
+
+        etags = self.get_list_etags()
+        self.assertNotEqual(etags[0], owner_etag)
+        self.assertNotEqual(etags[1], collaborator_etag)
+        self.assertEqual(etags[2], other_etag)
+        self.assertEqual(self.get(self.owner, "/projects/").data[0]["progress"], 50)
+
+    def test_added_collaborator_list_is_invalidated(self):
+        self.assertEqual(self.get(self.other, "/projects/").data, [])
+        self.project.collaborators.add(self.other)
+
+        projects = self.get(self.other, "/projects/").data
+        self.assertEqual([project["id"] for project in projects], [self.project.id])
+
+    def test_removed_collaborator_list_is_invalidated(self):
+        self.assertEqual(len(self.get(self.collaborator, "/projects/").data), 1)
+        self.project.collaborators.clear()
+        self.assertEqual(self.get(self.collaborator, "/projects/").data, [])
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Checks that reads of replica endpoints go to the replica, and to the
+    primary after the user writes.
+    """
+
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        self.user = USER.objects.create_user(email="user@example.com")
+        Action.objects.create(
+            associated_user=self.user,
+            action_type=Action.PROJECT_CREATION,
+            action_detail="project",
+        )
+        self.client = APIClient(HTTP_HOST="localhost")
+        self.client.force_authenticate(self.user)
+
+    def get_action_databases(self) -> set:
+        databases = set()
+        for alias in self.databases:
+            with CaptureQueriesContext(connections[alias]) as queries:
+                response = self.client.get("/actions/")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["results"]), 1)
+            if any('FROM "api_action"' in query["sql"] for query in queries):
+                databases.add(alias)
+        return databases
+
+    def test_reads_use_replica(self):
+        self.assertEqual(self.get_action_databases(), {"replica"})
+
+    def test_reads_after_write_use_primary(self):
+        action = Action.objects.create(
+            associated_user=self.user,
+            action_type=Action.FILE_UPLOAD,
+            action_detail="file",
+        )
+        response = self.client.delete(f"/actions/{action.id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_action_databases(), {"default"})
+
+
+class StorageUsageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = USER.objects.create_user(email="user@example.com")
+        self.project = Project.objects.create(
+            user=self.user,
+            name="project",
+            project_type=Project.SOMATIC,
+            status=Project.IN_PROGRESS,
+        )
+        project_dir = get_project_dir(self.project)
+        os.makedirs(project_dir, exist_ok=True)
+        with open(os.path.join(project_dir, "output.vcf"), "wb") as f:
+            f.write(b"0" * 100)
+
+    def test_finished_project_usage_is_reconciled(self):
+        self.assertEqual(get_user_storage(self.user)["bytes_used"], 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.project.status = Project.COMPLETED
+            self.project.save()
+        self.assertEqual(get_user_storage(self.user)["bytes_used"], 100)
+
+        user = annotate_user_storage(USER.objects.filter(id=self.user.id)).get()
+        self.assertEqual(get_user_storage(user)["bytes_used"], 100)
+
+
+@primary_reads
+class TokenCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _local_token_cache.clear()
+        self.user = USER.objects.create_user(email="user@example.com")
+        self.key = Token.objects.get(user=self.user).key
+
+    def get(self, key, keyword="Token"):
+        client = APIClient(HTTP_HOST="localhost")
+        client.credentials(HTTP_AUTHORIZATION=f"{keyword} {key}")
+        return client.get("/projects/")
+
+    def warm_caches(self):
+        # Leaves a stale entry in the local cache, like the one another
+        # process would still hold after the change below
+        self.assertEqual(self.get(self.key).status_code, 200)
+        self.addCleanup(_local_token_cache.clear)
+        return _local_token_cache.get(self.key)
+
+    def assertRejected(self, key, stale):
+        _local_token_cache.set(key, stale)
+        for keyword in ("Token", "Bearer"):
+            with self.subTest(keyword=keyword):
+                self.assertEqual(self.get(key, keyword).status_code, 401)
+
+    def test_tokens_are_served_from_both_tiers(self):
+        self.assertEqual(get_token(self.key).user, self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_token(self.key).user, self.user)
+
+            _local_token_cache.clear()
+            self.assertEqual(get_token(self.key).user, self.user)
+
+        self.assertIsNone(get_token("unknown"))
+
+    def test_deleted_tokens_are_rejected_at_once(self):
+        stale = self.warm_caches()
+        Token.objects.filter(key=self.key).delete()
+        self.assertRejected(self.key, stale)
+        self.assertIsNone(get_token(self.key))
+
+    def test_deactivated_users_are_rejected_at_once(self):
+        stale = self.warm_caches()
+        self.user.is_active = False
+        self.user.save()
+        self.assertRejected(self.key, stale)
+
+    def test_rotated_keys_are_honoured_at_once(self):
+        stale = self.warm_caches()
+        Token.objects.filter(user=self.user).delete()
+        new_key = Token.objects.create(user=self.user).key
+        self.assertRejected(self.key, stale)
+        self.assertEqual(self.get(new_key, "Bearer").status_code, 200)
+
+
+@primary_reads
+class ProjectAclTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.owner = USER.objects.create_user(email="owner@example.com")
+        self.collaborator = USER.objects.create_user(email="collaborator@example.com")
+        self.stranger = USER.objects.create_user(email="stranger@example.com")
+        self.project = Project.objects.create(
+            user=self.owner, name="project", project_type=Project.SOMATIC
+        )
+        self.project.collaborators.add(self.collaborator)
+        self.demo = Project.objects.create(
+            user=self.owner, name="demo", project_type=Project.SOMATIC, is_demo=True
+        )
+
+        self.project_file = self.create_file(
+            os.path.join(get_project_dir(self.project), "output.vcf")
+        )
+        self.demo_file = self.create_file(
+            os.path.join(get_project_dir(self.demo), "output.vcf")
+        )
+        self.upload_file = self.create_file(
+            os.path.join(get_user_dir(self.owner), "files", "sample_1.fastq")
+        )
+
+    def create_file(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write("data")
+        return os.path.relpath(path, settings.MEDIA_ROOT)
+
+    def request(self, user):
+        request = RequestFactory().get("/")
+        request.user = user
+        return request
+
+    def test_project_access(self):
+        cases = [
+            (self.owner, True, True),
+            (self.collaborator, True, True),
+            (self.stranger, False, True),
+        ]
+        for user, project_access, demo_access in cases:
+            with self.subTest(user=user.email):
+                request = self.request(user)
+                self.assertEqual(
+                    has_project_access(request, self.project.id), project_access
+                )
+                self.assertEqual(has_project_access(request, self.demo.id), demo_access)
+                self.assertEqual(
+                    get_accessible_file_path(request, self.project_file) is not None,
+                    project_access,
+                )
+                self.assertIsNotNone(get_accessible_file_path(request, self.demo_file))
+
+    def test_demo_projects_are_not_membership(self):
+        request = self.request(self.stranger)
+        self.assertFalse(has_project_access(request, self.demo.id, member=True))
+        self.assertTrue(
+            has_project_access(self.request(self.owner), self.demo.id, member=True)
+        )
+
+    def test_upload_directories_are_private(self):
+        self.assertIsNotNone(
+            get_accessible_file_path(self.request(self.owner), self.upload_file)
+        )
+        for user in (self.collaborator, self.stranger):
+            with self.subTest(user=user.email):
+                self.assertIsNone(
+                    get_accessible_file_path(self.request(user), self.upload_file)
+                )
+
+    def test_parent_directory_traversal(self):
+        stranger_dir = os.path.basename(get_user_dir(self.stranger))
+        paths = [
+            os.path.join(stranger_dir, "..", self.project_file),
+            os.path.join(stranger_dir, "files", "..", "..", self.upload_file),
+            os.path.join(
+                "..", os.path.basename(settings.MEDIA_ROOT), self.project_file
+            ),
+            os.path.join("..", "..", "etc", "passwd"),
+        ]
+        request = self.request(self.stranger)
+        for path in paths:
+            with self.subTest(path=path):
+                self.assertIsNone(get_accessible_file_path(request, path))
+
+    def test_symlink_traversal(self):
+        stranger_dir = get_user_dir(self.stranger)
+        os.makedirs(stranger_dir)
+        os.symlink(get_project_dir(self.project), os.path.join(stranger_dir, "link"))
+        os.symlink(
+            os.path.dirname(settings.MEDIA_ROOT), os.path.join(stranger_dir, "root")
+        )
+
+        request = self.request(self.stranger)
+        for path in ("link/output.vcf", "root"):
+            with self.subTest(path=path):
+                self.assertIsNone(
+                    get_accessible_file_path(
+                        request, os.path.join(os.path.basename(stranger_dir), path)
+                    )
+                )
+
+    def test_acl_is_memoized_per_request(self):
+        request = self.request(self.collaborator)
+        with self.assertNumQueries(1):
+            acl = get_project_acl(request)
+        with self.assertNumQueries(0):
+            self.assertIs(get_project_acl(request), acl)
+            has_project_access(request, self.project.id)
+            get_accessible_file_path(request, self.project_file)
+
+        # Later requests are served from the shared cache
+        with self.assertNumQueries(0):
+            self.assertEqual(get_project_acl(self.request(self.collaborator)), acl)
+
+    def test_acl_is_cached_when_versions_are_created(self):
+        # Versions missing from the shared cache are created on the first read
+        cache.delete("version:project_acl")
+        get_project_acl(self.request(self.collaborator))
+        with self.assertNumQueries(0):
+            get_project_acl(self.request(self.collaborator))
+
+    def test_acl_is_invalidated_by_version_bumps(self):
+        self.assertFalse(
+            has_project_access(self.request(self.stranger), self.project.id)
+        )
+        self.project.collaborators.add(self.stranger)
+        self.assertTrue(
+            has_project_access(self.request(self.stranger), self.project.id)
+        )
+
+        self.project.collaborators.remove(self.collaborator)
+        self.assertFalse(
+            has_project_access(self.request(self.collaborator), self.project.id)
+        )
+
+        demo = Project.objects.create(
+            user=self.owner, name="demo 2", project_type=Project.SOMATIC, is_demo=True
+        )
+        self.assertTrue(has_project_access(self.request(self.stranger), demo.id))
+
+        # Bumping the version by hand drops the cached access list as well
+        request = self.request(self.stranger)
+        get_project_acl(request)
+        Project.objects.filter(id=demo.id).update(is_demo=False)
+        self.assertIn(demo.id, get_project_acl(self.request(self.stranger)))
+        invalidate_project_acls([self.stranger.id])
+        self.assertNotIn(demo.id, get_project_acl(self.request(self.stranger)))
+
+
+class FileCatalogTests(TestCase):
+    def setUp(self):
+        self.user = USER.objects.create_user(email="user@example.com")
+        self.other = USER.objects.create_user(email="other@example.com")
+        self.client = APIClient(HTTP_HOST="localhost")
+        self.client.force_authenticate(self.user)
+
+        now = timezone.now()
+        self.files = []
+        for i, (user, name, is_demo) in enumerate(
+            (
+                (self.user, "Tumor_1.fastq.gz", False),
+                (self.user, "tumor_2.fastq.gz", False),
+                (self.user, "normal_1.fastq.gz", False),
+                (self.other, "tumor_3.fastq.gz", False),
+                (self.other, "demo_tumor.bam", True),
+                (self.user, "normal_2.bam", False),
+            )
+        ):
+            file = File.objects.create(user=user, name=name, file=name, is_demo=is_demo)
+            # Two files share every upload time, ties are broken by id
+            File.objects.filter(id=file.id).update(
+                uploaded_at=now - timedelta(hours=i // 2),
+                file_type="BAM" if name.endswith(".bam") else "FQ",
+            )
+            file.refresh_from_db()
+            self.files.append(file)
+
+    def get_pages(self, **params) -> list:
+        pages = []
+        response = self.client.get("/files/catalog/", params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            pages.append([file["name"] for file in response.data["results"]])
+            if not response.data["next"]:
+                return pages
+            response = self.client.get(response.data["next"])
+
+    def test_pages_are_ordered_by_upload_time(self):
+        pages = self.get_pages(page_size=2)
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+
+        visible = [
+            file for file in self.files if file.user == self.user or file.is_demo
+        ]
+        visible.sort(key=lambda file: (file.uploaded_at, file.id), reverse=True)
+        self.assertEqual(sum(pages, []), [file.name for file in visible])
+
+    def test_filters(self):
+        def get_names(**params):
+            return set(sum(self.get_pages(**params), []))
+
+        self.assertEqual(
+            get_names(search="tumor"), {"Tumor_1.fastq.gz", "tumor_2.fastq.gz"}
+        )
+        self.assertEqual(get_names(file_type="bam"), {"demo_tumor.bam", "normal_2.bam"})
+        self.assertEqual(
+            get_names(
+                uploaded_after=self.files[0].uploaded_at.isoformat(), page_size=1
+            ),
+            {"Tumor_1.fastq.gz", "tumor_2.fastq.gz"},
+        )
+
+        response = self.client.get("/files/catalog/", {"uploaded_before": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+
+@primary_reads
+class ProjectEstimateTests(TestCase):
+    algorithms = {"mapper": "bwa", "variant_caller": ["mutect"]}
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        self.user = USER.objects.create_user(email="user@example.com")
+        self.other = USER.objects.create_user(email="other@example.com")
+        self.client = APIClient(HTTP_HOST="localhost")
+        self.client.force_authenticate(self.user)
+
+        self.tumor = self.create_file(self.user, "tumor.fastq", 150)
+        self.normal = self.create_file(self.user, "normal.fastq", 50)
+        self.hidden = self.create_file(self.other, "hidden.fastq", 1000)
+
+    def create_file(self, user, name, size):
+        with open(os.path.join(settings.MEDIA_ROOT, name), "wb") as f:
+            f.write(b"0" * size)
+        return File.objects.create(user=user, name=name, file=name)
+
+    def create_run(self, input_size, stages, algorithms=None):
+        project = Project.objects.create(
+            user=self.other,
+            name="past run",
+            project_type=Project.SOMATIC,
+            algorithms=algorithms or self.algorithms,
+        )
+        task = ProjectTask.objects.create(
+            project=project, task_id=f"task {project.id}", input_size=input_size
+        )
+        for stage, (wall_time, output_size) in stages.items():
+            TaskStageMetric.objects.create(
+                project_task=task,
+                stage=stage,
+                wall_time=wall_time,
+                output_size=output_size,
+            )
+
+    def estimate(self, **data):
+        data = {
+            "project_type": Project.SOMATIC,
+            "algorithms": json.dumps(self.algorithms),
+            "tumor_files": json.dumps([str(self.tumor.uuid), str(self.hidden.uuid)]),
+            "normal_files": json.dumps([str(self.normal.uuid)]),
+            **data,
+        }
+        return self.client.post("/projects/estimate/", data)
+
+    def test_no_history(self):
+        response = self.estimate()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data,
+            {
+                "input_size": 200,
+                "duration": 0,
+                "output_size": 0,
+                "stages": {},
+                "based_on": None,
+                "sample_count": 0,
+            },
+        )
+
+    def test_invalid_json(self):
+        for field, value in (
+            ("algorithms", "{"),
+            ("algorithms", "[]"),
+            ("tumor_files", "not json"),
+            ("normal_files", "{}"),
+        ):
+            with self.subTest(field=field, value=value):
+                response = self.estimate(**{field: value})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.data)
+
+    def test_estimate_from_history(self):
+        # Per input byte, mapping took 0.1 and 0.2 seconds and wrote 0.2 bytes,
+        # calling took 0.5 and 1 seconds and wrote 0.5 and 1 bytes
+        self.create_run(100, {"mapping": (10, 20), "calling": (50, 50)})
+        self.create_run(300, {"mapping": (60, 60), "calling": (300, 300)})
+        # Only used when no run has the same algorithms
+        self.create_run(100, {"mapping": (1000, 1000)}, {"mapper": "bowtie"})
+
+        response = self.estimate()
+        self.assertEqual(response.data["based_on"], "project_type_and_algorithms")
+        self.assertEqual(response.data["sample_count"], 2)
+        stages = response.data["stages"]
+        self.assertAlmostEqual(stages["mapping"]["duration"], 0.15 * 200)
+        self.assertAlmostEqual(stages["calling"]["duration"], 0.75 * 200)
+        self.assertEqual(stages["mapping"]["output_size"], 40)
+        self.assertEqual(stages["calling"]["output_size"], 150)
+        self.assertAlmostEqual(response.data["duration"], 180)
+        self.assertEqual(response.data["output_size"], 190)
+
+        response = self.estimate(algorithms=json.dumps({"mapper": "novoalign"}))
+        self.assertEqual(response.data["based_on"], "project_type")
+        self.assertEqual(response.data["sample_count"], 3)
+        self.assertAlmostEqual(
+            response.data["stages"]["mapping"]["duration"], 0.2 * 200
+        )
+
+
+@primary_reads
+@override_settings(RECLAIM_IN_BACKGROUND=False)
+class ProjectDeletionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = USER.objects.create_user(email="owner@example.com")
+        self.collaborator = USER.objects.create_user(email="collaborator@example.com")
+        self.project = Project.objects.create(
+            user=self.owner,
+            name="project",
+            project_type=Project.SOMATIC,
+            status=Project.COMPLETED,
+        )
+        self.project.collaborators.add(self.collaborator)
+
+    def delete(self, user, path, method="delete"):
+        client = APIClient(HTTP_HOST="localhost")
+        client.force_authenticate(user)
+        return getattr(client, method)(path)
+
+    def assertDeleted(self, deleted):
+        project = Project.all_objects.get(id=self.project.id)
+        self.assertEqual(project.deleted_at is not None, deleted)
+
+    def test_only_the_owner_can_delete(self):
+        for path, method in (
+            (f"/projects/{self.project.id}/", "delete"),
+            (f"/projects/{self.project.id}/delete_project/", "post"),
+        ):
+            with self.subTest(path=path):
+                response = self.delete(self.collaborator, path, method)
+                self.assertEqual(response.status_code, 401)
+                self.assertDeleted(False)
+
+    def test_only_the_owner_can_delete_demo_projects(self):
+        Project.objects.filter(id=self.project.id).update(is_demo=True)
+        other = USER.objects.create_user(email="other@example.com")
+        response = self.delete(other, f"/projects/{self.project.id}/")
+        self.assertEqual(response.status_code, 401)
+        self.assertDeleted(False)
+
+    def test_delete_tombstones_the_project(self):
+        response = self.delete(self.owner, f"/projects/{self.project.id}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertDeleted(True)
+
+        response = self.delete(self.owner, f"/projects/{self.project.id}/")
+        self.assertEqual(response.status_code, 404)
+
+
+@primary_reads
+class ProjectCancelTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = USER.objects.create_user(email="owner@example.com")
+        self.collaborator = USER.objects.create_user(email="collaborator@example.com")
+        self.project = Project.objects.create(
+            user=self.owner,
+            name="project",
+            project_type=Project.SOMATIC,
+            status=Project.IN_PROGRESS,
+        )
+        self.project.collaborators.add(self.collaborator)
+        ProjectTask.objects.create(project=self.project, task_id="task")
+
+        patcher = mock.patch("cosapweb.api.views.revoke_cosap_dna_job")
+        self.revoke = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cancel(self, user, project_id):
+        client = APIClient(HTTP_HOST="localhost")
+        client.force_authenticate(user)
+        return client.post(f"/projects/{project_id}/cancel_project/")
+
+    def test_owner_can_cancel(self):
+        response = self.cancel(self.owner, self.project.id)
+        self.assertEqual(response.status_code, 200)
+        self.revoke.assert_called_once_with(["task"])
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.status, Project.CANCELLED)
+
+    def test_only_the_owner_can_cancel(self):
+        response = self.cancel(self.collaborator, self.project.id)
+        self.assertEqual(response.status_code, 401)
+        self.revoke.assert_not_called()
+        self.project.refresh_from_db()
+        self.assertEqual(self.project.status, Project.IN_PROGRESS)
+
+    def test_missing_projects_are_not_found(self):
+        admin = USER.objects.create_superuser(email="admin@example.com")
+        for user, path in (
+            (self.owner, "/projects/0/cancel_project/"),
+            (self.owner, "/projects/0/rerun_project/"),
+            (admin, "/projects/0/summary_facets/"),
+            (admin, "/variants/0/"),
+        ):
+            with self.subTest(path=path):
+                client = APIClient(HTTP_HOST="localhost")
+                client.force_authenticate(user)
+                method = client.get if user is admin else client.post
+                self.assertEqual(method(path).status_code, 404)
+        self.revoke.assert_not_called()
+
+
+class LegacyVariantMirroringTests(TestCase):
+    """
+    Checks that SNVs linked through ProjectSNVs are mirrored into
+    ProjectVariant, and that the variant facets follow them.
+    """
+
+    def setUp(self):
+        cache.clear()
+        user = USER.objects.create_user(email="user@example.com")
+        self.project = Project.objects.create(
+            user=user,
+            name="project",
+            project_type=Project.SOMATIC,
+            status=Project.COMPLETED,
+        )
+        self.snvs = [
+            SNV.objects.create(location=f"chr1:{position}", ref="A", alt="T")
+            for position in (100, 200, 300)
+        ]
+        ProjectSNVData.objects.create(
+            project=self.project, snv=self.snvs[0], allele_frequency=0.25
+        )
+        self.project_snvs = ProjectSNVs.objects.create(project=self.project)
+
+    def assertMirrored(self, snvs):
+        self.assertEqual(
+            set(
+                ProjectVariant.objects.filter(project=self.project).values_list(
+                    "snv_id", flat=True
+                )
+            ),
+            {snv.id for snv in snvs},
+        )
+        facets = get_variant_facets(self.project)
+        self.assertEqual(facets["variant_count"], len(snvs))
+
+    def test_add(self):
+        self.assertMirrored([])
+        self.project_snvs.snvs.add(*self.snvs)
+        self.assertMirrored(self.snvs)
+        self.assertEqual(
+            ProjectVariant.objects.get(snv=self.snvs[0]).allele_frequency, 0.25
+        )
+
+    def test_remove(self):
+        self.project_snvs.snvs.add(*self.snvs)
+        self.assertMirrored(self.snvs)
+        self.project_snvs.snvs.remove(self.snvs[1])
+        self.assertMirrored([self.snvs[0], self.snvs[2]])
+
+    def test_reverse_remove(self):
+        self.project_snvs.snvs.add(*self.snvs)
+        self.assertMirrored(self.snvs)
+        self.snvs[2].projectsnvs_set.remove(self.project_snvs)
+        self.assertMirrored(self.snvs[:2])
+
+    def test_clear(self):
+        self.project_snvs.snvs.add(*self.snvs)
+        self.assertMirrored(self.snvs)
+        self.project_snvs.snvs.clear()
+        self.assertMirrored([])
+
+    def test_changes_bump_the_variant_cache_version(self):
+        name = get_variant_cache_name(self.project.id)
+        self.project_snvs.snvs.add(*self.snvs)
+        version = get_cache_version(name)
+        self.project_snvs.snvs.clear()
+        self.assertNotEqual(get_cache_version(name), version)
+
+
+@primary_reads
+class DemoContentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = USER.objects.create_user(email="owner@example.com")
+        self.demo = Project.objects.create(
+            user=self.owner,
+            name="demo",
+            project_type=Project.SOMATIC,
+            status=Project.COMPLETED,
+            is_demo=True,
+        )
+        self.project = Project.objects.create(
+            user=self.owner, name="project", project_type=Project.SOMATIC
+        )
+        self.demo_file = File.objects.create(
+            user=self.owner, name="demo.bam", file="demo.bam", is_demo=True
+        )
+        self.file = File.objects.create(user=self.owner, name="own.bam", file="own.bam")
+        self.snvs = [
+            SNV.objects.create(location=f"chr1:{position}", ref="A", alt="T")
+            for position in (100, 200)
+        ]
+        ingest_project_variants(self.demo, [{"snv_id": self.snvs[0].id}])
+
+    def get_payloads(self):
+        return (
+            get_demo_project_entries(),
+            get_demo_files(),
+            get_demo_variants(self.demo.id),
+        )
+
+    def assertInvalidates(self, change, invalidates=True):
+        self.get_payloads()
+        version = get_cache_version(DEMO_CACHE)
+        change()
+        self.assertEqual(get_cache_version(DEMO_CACHE) != version, invalidates)
+
+    def test_payloads_are_shared_by_all_users(self):
+        projects, files, variants = self.get_payloads()
+        self.assertEqual([project["id"] for project in projects], [self.demo.id])
+        self.assertEqual([file["id"] for file in files], [self.demo_file.id])
+        self.assertEqual(len(variants), 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_payloads(), (projects, files, variants))
+
+        # Demo variants are not read again for other users
+        for email in ("first@example.com", "second@example.com"):
+            client = APIClient(HTTP_HOST="localhost")
+            client.force_authenticate(USER.objects.create_user(email=email))
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(f"/variants/{self.demo.id}/")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data), 1)
+            self.assertFalse(
+                any("api_projectvariant" in query["sql"] for query in queries)
+            )
+
+    def test_demo_project_changes_invalidate(self):
+        def rename():
+            self.demo.name = "renamed"
+            self.demo.save()
+
+        self.assertInvalidates(rename)
+        self.assertEqual(get_demo_project_entries()[0]["name"], "renamed")
+
+        def unflag():
+            self.demo.is_demo = False
+            self.demo.save()
+
+        self.assertInvalidates(unflag)
+        self.assertEqual(get_demo_project_entries(), [])
+        self.assertEqual(get_demo_project_ids(), frozenset())
+
+    def test_demo_file_changes_invalidate(self):
+        def rename():
+            self.demo_file.name = "renamed.bam"
+            self.demo_file.save()
+
+        self.assertInvalidates(rename)
+        self.assertEqual(get_demo_files()[0]["name"], "renamed.bam")
+
+        def unflag():
+            self.demo_file.is_demo = False
+            self.demo_file.save()
+
+        self.assertInvalidates(unflag)
+        self.assertEqual(get_demo_files(), [])
+
+        File.objects.filter(id=self.demo_file.id).update(is_demo=True)
+        bump_cache_version(DEMO_CACHE)
+        self.assertInvalidates(self.demo_file.delete)
+        self.assertEqual(get_demo_files(), [])
+
+    def test_demo_variant_changes_invalidate(self):
+        self.assertInvalidates(
+            lambda: ingest_project_variants(
+                self.demo, [{"snv_id": snv.id} for snv in self.snvs]
+            )
+        )
+        self.assertEqual(len(get_demo_variants(self.demo.id)), 2)
+
+        project_snvs = ProjectSNVs.objects.create(project=self.demo)
+        self.assertInvalidates(lambda: project_snvs.snvs.add(self.snvs[0]))
+
+    def test_other_changes_keep_the_cache(self):
+        def rename():
+            self.project.name = "renamed"
+            self.project.save()
+            self.file.name = "renamed.bam"
+            self.file.save()
+
+        self.assertInvalidates(rename, invalidates=False)
+        self.assertInvalidates(
+            lambda: ingest_project_variants(
+                self.project, [{"snv_id": self.snvs[0].id}]
+            ),
+            invalidates=False,
+        )
+
+
+@primary_reads
+class VariantFacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = USER.objects.create_user(email="user@example.com")
+        self.project = Project.objects.create(
+            user=self.user,
+            name="project",
+            project_type=Project.SOMATIC,
+            status=Project.COMPLETED,
+        )
+        self.snvs = [
+            SNV.objects.create(
+                location=location,
+                ref="A",
+                alt="T",
+                gene_symbol=gene,
+                consequence=consequence,
+            )
+            for location, gene, consequence in (
+                ("chr1:100", "TP53", "missense_variant"),
+                ("chr1:200", "TP53", "missense_variant&splice_region_variant"),
+                ("chr2:300", "BRCA2", None),
+            )
+        ]
+
+    def get_counts(self, facets, name) -> dict:
+        return {item["value"]: item["count"] for item in facets["facets"][name]}
+
+    def test_facets_after_ingest(self):
+        ingest_project_variants(
+            self.project,
+            [
+                {"snv_id": self.snvs[0].id, "allele_frequency": 0.02},
+                {"snv_id": self.snvs[1].id, "allele_frequency": 0.45},
+                {"snv_id": self.snvs[2].id},
+            ],
+        )
+        # Stored when the variants are ingested
+        self.assertTrue(ProjectVariantAggregate.objects.filter(project=self.project))
+
+        client = APIClient(HTTP_HOST="localhost")
+        client.force_authenticate(self.user)
+        facets = client.get(f"/projects/{self.project.id}/summary_facets/").data
+        self.assertEqual(facets["variant_count"], 3)
+        self.assertEqual(
+            self.get_counts(facets, "gene_symbol"), {"TP53": 2, "BRCA2": 1}
+        )
+        self.assertEqual(
+            self.get_counts(facets, "consequence"),
+            {"missense_variant": 2, "splice_region_variant": 1, "unknown": 1},
+        )
+        self.assertEqual(self.get_counts(facets, "chromosome"), {"chr1": 2, "chr2": 1})
+        self.assertEqual(
+            self.get_counts(facets, "allele_frequency"),
+            {"0-0.05": 1, "0.4-0.5": 1, "unknown": 1},
+        )
+
+    def test_facets_after_legacy_changes(self):
+        project_snvs = ProjectSNVs.objects.create(project=self.project)
+        project_snvs.snvs.add(*self.snvs)
+        facets = get_variant_facets(self.project)
+        self.assertEqual(facets["variant_count"], 3)
+
+        project_snvs.snvs.remove(self.snvs[2])
+        facets = get_variant_facets(self.project)
+        self.assertEqual(facets["variant_count"], 2)
+        self.assertEqual(self.get_counts(facets, "gene_symbol"), {"TP53": 2})
+
+    def test_unfinished_projects_are_not_stored(self):
+        Project.objects.filter(id=self.project.id).update(status=Project.IN_PROGRESS)
+        self.project.refresh_from_db()
+        ProjectVariant.objects.create(project=self.project, snv=self.snvs[0])
+
+        facets = get_variant_facets(self.project)
+        self.assertEqual(facets["variant_count"], 1)
+        self.assertIsNone(facets["updated_at"])
+        self.assertFalse(ProjectVariantAggregate.objects.filter(project=self.project))
+
+        ProjectVariant.objects.create(project=self.project, snv=self.snvs[1])
+        self.assertEqual(get_variant_facets(self.project)["variant_count"], 2)
+
+
+@primary_reads
+class CohortCompareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = USER.objects.create_user(email="user@example.com")
+        self.client = APIClient(HTTP_HOST="localhost")
+        self.client.force_authenticate(self.user)
+
+        self.snvs = {
+            location: SNV.objects.create(
+                location=location, ref="A", alt="T", gene_symbol="TP53"
+            )
+            for location in (
+                "chr1:100",
+                "chr1:200",
+                "chr2:300",
+                "chr3:400",
+                "chr4:500",
+                # The same variant as chr1:100
+                "1:100",
+            )
+        }
+        self.variant_sets = [
+            {"chr1:100", "chr1:200", "chr2:300"},
+            {"1:100", "chr2:300", "chr3:400"},
+            {"chr1:100", "chr4:500"},
+        ]
+        self.projects = []
+        for i, locations in enumerate(self.variant_sets):
+            project = Project.objects.create(
+                user=self.user,
+                name=f"project {i}",
+                project_type=Project.SOMATIC,
+                status=Project.COMPLETED,
+            )
+            self.set_variants(project, locations)
+            self.projects.append(project)
+
+    def set_variants(self, project, locations):
+        ingest_project_variants(
+            project, [{"snv_id": self.snvs[location].id} for location in locations]
+        )
+
+    def compare(self, project_ids):
+        return self.client.get(
+            "/projects/compare/",
+            {"projects": ",".join(str(project_id) for project_id in project_ids)},
+        )
+
+    def expected(self, variant_sets):
+        variant_sets = [
+            {location.removeprefix("chr") for location in locations}
+            for locations in variant_sets
+        ]
+        return {
+            "variant_count": len(set.union(*variant_sets)),
+            "sizes": [len(locations) for locations in variant_sets],
+            "overlap": [[len(a & b) for b in variant_sets] for a in variant_sets],
+        }
+
+    def test_overlaps_match_set_intersections(self):
+        response = self.compare([project.id for project in self.projects])
+        self.assertEqual(response.status_code, 200)
+
+        expected = self.expected(self.variant_sets)
+        self.assertEqual(response.data["variant_count"], expected["variant_count"])
+        self.assertEqual(response.data["overlap"], expected["overlap"])
+        self.assertEqual(
+            [project["variant_count"] for project in response.data["projects"]],
+            expected["sizes"],
+        )
+        # chr1:100 is in every project, chr2:300 in two
+        self.assertEqual(response.data["recurrence"], [3, 1, 1])
+        self.assertEqual(
+            [variant["count"] for variant in response.data["recurrent_variants"]],
+            [3, 2],
+        )
+        self.assertEqual(response.data["jaccard"][0][1], round(2 / 4, 4))
+
+    def test_invalid_project_ids(self):
+        first, second, _ = (project.id for project in self.projects)
+        for projects in ("", f"{first},", f"{first},{first}", f"{first},a"):
+            with self.subTest(projects=projects):
+                response = self.client.get("/projects/compare/", {"projects": projects})
+                self.assertEqual(response.status_code, 400)
+
+        # Inaccessible and missing projects are not found, like elsewhere
+        other = USER.objects.create_user(email="other@example.com")
+        hidden = Project.objects.create(
+            user=other, name="hidden", project_type=Project.SOMATIC
+        )
+        for project_ids in ([first, hidden.id], [first, 0]):
+            with self.subTest(project_ids=project_ids):
+                self.assertEqual(self.compare(project_ids).status_code, 404)
+
+    def test_results_are_invalidated_when_variants_change(self):
+        project_ids = [project.id for project in self.projects[:2]]
+        self.assertEqual(self.compare(project_ids).data["overlap"][0][1], 2)
+        # Only the projects are loaded when the comparison is cached
+        with self.assertNumQueries(1):
+            self.assertEqual(self.compare(project_ids).data["overlap"][0][1], 2)
+
+        self.set_variants(self.projects[1], {"chr3:400"})
+        response = self.compare(project_ids)
+        self.assertEqual(
+            response.data["overlap"],
+            self.expected([self.variant_sets[0], {"chr3:400"}])["overlap"],
+        )
+
+        # Legacy writers invalidate the results as well
+        project_snvs = ProjectSNVs.objects.create(project=self.projects[1])
+        project_snvs.snvs.add(self.snvs["chr1:200"])
+        self.assertEqual(self.compare(project_ids).data["overlap"][0][1], 1)
+        project_snvs.snvs.remove(self.snvs["chr1:200"])
+        self.assertEqual(self.compare(project_ids).data["overlap"][0][1], 0)
+
+
+@primary_reads
+class VariantSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = USER.objects.create_user(email="user@example.com")
+        self.other = USER.objects.create_user(email="other@example.com")
+        self.client = APIClient(HTTP_HOST="localhost")
+        self.client.force_authenticate(self.user)
+
+        self.snvs = [
+            SNV.objects.create(
+                location=f"chr{chromosome}:{position}",
+                ref="A",
+                alt="T",
+                gene_symbol=gene,
+                rs_id=f"rs{position}",
+            )
+            for chromosome, position, gene in (
+                (1, 100, "TP53"),
+                (1, 200, "TP53"),
+                (1, 300, "BRCA2"),
+                (1, 400, "BRCA2"),
+                (2, 200, "TP53"),
+            )
+        ]
+        self.own = self.create_project(self.user, "own")
+        self.shared = self.create_project(self.other, "shared")
+        self.shared.collaborators.add(self.user)
+        self.hidden = self.create_project(self.other, "hidden")
+        self.deleted = self.create_project(self.user, "deleted")
+        Project.objects.filter(id=self.deleted.id).update(deleted_at=timezone.now())
+
+    def create_project(self, user, name):
+        project = Project.objects.create(
+            user=user,
+            name=name,
+            project_type=Project.SOMATIC,
+            status=Project.COMPLETED,
+        )
+        ingest_project_variants(project, [{"snv_id": snv.id} for snv in self.snvs])
+        return project
+
+    def search(self, **params):
+        return self.client.get("/variants/search/", params)
+
+    def get_rows(self, response) -> set:
+        return {
+            (row["project"], row["snv"]["location"]) for row in response.data["results"]
+        }
+
+    def test_only_accessible_projects_are_searched(self):
+        response = self.search(gene="TP53,BRCA2", page_size=500)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 10)
+        self.assertEqual(
+            {row["project"] for row in response.data["results"]},
+            {self.own.id, self.shared.id},
+        )
+        self.assertEqual(
+            {row["project"]: row["count"] for row in response.data["projects"]},
+            {self.own.id: 5, self.shared.id: 5},
+        )
+
+        response = self.search(rs_id="rs100")
+        self.assertEqual(
+            self.get_rows(response),
+            {(self.own.id, "chr1:100"), (self.shared.id, "chr1:100")},
+        )
+
+    def test_invalid_parameters(self):
+        for params in (
+            {},
+            {"aa_change": "p.R175H"},
+            {"start": "100"},
+            {"chromosome": "chr1", "start": "a"},
+            {"chromosome": "chr1", "end": "-1"},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.search(**params).status_code, 400)
+
+    def test_position_range(self):
+        response = self.search(chromosome="chr1", start="200", end="300")
+        self.assertEqual(
+            self.get_rows(response),
+            {
+                (project.id, location)
+                for project in (self.own, self.shared)
+                for location in ("chr1:200", "chr1:300")
+            },
+        )
+
+        response = self.search(chromosome="chr1", start="400")
+        self.assertEqual(
+            self.get_rows(response),
+            {(self.own.id, "chr1:400"), (self.shared.id, "chr1:400")},
+        )
+
+    def test_pagination(self):
+        pages = []
+        response = self.search(gene="TP53", page_size=4)
+        while True:
+            self.assertEqual(response.data["count"], 6)
+            pages.append(self.get_rows(response))
+            if not response.data["next"]:
+                break
+            response = self.client.get(response.data["next"])
+
+        self.assertEqual([len(page) for page in pages], [4, 2])
+        self.assertEqual(
+            set.union(*pages),
+            {
+                (project.id, snv.location)
+                for project in (self.own, self.shared)
+                for snv in self.snvs
+                if snv.gene_symbol == "TP53"
+            },
+        )
+        # Matches in every project are counted on every page
+        self.assertEqual([row["count"] for row in response.data["projects"]], [3, 3])
+
+
+class ReclaimerTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        user = USER.objects.create_user(email="user@example.com")
+        self.project = Project.objects.create(
+            user=user,
+            name="project",
+            project_type=Project.SOMATIC,
+            status=Project.COMPLETED,
+            deleted_at=timezone.now(),
+        )
+        snv = SNV.objects.create(location="chr1:100", ref="A", alt="T")
+        ProjectSNVData.objects.create(project=self.project, snv=snv)
+        ProjectVariant.objects.create(project=self.project, snv=snv)
+
+        self.project_dir = get_project_dir(self.project)
+        os.makedirs(self.project_dir, exist_ok=True)
+        with open(os.path.join(self.project_dir, "output.vcf"), "wb") as f:
+            f.write(b"0" * 100)
+
+        self.reclaimer = ProjectReclaimer(
+            bytes_per_second=10**9, files_per_second=10**6
+        )
+
+    def test_reclaims_deleted_projects(self):
+        self.assertEqual(self.reclaimer.reclaim_all(log=lambda message: None), (1, 100))
+        self.assertFalse(Project.all_objects.filter(id=self.project.id).exists())
+        self.assertFalse(ProjectSNVData.objects.exists())
+        self.assertFalse(ProjectVariant.objects.exists())
+        self.assertFalse(os.path.exists(self.project_dir))
+
+    def test_skips_projects_claimed_by_another_process(self):
+        Project.all_objects.filter(id=self.project.id).update(
+            reclaiming_at=timezone.now()
+        )
+        self.assertEqual(self.reclaimer.reclaim_all(log=lambda message: None), (0, 0))
+        self.assertTrue(os.path.exists(self.project_dir))
+
+        Project.all_objects.filter(id=self.project.id).update(
+            reclaiming_at=timezone.now() - CLAIM_TIMEOUT
+        )
+        self.assertEqual(self.reclaimer.reclaim_all(log=lambda message: None), (1, 100))
+
+    def test_failures_do_not_stop_other_projects(self):
+        failing = Project.objects.create(
+            user=self.project.user,
+            name="failing",
+            project_type=Project.SOMATIC,
+            status=Project.COMPLETED,
+            deleted_at=timezone.now() - CLAIM_TIMEOUT,
+        )
+        reclaim = self.reclaimer.reclaim
+
+        def reclaim_or_fail(project):
+            if project.id == failing.id:
+                raise OSError("Permission denied")
+            return reclaim(project)
+
+        with mock.patch.object(self.reclaimer, "reclaim", reclaim_or_fail):
+            with self.assertLogs("cosapweb.api.reclaimer", "ERROR"):
+                reclaimed = self.reclaimer.reclaim_all(log=lambda message: None)
+        self.assertEqual(reclaimed, (1, 100))
+        # Released to be tried again on the next run
+        self.assertIsNone(Project.all_objects.get(id=failing.id).reclaiming_at)
+
+    def test_projects_without_owner(self):
+        Project.all_objects.filter(id=self.project.id).update(user=None)
+        self.assertEqual(self.reclaimer.reclaim_all(log=lambda message: None), (1, 0))
+        self.assertFalse(Project.all_objects.filter(id=self.project.id).exists())
+
+
+class FileRestoreTests(TransactionTestCase):
+    """
+    Checks that downloads of compacted files restore small files at once,
+    and others in the background while clients are asked to retry.
+    """
+
+    content = b"chr1\t100\tA\tT\n" * 1000
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        user = USER.objects.create_user(email="user@example.com")
+        project = Project.objects.create(
+            user=user,
+            name="project",
+            project_type=Project.SOMATIC,
+            status=Project.COMPLETED,
+        )
+        project_dir = get_project_dir(project)
+        os.makedirs(project_dir, exist_ok=True)
+        self.file_path = os.path.join(project_dir, "variants.vcf")
+        with open(self.file_path, "wb") as f:
+            f.write(self.content)
+        tiering.compact_project(project)
+        self.assertFalse(os.path.exists(self.file_path))
+
+        self.client = APIClient(HTTP_HOST="localhost")
+        self.client.force_authenticate(user)
+        rel_path = os.path.relpath(self.file_path, media_root)
+        self.b64_path = base64.b64encode(rel_path.encode()).decode()
+        self.url = f"/file/{self.b64_path}"
+        self.token = Token.objects.get(user=user)
+
+    def assertRestored(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_small_files_are_restored_in_the_request(self):
+        self.assertRestored(self.client.get(self.url))
+
+    @override_settings(TIERING_INLINE_RESTORE_BYTES=0)
+    def test_large_files_are_restored_in_the_background(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], str(tiering.RESTORE_RETRY_AFTER))
+
+        for _ in range(100):
+            if not tiering._pending_restores:
+                break
+            time.sleep(0.05)
+        self.assertRestored(self.client.get(self.url))
+
+    async def test_async_downloads_restore_files(self):
+        response = await AsyncClient().get(
+            f"/async/file/{self.b64_path}",
+            authorization=f"Bearer {self.token.key}",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(os.path.isfile(self.file_path))
+
+
+class BamIndexTieringTests(TestCase):
+    """
+    Checks that both names a BAM index can have are removed when its BAM is
+    converted to CRAM, and rebuilt when the BAM is restored.
+    """
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+        user = USER.objects.create_user(email="user@example.com")
+        self.project = Project.objects.create(
+            user=user,
+            name="project",
+            project_type=Project.SOMATIC,
+            status=Project.COMPLETED,
+        )
+        self.project_dir = get_project_dir(self.project)
+        os.makedirs(self.project_dir, exist_ok=True)
+        self.bam_path = os.path.join(self.project_dir, "sample.bam")
+        self.index_paths = [f"{self.bam_path}.bai", f"{self.bam_path[:-4]}.bai"]
+        for path in [self.bam_path, *self.index_paths]:
+            with open(path, "wb") as f:
+                f.write(b"data")
+
+        pysam = mock.Mock()
+        pysam.index.side_effect = lambda path, index_path: shutil.copy(path, index_path)
+        # Conversions copy the file as is
+        convert = lambda src, dst, reference: shutil.copy(src, dst)
+        patches = [
+            mock.patch.dict("sys.modules", pysam=pysam),
+            mock.patch.object(tiering, "_bam_to_cram", side_effect=convert),
+            mock.patch.object(tiering, "_cram_to_bam", side_effect=convert),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_both_index_names_are_compacted_and_restored(self):
+        tiering.compact_project(self.project, reference="ref.fa")
+        for path in [self.bam_path, *self.index_paths]:
+            self.assertFalse(os.path.exists(path))
+        self.assertEqual(
+            set(tiering.read_manifest(self.project_dir)),
+            {"sample.bam", "sample.bam.bai", "sample.bai"},
+        )
+
+        tiering._restore_locked(self.project_dir, "sample.bai")
+        for path in [self.bam_path, *self.index_paths]:
+            self.assertTrue(os.path.isfile(path))
+        self.assertEqual(tiering.read_manifest(self.project_dir), {})
+
+
+@override_settings(METRICS_TOKEN="metrics-token", METRICS_ALLOWED_IPS=[])
+@mock.patch("cosapweb.api.views.get_cosap_queue_depth", return_value=3)
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient(HTTP_HOST="localhost")
+
+    def get(self, token=None, **extra):
+        if token is not None:
+            extra["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+        return self.client.get("/metrics", **extra)
+
+    def get_user_token(self, **fields):
+        user = USER.objects.create_user(email="user@example.com", **fields)
+        return Token.objects.get(user=user).key
+
+    def test_requires_access(self, queue_depth):
+        self.assertEqual(self.get().status_code, 401)
+        self.assertEqual(self.get("wrong-token").status_code, 401)
+        self.assertEqual(self.get(self.get_user_token()).status_code, 401)
+
+    def test_metrics_token(self, queue_depth):
+        response = self.get("metrics-token")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"cosap_worker_queue_depth 3.0", response.content)
+
+    def test_staff_users(self, queue_depth):
+        token = self.get_user_token(is_staff=True)
+        self.assertEqual(self.get(token).status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=["10.0.0.2"])
+    def test_allowed_ips(self, queue_depth):
+        self.assertEqual(self.get(REMOTE_ADDR="10.0.0.2").status_code, 200)
+        self.assertEqual(self.get(REMOTE_ADDR="10.0.0.3").status_code, 401)
+
+    def test_scrape_values_are_cached(self, queue_depth):
+        self.get("metrics-token")
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get("metrics-token").status_code, 200)
+        self.assertEqual(queue_depth.call_count, 1)
+
+
+class ActionLogTests(TransactionTestCase):
+    def setUp(self):
+        self.user = USER.objects.create_user(email="user@example.com")
+        Action.objects.all().delete()
+        self.writer = ActionLogWriter(flush_interval=60, batch_size=3)
+        self.addCleanup(self.writer.flush)
+
+    def log(self, user=None, detail="project"):
+        self.writer.log(user or self.user, Action.PROJECT_CREATION, detail)
+
+    def test_actions_are_buffered_after_commit(self):
+        with transaction.atomic():
+            self.log()
+            self.assertEqual(self.writer._buffer, [])
+        self.assertEqual(len(self.writer._buffer), 1)
+        self.assertFalse(Action.objects.exists())
+
+        self.writer.flush()
+        self.assertEqual(Action.objects.count(), 1)
+
+    def test_rolled_back_actions_are_dropped(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.log()
+            raise ValueError
+        self.writer.flush()
+        self.assertFalse(Action.objects.exists())
+
+    def test_full_buffers_are_written_at_once(self):
+        for i in range(3):
+            self.log(detail=f"project {i}")
+        self.assertEqual(self.writer._buffer, [])
+        self.assertEqual(Action.objects.count(), 3)
+
+    def test_invalid_actions_do_not_drop_the_batch(self):
+        deleted = USER.objects.create_user(email="deleted@example.com")
+        self.log(deleted, "deleted")
+        self.log(detail="kept")
+        USER.objects.filter(pk=deleted.pk).delete()
+
+        with self.assertLogs("cosapweb.api.action_log", "ERROR") as logs:
+            self.writer.flush()
+        self.assertIn("Could not write 1 of 2 actions", logs.output[0])
+        self.assertEqual(
+            list(Action.objects.values_list("action_detail", flat=True)), ["kept"]
+        )
+
+
+class StartupTests(SimpleTestCase):
+    def test_startup_time_and_lazy_imports(self):
+        # Django setup and the first request run in fresh processes
+        stdout = StringIO()
+        call_command("bench_startup", runs=3, budget_ms=0, stdout=stdout)
+        summary = json.loads(stdout.getvalue())
+
+        self.assertEqual(summary["heavy_modules"], [])
+        self.assertLessEqual(summary["startup_ms"], STARTUP_BUDGET_MS)
+
+
+@primary_reads
+class RequestInstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = USER.objects.create_user(email="user@example.com")
+        self.staff = USER.objects.create_user(email="staff@example.com", is_staff=True)
+        self.project = Project.objects.create(
+            user=self.staff,
+            name="project",
+            project_type=Project.SOMATIC,
+            status=Project.COMPLETED,
+        )
+        self.token = Token.objects.get(user=self.staff)
+
+    def get(self, user, path):
+        client = APIClient(HTTP_HOST="localhost")
+        client.force_authenticate(user)
+        return client.get(path)
+
+    def test_server_timing_is_only_sent_to_staff(self):
+        self.assertNotIn("Server-Timing", self.get(self.user, "/actions/"))
+        self.assertIn("db;dur=", self.get(self.staff, "/actions/")["Server-Timing"])
+
+    @override_settings(DEBUG=True)
+    def test_server_timing_is_sent_in_debug(self):
+        self.assertIn("Server-Timing", self.get(self.user, "/actions/"))
+
+    async def test_async_views_are_timed(self):
+        # Headers of the async client are named as in ASGI scopes
+        response = await AsyncClient().get(
+            f"/async/variants/{self.project.id}/",
+            authorization=f"Bearer {self.token.key}",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("db;dur=", response["Server-Timing"])
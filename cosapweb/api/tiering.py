@@ -0,0 +1,482 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from fnmatch import fnmatch
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, Q
+from django.http import HttpResponse
+from django.utils import timezone
+
+from ..common.cache import TTLCache
+from ..common.utils import get_project_dir
+from .models import Project
+from .storage import add_project_usage, reconcile_project_usage
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".cosap_manifest.json"
+MANIFEST_LOCK_NAME = ".cosap_manifest.lock"
+
+# How the original file of a manifest entry is stored
+ZSTD = "zstd"
+CRAM = "cram"
+# BAM index removed with its BAM, rebuilt when the BAM is restored
+BAM_INDEX = "bai"
+DROPPED = "dropped"
+
+ZSTD_LEVEL = 9
+
+# last_accessed_at is written at most once per project and process per TTL
+_touched_projects = TTLCache("project_access", maxsize=4096, ttl=60 * 60)
+
+# Seconds clients are asked to wait for files restored in the background
+RESTORE_RETRY_AFTER = 30
+RESTORE_WORKERS = 2
+
+_restore_executor = None
+# Paths being restored in the background by this process
+_pending_restores = set()
+_pending_restores_lock = threading.Lock()
+
+
+class RestorePending(Exception):
+    """
+    Raised when a compacted file is being restored in the background.
+    """
+
+
+def _split_project_path(path):
+    """
+    Splits an absolute path under MEDIA_ROOT into its project directory,
+    project id and path relative to the project directory.
+    """
+    media_root = os.path.realpath(settings.MEDIA_ROOT)
+    parts = os.path.relpath(path, media_root).split(os.sep)
+    # Project directories are named "<user dir>/<project id>_<project name>"
+    if len(parts) < 3 or parts[0] == ".." or "_" not in parts[1]:
+        return None
+
+    project_id = parts[1].split("_", 1)[0]
+    if not project_id.isdigit():
+        return None
+
+    project_dir = os.path.join(media_root, parts[0], parts[1])
+    return project_dir, int(project_id), os.path.join(*parts[2:])
+
+
+def read_manifest(project_dir) -> dict:
+    """
+    Returns the manifest entries of a compacted project directory, keyed by
+    the original paths relative to the directory.
+    """
+    try:
+        with open(os.path.join(project_dir, MANIFEST_NAME)) as f:
+            return json.load(f)["files"]
+    except FileNotFoundError:
+        return {}
+
+
+def _write_manifest(project_dir, files):
+    manifest_path = os.path.join(project_dir, MANIFEST_NAME)
+    if not files:
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        return
+
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": 1, "files": files}, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+
+
+@contextmanager
+def _manifest_lock(project_dir, blocking=True):
+    # Serializes manifest changes between processes. Without `blocking`,
+    # raises BlockingIOError if the lock is held.
+    with open(os.path.join(project_dir, MANIFEST_LOCK_NAME), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _compress_zstd(path, stored_path):
+    import zstandard
+
+    with open(path, "rb") as src, open(stored_path, "wb") as dst:
+        zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src, dst)
+
+
+def _decompress_zstd(stored_path, path):
+    import zstandard
+
+    with open(stored_path, "rb") as src, open(path, "wb") as dst:
+        zstandard.ZstdDecompressor().copy_stream(src, dst)
+
+
+def _bam_to_cram(path, stored_path, reference):
+    import pysam
+
+    pysam.view("-C", "-T", reference, "-o", stored_path, path, catch_stdout=False)
+
+
+def _cram_to_bam(stored_path, path, reference):
+    import pysam
+
+    pysam.view("-b", "-T", reference, "-o", path, stored_path, catch_stdout=False)
+
+
+def compact_project(project, reference=None, dry_run=False):
+    """
+    Compacts the output files of a project: BAMs are converted to CRAM
+    against `reference` if given, files matching TIERING_COMPRESS_PATTERNS
+    are compressed with zstd and files matching TIERING_DROP_PATTERNS are
+    deleted. Every change is recorded in the manifest of the project
+    directory. Returns the number of bytes before and after compaction.
+    """
+    project_dir = get_project_dir(project)
+    if not os.path.isdir(project_dir):
+        return 0, 0
+
+    bytes_before, bytes_after = 0, 0
+    for root, dirs, files in os.walk(project_dir):
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        for name in files:
+            path = os.path.join(root, name)
+            rel_path = os.path.relpath(path, project_dir)
+            if name.startswith(".") or name.endswith(".tmp"):
+                continue
+
+            if any(fnmatch(rel_path, p) for p in settings.TIERING_DROP_PATTERNS):
+                codec = DROPPED
+            elif reference and name.endswith(".bam"):
+                codec = CRAM
+            elif any(fnmatch(name, p) for p in settings.TIERING_COMPRESS_PATTERNS):
+                codec = ZSTD
+            else:
+                continue
+
+            size = os.path.getsize(path)
+            if dry_run:
+                bytes_before += size
+                continue
+
+            try:
+                stored_size = _compact_file(project_dir, rel_path, codec, reference)
+            except Exception as e:
+                logger.error(f"Could not compact {path}: {e}")
+                continue
+
+            if stored_size is not None:
+                bytes_before += size
+                bytes_after += stored_size
+
+    if not dry_run:
+        reconcile_project_usage(project)
+        Project.all_objects.filter(id=project.id).update(compacted_at=timezone.now())
+    return bytes_before, bytes_after
+
+
+def _bam_index_paths(rel_path):
+    # A BAM index is named either <name>.bam.bai or <name>.bai
+    return [f"{rel_path}.bai", f"{os.path.splitext(rel_path)[0]}.bai"]
+
+
+def _compact_file(project_dir, rel_path, codec, reference):
+    path = os.path.join(project_dir, rel_path)
+    stat = os.stat(path)
+    entry = {"codec": codec, "size": stat.st_size, "mtime": stat.st_mtime}
+    if codec == CRAM:
+        entry["reference"] = reference
+    stored_size = 0
+    if codec != DROPPED:
+        entry["stored"] = f"{rel_path}.{'zst' if codec == ZSTD else 'cram'}"
+        stored_path = os.path.join(project_dir, entry["stored"])
+        tmp_path = f"{stored_path}.tmp"
+        try:
+            if codec == ZSTD:
+                _compress_zstd(path, tmp_path)
+            else:
+                _bam_to_cram(path, tmp_path, reference)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.replace(tmp_path, stored_path)
+        stored_size = os.path.getsize(stored_path)
+
+    with _manifest_lock(project_dir):
+        current = os.stat(path)
+        if (current.st_size, current.st_mtime) != (stat.st_size, stat.st_mtime):
+            # Written while it was being compacted
+            if codec != DROPPED:
+                os.remove(stored_path)
+            return None
+
+        files = read_manifest(project_dir)
+        files[rel_path] = entry
+        index_paths = []
+        if codec == CRAM:
+            for index_rel_path in _bam_index_paths(rel_path):
+                index_path = os.path.join(project_dir, index_rel_path)
+                if os.path.exists(index_path):
+                    index_paths.append(index_path)
+                    files[index_rel_path] = {
+                        "codec": BAM_INDEX,
+                        "source": rel_path,
+                        "size": os.path.getsize(index_path),
+                    }
+        _write_manifest(project_dir, files)
+        os.remove(path)
+        for index_path in index_paths:
+            os.remove(index_path)
+
+    return stored_size
+
+
+def _restore_file(project_dir, rel_path, files):
+    """
+    Restores a compacted file in place and removes it from `files`. Returns
+    the change in disk usage, or None if the file cannot be restored.
+    """
+    entry = files.get(rel_path)
+    if entry is None or entry["codec"] == DROPPED:
+        return None
+
+    if entry["codec"] == BAM_INDEX:
+        return _restore_file(project_dir, entry["source"], files)
+
+    path = os.path.join(project_dir, rel_path)
+    stored_path = os.path.join(project_dir, entry["stored"])
+    tmp_path = f"{path}.tmp"
+    try:
+        if entry["codec"] == ZSTD:
+            _decompress_zstd(stored_path, tmp_path)
+        else:
+            _cram_to_bam(stored_path, tmp_path, entry["reference"])
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.utime(tmp_path, (entry["mtime"], entry["mtime"]))
+    os.replace(tmp_path, path)
+
+    usage_delta = entry["size"] - os.path.getsize(stored_path)
+    del files[rel_path]
+    if entry["codec"] == CRAM:
+        import pysam
+
+        # Rebuild the indexes under the names they were removed with
+        index_rel_paths = [
+            index_rel_path
+            for index_rel_path in _bam_index_paths(rel_path)
+            if files.pop(index_rel_path, None) is not None
+        ] or [f"{rel_path}.bai"]
+        for index_rel_path in index_rel_paths:
+            index_path = os.path.join(project_dir, index_rel_path)
+            pysam.index(path, index_path)
+            usage_delta += os.path.getsize(index_path)
+    _write_manifest(project_dir, files)
+    os.remove(stored_path)
+    return usage_delta
+
+
+def _get_stored_entry(files, rel_path):
+    # Entry of the file restored to make rel_path available
+    entry = files.get(rel_path)
+    if entry is not None and entry["codec"] == BAM_INDEX:
+        rel_path, entry = entry["source"], files.get(entry["source"])
+    if entry is None or entry["codec"] == DROPPED:
+        return None, None
+    return rel_path, entry
+
+
+def _restore_locked(project_dir, rel_path, blocking=True):
+    with _manifest_lock(project_dir, blocking):
+        if os.path.isfile(os.path.join(project_dir, rel_path)):
+            # Restored by another request meanwhile
+            return 0
+
+        return _restore_file(project_dir, rel_path, read_manifest(project_dir))
+
+
+def restore_file(path):
+    """
+    Restores a file under MEDIA_ROOT if it was compacted, touching only the
+    filesystem. Small zstd files are restored at once, others in the
+    background while RestorePending is raised. Returns whether the file
+    exists and the change in disk usage of its project.
+    """
+    if os.path.isfile(path):
+        return True, 0
+
+    project_path = _split_project_path(path)
+    if project_path is None:
+        return False, 0
+
+    project_dir, _, rel_path = project_path
+    stored_rel_path, entry = _get_stored_entry(read_manifest(project_dir), rel_path)
+    if entry is None:
+        return False, 0
+
+    if entry["codec"] != ZSTD or entry["size"] > settings.TIERING_INLINE_RESTORE_BYTES:
+        _restore_in_background(project_dir, stored_rel_path)
+        raise RestorePending
+
+    try:
+        usage_delta = _restore_locked(project_dir, stored_rel_path, blocking=False)
+    except BlockingIOError:
+        # Another file of the project is being restored, wait in the background
+        _restore_in_background(project_dir, stored_rel_path)
+        raise RestorePending
+    if usage_delta is None:
+        return False, 0
+
+    logger.info(f"Restored compacted file {path}")
+    return os.path.isfile(path), usage_delta
+
+
+def record_file_access(path, usage_delta=0):
+    """
+    Marks the project of a file under MEDIA_ROOT as accessed and adds the
+    disk usage of files restored by `restore_file` to it.
+    """
+    project_path = _split_project_path(path)
+    if project_path is None:
+        return
+
+    project_id = project_path[1]
+    touch_project(project_id)
+    if usage_delta:
+        project = Project.all_objects.filter(id=project_id).only("id", "user").first()
+        if project is not None:
+            add_project_usage(project, usage_delta)
+
+
+def ensure_file_available(path) -> bool:
+    """
+    Checks whether a file under MEDIA_ROOT exists, restoring it first if it
+    was compacted. Marks the project it belongs to as accessed. Raises
+    RestorePending if the file is restored in the background.
+    """
+    available, usage_delta = restore_file(path)
+    record_file_access(path, usage_delta)
+    return available
+
+
+def restore_pending_response():
+    return HttpResponse(
+        "The file is being restored, retry later.",
+        status=503,
+        headers={"Retry-After": str(RESTORE_RETRY_AFTER)},
+    )
+
+
+def _restore_in_background(project_dir, rel_path):
+    global _restore_executor
+
+    path = os.path.join(project_dir, rel_path)
+    with _pending_restores_lock:
+        if path in _pending_restores:
+            return
+
+        _pending_restores.add(path)
+        if _restore_executor is None:
+            _restore_executor = ThreadPoolExecutor(
+                max_workers=RESTORE_WORKERS, thread_name_prefix="file-restore"
+            )
+    _restore_executor.submit(_restore_later, project_dir, rel_path)
+
+
+def _restore_later(project_dir, rel_path):
+    path = os.path.join(project_dir, rel_path)
+    try:
+        usage_delta = _restore_locked(project_dir, rel_path)
+        if usage_delta is not None:
+            logger.info(f"Restored compacted file {path}")
+            record_file_access(path, usage_delta)
+    except Exception as e:
+        logger.error(f"Could not restore {path}: {e}")
+    finally:
+        with _pending_restores_lock:
+            _pending_restores.discard(path)
+        connections.close_all()
+
+
+def touch_project(project_id):
+    """
+    Records that the files of a project were accessed, so it is not
+    considered cold.
+    """
+    if _touched_projects.get(project_id):
+        return
+
+    _touched_projects.set(project_id, True)
+    Project.all_objects.filter(id=project_id).update(last_accessed_at=timezone.now())
+
+
+def apply_manifest(file_map, project_dir):
+    """
+    Shows compacted files of a Chonky file map under their original names
+    and sizes.
+    """
+    if not file_map:
+        return file_map
+
+    stored_files = {
+        entry["stored"]: (rel_path, entry)
+        for rel_path, entry in read_manifest(project_dir).items()
+        if "stored" in entry
+    }
+    if not stored_files:
+        return file_map
+
+    for file in file_map["file_map"].values():
+        if file.get("isDir"):
+            continue
+
+        stored_path = os.path.relpath(
+            os.path.join(settings.MEDIA_ROOT, file["path"]), project_dir
+        )
+        if stored_path not in stored_files:
+            continue
+
+        rel_path, entry = stored_files[stored_path]
+        file["name"] = os.path.basename(rel_path)
+        file["path"] = os.path.relpath(
+            os.path.join(project_dir, rel_path), settings.MEDIA_ROOT
+        )
+        file["size"] = entry["size"]
+        file["isCompacted"] = True
+    return file_map
+
+
+def get_cold_projects(days):
+    """
+    Returns finished projects whose files were not accessed for `days` days
+    and that were not compacted since.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    return (
+        Project.objects.filter(
+            status__in=[Project.COMPLETED, Project.FAILED, Project.CANCELLED],
+            is_demo=False,
+        )
+        .filter(
+            Q(last_accessed_at__lt=cutoff)
+            | Q(last_accessed_at__isnull=True, created_at__lt=cutoff)
+        )
+        .filter(
+            Q(compacted_at__isnull=True) | Q(compacted_at__lt=F("last_accessed_at"))
+        )
+        .select_related("user")
+        .order_by("id")
+    )
@@ -2,7 +2,7 @@ from django.urls import include, path, re_path
 from rest_framework.authtoken import views as auth_views
 from rest_framework.routers import DefaultRouter
 
-from cosapweb.api import views
+from cosapweb.api import async_views, views
 
 router = DefaultRouter()
 router.register(r"users", views.UserViewSet, basename="user")
@@ -11,10 +11,17 @@ router.register(r"register", views.RegisterViewSet, basename="register")
 router.register(r"get_user", views.VerifyUserVeiwSet, basename="get_user")
 router.register(r"projects", views.ProjectViewSet, basename="project")
 router.register(r"actions", views.ActionViewSet, basename="action")
+router.register(r"variants/search", views.VariantSearchViewSet, basename="variant_search")
 router.register(r"variants", views.ProjectSNVViewset, basename="project_variants")
+router.register(r"files/catalog", views.FileCatalogViewSet, basename="file_catalog")
 
 urlpatterns = [
     path("", include(router.urls)),
+    # Async variants of I/O heavy read endpoints, best served by an ASGI server
+    re_path(r"async/igv/(?P<b64_string>.+)/?$", async_views.igv_data),
+    re_path(r"async/file/(?P<b64_string>.+)/?$", async_views.download),
+    path("async/variants/<int:pk>/", async_views.project_variants),
+    path("async/files/<int:project_id>/file_map/", async_views.project_file_map),
     re_path(r"files/?$", views.FileViewSet.as_view({"get": "list", "post": "create"})),
     re_path(
         r"files/(?P<project_id>[0-9a-zA-Z]+)/?$",
@@ -27,6 +34,7 @@ urlpatterns = [
     re_path(
         r"file/(?P<b64_string>.+)/?$", views.FileViewSet.as_view({"get": "download"})
     ),
+    path("metrics", views.MetricsView.as_view()),
     path("change_password/", views.VerifyUserVeiwSet.as_view({"put": "update"})),
     re_path(r"igv/(?P<b64_string>.+)/?$", views.IGVDataView.as_view()),
 ]
@@ -0,0 +1,260 @@
+import re
+from bisect import bisect_right
+from collections import Counter
+
+from django.db import transaction
+
+from ..common.cache import bump_cache_version
+from ..db_routers import use_primary
+from .models import (SNV, Project, ProjectSNVData, ProjectSNVs,
+                     ProjectVariant, ProjectVariantAggregate)
+
+# Fields of the SNVs returned with project variants, without the ones
+# derived from `location`
+SNV_FIELDS = [
+    field.name
+    for field in SNV._meta.fields
+    if field.name not in ("chromosome", "position")
+]
+
+BATCH_SIZE = 5000
+
+# Upper bounds of the allele frequency bins of the variant facets
+AF_BINS = [0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0]
+AF_BIN_LABELS = [f"{lower}-{upper}" for lower, upper in zip([0, *AF_BINS], AF_BINS)]
+UNKNOWN = "unknown"
+
+FINISHED_STATUSES = [Project.COMPLETED, Project.FAILED, Project.CANCELLED]
+
+
+def get_project_variants(project) -> list:
+    """
+    Returns the SNVs of a project as dicts with their allele frequency in
+    the `af` key, -1 if it is unknown.
+    """
+    rows = (
+        ProjectVariant.objects.filter(project=project)
+        .order_by("snv_id")
+        .values_list(*[f"snv__{name}" for name in SNV_FIELDS], "allele_frequency")
+    )
+
+    all_variants = []
+    for row in rows:
+        variant_dict = dict(zip(SNV_FIELDS, row))
+        variant_dict["af"] = -1 if row[-1] is None else row[-1]
+        all_variants.append(variant_dict)
+
+    return all_variants
+
+
+def parse_location(location):
+    """
+    Splits a location like "chr1:12345" or "chr1:12345-12350" into its
+    chromosome and start position. Parts that cannot be parsed are None.
+    """
+    chromosome, _, position = (location or "").partition(":")
+    match = re.match(r"\d+", position.replace(",", ""))
+    return chromosome or None, int(match.group()) if match else None
+
+
+def backfill_snv_locations() -> int:
+    """
+    Fills the chromosome and position of SNVs saved without them. Returns
+    the number of SNVs updated.
+    """
+    updated = 0
+    while True:
+        snvs = list(
+            SNV.objects.filter(chromosome__isnull=True)
+            .exclude(location="")
+            .only("id", "location")[:BATCH_SIZE]
+        )
+        for snv in snvs:
+            snv.chromosome, snv.position = parse_location(snv.location)
+            # Marks locations without a chromosome as done
+            snv.chromosome = snv.chromosome or ""
+        SNV.objects.bulk_update(snvs, ["chromosome", "position"])
+        updated += len(snvs)
+        if len(snvs) < BATCH_SIZE:
+            return updated
+
+
+def _get_af_bin(allele_frequency):
+    if allele_frequency is None or allele_frequency < 0:
+        return UNKNOWN
+    index = min(bisect_right(AF_BINS, allele_frequency), len(AF_BINS) - 1)
+    return AF_BIN_LABELS[index]
+
+
+def compute_variant_facets(project):
+    """
+    Counts the variants of a project by gene, classification, consequence,
+    chromosome and allele frequency bin. Returns the number of variants and
+    the facets, each a list of values with their counts.
+    """
+    counters = {
+        "gene_symbol": Counter(),
+        "classification": Counter(),
+        "consequence": Counter(),
+        "chromosome": Counter(),
+    }
+    af_bins = Counter()
+    rows = ProjectVariant.objects.filter(project=project).values_list(
+        "snv__gene_symbol",
+        "snv__classification",
+        "snv__consequence",
+        "snv__location",
+        "allele_frequency",
+    )
+    variant_count = 0
+    for gene, classification, consequence, location, allele_frequency in rows:
+        variant_count += 1
+        counters["gene_symbol"][gene or UNKNOWN] += 1
+        counters["classification"][classification or UNKNOWN] += 1
+        # Variants can have several consequences, e.g. "a&b" or "a,b"
+        for term in set(re.split(r"[,&]", consequence or UNKNOWN)):
+            counters["consequence"][term.strip() or UNKNOWN] += 1
+        # Locations look like "chr1:12345"
+        counters["chromosome"][(location or UNKNOWN).split(":", 1)[0]] += 1
+        af_bins[_get_af_bin(allele_frequency)] += 1
+
+    facets = {
+        name: [{"value": value, "count": n} for value, n in counter.most_common()]
+        for name, counter in counters.items()
+    }
+    facets["allele_frequency"] = [
+        {"value": label, "count": af_bins[label]}
+        for label in [*AF_BIN_LABELS, UNKNOWN]
+        if af_bins[label]
+    ]
+    return variant_count, facets
+
+
+def refresh_variant_aggregate(project) -> ProjectVariantAggregate:
+    with use_primary():
+        variant_count, facets = compute_variant_facets(project)
+    aggregate, _ = ProjectVariantAggregate.objects.update_or_create(
+        project=project,
+        defaults={"variant_count": variant_count, "facets": facets},
+    )
+    return aggregate
+
+
+def get_variant_facets(project) -> dict:
+    """
+    Returns the variant facets of a project, computing them if its variants
+    changed since they were last computed.
+    """
+    aggregate = ProjectVariantAggregate.objects.filter(project=project).first()
+    if aggregate is None and project.status in FINISHED_STATUSES:
+        aggregate = refresh_variant_aggregate(project)
+    elif aggregate is None:
+        # Variants may still be written, so the result is not stored
+        with use_primary():
+            variant_count, facets = compute_variant_facets(project)
+        return {"variant_count": variant_count, "facets": facets, "updated_at": None}
+
+    return {
+        "variant_count": aggregate.variant_count,
+        "facets": aggregate.facets,
+        "updated_at": aggregate.updated_at,
+    }
+
+
+def get_variant_cache_name(project_id) -> str:
+    """
+    Name of the cache version bumped when the variants of a project change.
+    """
+    return f"project_variants:{project_id}"
+
+
+def invalidate_variant_aggregates(project_ids):
+    """
+    Drops the aggregates of projects whose variants changed one by one, they
+    are computed again when they are next read.
+    """
+    project_ids = list(project_ids)
+    ProjectVariantAggregate.objects.filter(project_id__in=project_ids).delete()
+    for project_id in project_ids:
+        bump_cache_version(get_variant_cache_name(project_id))
+
+
+def _variants_changed(project):
+    # Imported here as the demo cache builds its payloads from this module
+    from .demo_cache import DEMO_CACHE
+
+    refresh_variant_aggregate(project)
+    bump_cache_version(get_variant_cache_name(project.id))
+    if project.is_demo:
+        bump_cache_version(DEMO_CACHE)
+
+
+def ingest_project_variants(project, variants):
+    """
+    Replaces the variants of a project. `variants` are dicts with an
+    `snv_id` and optionally `allele_frequency`, `depth`, `caller` and
+    `filter`.
+    """
+    with transaction.atomic():
+        ProjectVariant.objects.filter(project=project).delete()
+        ProjectVariant.objects.bulk_create(
+            [ProjectVariant(project=project, **variant) for variant in variants],
+            batch_size=BATCH_SIZE,
+        )
+    _variants_changed(project)
+
+
+def add_legacy_project_snvs(project_id, snv_ids):
+    """
+    Mirrors SNVs linked to a project through ProjectSNVs, with the allele
+    frequencies recorded in ProjectSNVData.
+    """
+    snv_ids = list(snv_ids)
+    allele_frequencies = dict(
+        ProjectSNVData.objects.filter(
+            project_id=project_id, snv_id__in=snv_ids
+        ).values_list("snv_id", "allele_frequency")
+    )
+    ProjectVariant.objects.bulk_create(
+        [
+            ProjectVariant(
+                project_id=project_id,
+                snv_id=snv_id,
+                allele_frequency=allele_frequencies.get(snv_id),
+            )
+            for snv_id in snv_ids
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    invalidate_variant_aggregates([project_id])
+
+
+def set_legacy_allele_frequency(project_id, snv_id, allele_frequency):
+    """
+    Mirrors an allele frequency recorded in ProjectSNVData.
+    """
+    ProjectVariant.objects.filter(project_id=project_id, snv_id=snv_id).update(
+        allele_frequency=allele_frequency
+    )
+    invalidate_variant_aggregates([project_id])
+
+
+def backfill_project_variants(project) -> int:
+    """
+    Copies the variants of a project from ProjectSNVs and ProjectSNVData,
+    keeping variants that were copied before. Returns the number of legacy
+    variants of the project.
+    """
+    snv_ids = list(
+        ProjectSNVs.snvs.through.objects.filter(projectsnvs__project=project)
+        .order_by("snv_id")
+        .values_list("snv_id", flat=True)
+        .distinct()
+    )
+    for start in range(0, len(snv_ids), BATCH_SIZE):
+        add_legacy_project_snvs(project.id, snv_ids[start : start + BATCH_SIZE])
+
+    if snv_ids:
+        _variants_changed(project)
+    return len(snv_ids)
@@ -1,47 +1,99 @@
 import base64
+import hmac
 import json
-import mimetypes
+import logging
 import os
 import re
-import tempfile
-from multiprocessing.pool import ThreadPool
-from pathlib import Path
-from urllib import request
 from wsgiref.util import FileWrapper
 
-import pysam
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core import serializers as django_serializers
-from django.db.models import Q
+from django.db.models import Count, Q
 from django.db.models.query import QuerySet
 from django.forms.models import model_to_dict
 from django.http import Http404, HttpResponse, StreamingHttpResponse
-from django_drf_filepond.parsers import PlainTextParser, UploadChunkParser
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django_drf_filepond.parsers import UploadChunkParser
 from django_drf_filepond.renderers import PlainTextRenderer
 from django_drf_filepond.views import PatchView, ProcessView
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Gauge, generate_latest,
+                               multiprocess)
 from rest_framework import mixins, permissions, status, views, viewsets
 from rest_framework.authtoken.models import Token
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.parsers import MultiPartParser
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from rest_framework.decorators import api_view
 
 from cosapweb.api import serializers
+from cosapweb.api.demo_cache import (DEMO_CACHE, get_demo_files,
+                                     get_demo_project_entries,
+                                     get_demo_project_ids, get_demo_variants)
+from cosapweb.api.mixins import ReplicaReadMixin
 from cosapweb.api.models import (SNV, Action, File, Project, ProjectFiles,
-                                 ProjectSNVData, ProjectSNVs, ProjectSummary,
-                                 ProjectTask)
-from cosapweb.api.permissions import IsOwnerOrDoesNotExist, OnlyAdminToList
-
-from ..common.utils import (convert_file_relative_path_to_absolute_path,
-                            create_chonky_filemap, get_project_dir,
-                            get_user_dir)
-from .celery_handlers import submit_cosap_dna_job
+                                 ProjectSummary, ProjectTask, ProjectVariant)
+from cosapweb.api.pagination import (ActionCursorPagination,
+                                     FileCatalogCursorPagination,
+                                     VariantSearchPagination)
+from cosapweb.api.permissions import (IsOwnerOrDoesNotExist, OnlyAdminToList,
+                                      get_accessible_file_path,
+                                      get_accessible_project_ids,
+                                      has_project_access)
+from cosapweb.api.response_cache import (ALL_PROJECTS, PROJECT_LIST_CACHE,
+                                         cached_response,
+                                         get_project_cache_name,
+                                         get_project_list_cache_name)
+from cosapweb.authentication import get_token
+
+from ..common.cache import shared_cache_get, shared_cache_set
+from ..common.instrumentation import count, timed
+from ..common.metrics import (FILE_BYTES_SERVED, IGV_RANGE_SIZE,
+                              PIPELINE_SUBMISSION_LATENCY, UPLOAD_BYTES,
+                              UPLOAD_CHUNKS)
+from ..common.utils import (clear_directory, create_chonky_filemap,
+                            get_project_dir, get_user_dir)
+from .celery_handlers import (get_cosap_queue_depth, revoke_cosap_dna_job,
+                              submit_cosap_dna_job)
+from .cohort import compare_projects
+from .reclaimer import project_reclaimer
+from .storage import (add_user_files_usage, annotate_user_storage,
+                      exceeds_quota, get_project_storage,
+                      reconcile_project_usage)
+from .telemetry import (estimate_project_resources, get_files_size,
+                        record_stage_metric)
+from .tiering import (RestorePending, apply_manifest, ensure_file_available,
+                      restore_pending_response, touch_project)
+from .variants import get_project_variants, get_variant_facets
+
+logger = logging.getLogger(__name__)
 
 USER = get_user_model()
 
 
+def get_json_field(request, name, default, expected_type):
+    """
+    Parses a JSON encoded form field, raising a ValidationError if it is not
+    valid JSON of the expected type.
+    """
+    value = request.POST.get(name)
+    if value is None:
+        return default
+
+    try:
+        value = json.loads(value)
+    except json.JSONDecodeError:
+        raise ValidationError({name: "Invalid JSON."})
+
+    if not isinstance(value, expected_type):
+        raise ValidationError({name: f"Expected a JSON {expected_type.__name__}."})
+    return value
+
+
 class UserViewSet(
     mixins.RetrieveModelMixin,
     mixins.UpdateModelMixin,
@@ -61,7 +113,7 @@ class UserViewSet(
 
     lookup_field = "email"
     serializer_class = serializers.UserSerializer
-    queryset = USER.objects.all()
+    queryset = annotate_user_storage(USER.objects.prefetch_related("affiliations"))
 
 
 class VerifyUserVeiwSet(viewsets.ViewSet):
@@ -81,8 +133,9 @@ class VerifyUserVeiwSet(viewsets.ViewSet):
             else None
         )
 
-        if token and Token.objects.filter(key=token).exists():
-            user = Token.objects.get(key=token).user
+        token = get_token(token) if token else None
+        if token:
+            user = token.user
             user_serializer = self.serializer_class(user)
             return Response(user_serializer.data, status=status.HTTP_200_OK)
 
@@ -98,8 +151,9 @@ class VerifyUserVeiwSet(viewsets.ViewSet):
             else None
         )
 
-        if request_token and Token.objects.filter(key=request_token).exists():
-            user = Token.objects.get(key=request_token).user
+        token = get_token(request_token) if request_token else None
+        if token:
+            user = USER.objects.get(id=token.user_id)
             if user.check_password(request.data["old_password"]):
                 user.set_password(request.data["new_password"])
                 user.save()
@@ -143,14 +197,18 @@ class RegisterViewSet(mixins.CreateModelMixin, viewsets.GenericViewSet):
         return Response({"token": token.key})
 
 
-class ProjectViewSet(viewsets.ModelViewSet):
+class ProjectViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     """
     View to create, view, update and list projects where the requesting user is the creator or a collaborator.
     """
 
     permission_classes = [permissions.IsAuthenticated]
 
-    queryset = Project.objects.order_by("-created_at")
+    queryset = (
+        Project.objects.select_related("user")
+        .prefetch_related("collaborators")
+        .order_by("-created_at")
+    )
     serializer_class = serializers.ProjectSerializer
 
     def get_queryset(self):
@@ -158,21 +216,38 @@ class ProjectViewSet(viewsets.ModelViewSet):
         Get the list of items for this view.
 
         Overridden only to return projects where the requesting user
-        is the creator of the project or a collaborator in the project.
+        is the creator of the project, a collaborator in the project
+        or the project is a demo.
         """
         queryset = self.queryset.all()
         if isinstance(queryset, QuerySet):
             user = self.request.user
             if user.is_superuser:
                 return queryset
-            queryset = queryset.filter(Q(user=user) | Q(collaborators=user) | Q(is_demo=True))
+            queryset = queryset.filter(
+                id__in=get_accessible_project_ids(self.request)
+            )
         return queryset
 
     def create(self, request, *args, **kwargs):
         user = request.user
         project_type = request.POST.get("project_type")
         name = request.POST.get("name")
-        algorithms = json.loads(request.POST.get("algorithms"))
+        algorithms = get_json_field(request, "algorithms", {}, dict)
+        file_ids = set()
+        for field in ["normal_files", "tumor_files", "bed_files"]:
+            file_ids.update(map(str, get_json_field(request, field, [], list)))
+
+        # Projects can only use files of their owner and demo files
+        files = list(
+            File.objects.filter(Q(user=user) | Q(is_demo=True), uuid__in=file_ids)
+        )
+        missing_ids = file_ids - {file.uuid for file in files}
+        if missing_ids:
+            raise ValidationError(
+                {"files": f"Unknown files: {', '.join(sorted(missing_ids))}"}
+            )
+
         new_project = Project.objects.create(
             user=user,
             project_type=project_type,
@@ -181,35 +256,15 @@ class ProjectViewSet(viewsets.ModelViewSet):
             status="PENDING",
         )
 
-        normal_file_ids = json.loads(request.POST.get("normal_files", "[]"))
-        tumor_file_ids = json.loads(request.POST.get("tumor_files", "[]"))
-        bed_file_ids = json.loads(request.POST.get("bed_files", "[]"))
-
         project_files = ProjectFiles.objects.create(project=new_project)
-
-        for file_id in normal_file_ids:
-            file = File.objects.get(uuid=file_id)
-            project_files.files.add(file)
-
-        for file_id in tumor_file_ids:
-            file = File.objects.get(uuid=file_id)
-            project_files.files.add(file)
-
-        for file_id in bed_file_ids:
-            file = File.objects.get(uuid=file_id)
-            project_files.files.add(file)
-
-        project_files.save()
+        project_files.files.add(*files)
 
         # Create project directory under user directory
         user_dir = get_user_dir(user)
         project_dir = os.path.join(user_dir, f"{new_project.id}_{new_project.name}")
         os.makedirs(project_dir)
         try:
-            pool = ThreadPool(processes=1)
-            async_result = pool.apply_async(submit_cosap_dna_job, (new_project.id,))
-            task_id = async_result.get()
-            ProjectTask.objects.create(project=new_project, task_id=task_id)
+            self.submit_project(new_project)
 
         except Exception as e:
             new_project.status = "FAILED"
@@ -217,46 +272,82 @@ class ProjectViewSet(viewsets.ModelViewSet):
 
         return HttpResponse(status=status.HTTP_201_CREATED)
 
+    def submit_project(self, project):
+        """
+        Submits the pipeline of a project and records the Celery task with
+        the total size of the project inputs.
+        """
+        from multiprocessing.pool import ThreadPool
+
+        with timed("celery"), PIPELINE_SUBMISSION_LATENCY.labels("submit").time():
+            pool = ThreadPool(processes=1)
+            async_result = pool.apply_async(submit_cosap_dna_job, (project.id,))
+            task_id = async_result.get()
+
+        input_files = File.objects.filter(projectfiles__project=project)
+        ProjectTask.objects.create(
+            project=project, task_id=task_id, input_size=get_files_size(input_files)
+        )
+
+    def list(self, request, *args, **kwargs):
+        def build_payload():
+            queryset = self.get_queryset().filter(is_demo=False)
+            serializer = self.get_serializer(queryset, many=True)
+            projects = [dict(project) for project in serializer.data]
+            projects += get_demo_project_entries()
+            projects.sort(key=lambda project: project["created_at"], reverse=True)
+            return projects
+
+        user = request.user
+        cache_names = [
+            PROJECT_LIST_CACHE,
+            DEMO_CACHE,
+            get_project_list_cache_name(ALL_PROJECTS if user.is_superuser else user.id),
+        ]
+        return cached_response(request, cache_names, f"list-{user.id}", build_payload)
+
     def retrieve(self, request, pk):
-        project = Project.objects.get(id=pk)
+        if not has_project_access(request, pk):
+            raise Http404
 
-        project_metadata = {
-            "name": project.name,
-            "status": project.status,
-            "collaborators": ",".join(
-                [col.email for col in project.collaborators.all()]
-            ),
-            "time": project.created_at,
-        }
+        def build_payload():
+            project = self.get_object()
 
-        try:
-            results = ProjectSummary.objects.get(project=project)
-        except Exception as e:
-            results = None
+            project_metadata = {
+                "name": project.name,
+                "status": project.status,
+                "collaborators": ",".join(
+                    [col.email for col in project.collaborators.all()]
+                ),
+                "time": project.created_at,
+            }
 
-        return Response(
-            {
+            try:
+                results = ProjectSummary.objects.get(project=project)
+            except Exception as e:
+                results = None
+
+            return {
                 "metadata": project_metadata,
                 "summary": model_to_dict(results) if results else None,
-            },
-            status=status.HTTP_200_OK,
+            }
+
+        return cached_response(
+            request, [get_project_cache_name(pk)], f"detail-{pk}", build_payload
         )
 
     @action(detail=True, methods=["post"])
     def rerun_project(self, request, pk=None):
         # Allow only user that created the project to rerun it
-        if request.user != Project.objects.get(id=pk).user:
+        project = get_object_or_404(Project, id=pk)
+        if request.user != project.user:
             return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
 
-        project = Project.objects.get(id=pk)
         project.status = "PENDING"
         project.save()
 
         try:
-            pool = ThreadPool(processes=1)
-            async_result = pool.apply_async(submit_cosap_dna_job, (project.id,))
-            task_id = async_result.get()
-            ProjectTask.objects.create(project=project, task_id=task_id)
+            self.submit_project(project)
 
         except Exception as e:
             print(f"Error submitting job: {e}")
@@ -265,36 +356,284 @@ class ProjectViewSet(viewsets.ModelViewSet):
 
         return HttpResponse(status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=["post"])
+    def cancel_project(self, request, pk=None):
+        """
+        Stops the pipeline of a pending or running project.
+
+        Set `clean_outputs` to true to also remove the partial outputs
+        written to the project directory.
+
+        The Celery task is revoked and sent SIGTERM; stopping the tool
+        containers it started is left to the COSAP worker.
+        """
+        project = get_object_or_404(Project, id=pk)
+
+        # Allow only user that created the project to cancel it
+        if request.user != project.user:
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+
+        if project.status not in (Project.PENDING, Project.IN_PROGRESS):
+            return Response(
+                {"status": "Only pending or running projects can be cancelled."},
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        task_ids = list(
+            ProjectTask.objects.filter(project=project).values_list(
+                "task_id", flat=True
+            )
+        )
+        try:
+            with timed("celery"), PIPELINE_SUBMISSION_LATENCY.labels("revoke").time():
+                revoke_cosap_dna_job(task_ids)
+        except Exception as e:
+            logger.error(f"Could not revoke the tasks of project {project.id}: {e}")
+            return HttpResponse(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+        project.status = Project.CANCELLED
+        project.save()
+
+        if str(request.data.get("clean_outputs", "")).lower() in ("true", "1"):
+            clear_directory(get_project_dir(project))
+            reconcile_project_usage(project)
+
+        return HttpResponse(status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"])
+    def storage(self, request, pk=None):
+        """
+        Returns the disk usage of the project directory.
+        """
+        if not has_project_access(request, pk):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        return Response(get_project_storage(pk))
+
+    @action(detail=True, methods=["get"])
+    def summary_facets(self, request, pk=None):
+        """
+        Returns variant counts of the project by gene, classification,
+        consequence, chromosome and allele frequency bin.
+        """
+        if not has_project_access(request, pk):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        project = get_object_or_404(Project, id=pk)
+        return Response(get_variant_facets(project))
+
+    @action(detail=False, methods=["get"])
+    def compare(self, request):
+        """
+        Compares the variants of the projects given as comma separated ids
+        in `projects`: pairwise overlaps and Jaccard indices, and how many
+        projects each variant recurs in.
+        """
+        project_ids = request.query_params.get("projects", "").split(",")
+        if not all(project_id.isdigit() for project_id in project_ids):
+            raise ValidationError({"projects": "Invalid project ids."})
+
+        if len(set(project_ids)) != len(project_ids):
+            raise ValidationError({"projects": "Duplicate project ids."})
+
+        project_ids = set(map(int, project_ids))
+        if not 2 <= len(project_ids) <= settings.COHORT_MAX_PROJECTS:
+            raise ValidationError(
+                {
+                    "projects": "Between 2 and "
+                    f"{settings.COHORT_MAX_PROJECTS} projects are required."
+                }
+            )
+
+        if not all(has_project_access(request, pk) for pk in project_ids):
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        projects = Project.objects.filter(id__in=project_ids).only(
+            "id", "name", "algorithms"
+        )
+        return Response(compare_projects(projects))
+
+    @action(detail=False, methods=["post"])
+    def estimate(self, request):
+        """
+        Predicts the duration and storage needs of a project before it is
+        submitted, using the same parameters as project creation.
+        """
+        project_type = request.POST.get("project_type")
+        algorithms = get_json_field(request, "algorithms", {}, dict)
+
+        file_ids = []
+        for sample_files in ("normal_files", "tumor_files", "bed_files"):
+            file_ids += get_json_field(request, sample_files, [], list)
+
+        input_files = File.objects.filter(
+            Q(user=request.user) | Q(is_demo=True), Q(uuid__in=file_ids)
+        )
+        estimate = estimate_project_resources(
+            project_type, algorithms, get_files_size(input_files)
+        )
+        return Response(estimate, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["post"])
+    def stage_metrics(self, request, pk=None):
+        """
+        Records the resource usage of a finished pipeline stage.
+        Reported by the COSAP worker, so only admin users are allowed.
+        """
+        if not request.user.is_staff:
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+
+        try:
+            project_task = ProjectTask.objects.get(
+                project_id=pk, task_id=request.data["task_id"]
+            )
+            record_stage_metric(
+                project_task,
+                stage=request.data["stage"],
+                wall_time=float(request.data["wall_time"]),
+                cpu_time=(
+                    float(request.data["cpu_time"])
+                    if request.data.get("cpu_time") is not None
+                    else None
+                ),
+                output_size=int(request.data.get("output_size", 0)),
+            )
+        except ProjectTask.DoesNotExist:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+        except (KeyError, TypeError, ValueError):
+            return HttpResponse(status=status.HTTP_400_BAD_REQUEST)
+
+        return HttpResponse(status=status.HTTP_201_CREATED)
+
+    def destroy(self, request, pk=None):
+        """
+        Deletes the project like `delete_project`.
+        """
+        project = get_object_or_404(Project, id=pk)
+
+        # Allow only user that created the project to delete it
+        if request.user != project.user:
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+
+        self.tombstone_project(project)
+        return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
     @action(detail=True, methods=["post"])
     def delete_project(self, request, pk=None):
-        # Allow only user that created the project to delete it
-        if request.user != Project.objects.get(id=pk).user:
+        """
+        Hides the project at once and stops its pipeline. The project
+        directory is removed later by `cosapweb.api.reclaimer`.
+        """
+        project = get_object_or_404(Project, id=pk)
+
+        # Allow only user that created the project to delete it
+        if request.user != project.user:
             return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
-        project = Project.objects.get(id=pk)
-        project.delete()
+
+        self.tombstone_project(project)
         return HttpResponse(status=status.HTTP_200_OK)
 
+    def tombstone_project(self, project):
+        if project.status in (Project.PENDING, Project.IN_PROGRESS):
+            task_ids = list(
+                ProjectTask.objects.filter(project=project).values_list(
+                    "task_id", flat=True
+                )
+            )
+            try:
+                with timed("celery"):
+                    revoke_cosap_dna_job(task_ids)
+            except Exception as e:
+                logger.error(f"Error revoking job: {e}")
+
+        project.deleted_at = timezone.now()
+        project.save(update_fields=["deleted_at"])
+        if settings.RECLAIM_IN_BACKGROUND:
+            project_reclaimer.schedule()
+
 
-class ProjectSNVViewset(viewsets.ViewSet):
+class ProjectSNVViewset(ReplicaReadMixin, viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def retrieve(self, request, pk=None):
-        project = Project.objects.get(id=pk)
-        project_snvs = ProjectSNVs.objects.get(project=project)
+        if not has_project_access(request, pk):
+            raise Http404
 
-        all_variants = []
-        for snv in project_snvs.snvs.all():
-            variant_dict = model_to_dict(snv)
-            try:
-                variant_dict["af"] = ProjectSNVData.objects.get(
-                    project=project, snv=snv
-                ).allele_frequency
-            except Exception as e:
-                variant_dict["af"] = -1
+        if int(pk) in get_demo_project_ids():
+            return Response(get_demo_variants(int(pk)))
+
+        project = get_object_or_404(Project, id=pk)
+        return Response(get_project_variants(project))
+
+
+class VariantSearchViewSet(ReplicaReadMixin, viewsets.GenericViewSet):
+    """
+    View to search the variants of all projects the requesting user can see.
+
+    Supports `gene` (comma separated symbols), `rs_id`, `cosmic_id`,
+    `aa_change` and `chromosome` with optional `start` and `end` positions.
+    Matching project variants are returned page by page, along with the
+    number of matches in each project.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
 
-            all_variants.append(variant_dict)
+    queryset = ProjectVariant.objects.select_related("snv", "project")
+    serializer_class = serializers.ProjectVariantSearchSerializer
+    pagination_class = VariantSearchPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        filters = {}
+        if params.get("gene"):
+            filters["snv__gene_symbol__in"] = params["gene"].split(",")
+        for param in ("rs_id", "cosmic_id"):
+            if params.get(param):
+                filters[f"snv__{param}"] = params[param]
+        if params.get("chromosome"):
+            filters["snv__chromosome"] = params["chromosome"]
+        for param, lookup in (("start", "gte"), ("end", "lte")):
+            if params.get(param):
+                if not params.get("chromosome"):
+                    raise ValidationError({param: "Requires a chromosome."})
+                if not params[param].isdigit():
+                    raise ValidationError({param: "Invalid position."})
+                filters[f"snv__position__{lookup}"] = int(params[param])
+
+        if not filters:
+            raise ValidationError(
+                "Search by gene, rs_id, cosmic_id or chromosome is required."
+            )
 
-        return Response(all_variants)
+        # aa_change narrows the other filters, it is not indexed
+        if params.get("aa_change"):
+            filters["snv__aa_change__icontains"] = params["aa_change"]
+
+        return self.queryset.filter(
+            project_id__in=get_accessible_project_ids(self.request), **filters
+        ).order_by("snv_id", "project_id")
+
+    def list(self, request):
+        queryset = self.get_queryset()
+        project_counts = (
+            queryset.order_by("project_id")
+            .values("project_id", "project__name")
+            .annotate(count=Count("id"))
+        )
+
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response(
+            self.get_serializer(page, many=True).data
+        )
+        response.data["projects"] = [
+            {
+                "project": row["project_id"],
+                "project_name": row["project__name"],
+                "count": row["count"],
+            }
+            for row in project_counts
+        ]
+        return response
 
 
 class IGVDataView(views.APIView):
@@ -312,9 +651,12 @@ class IGVDataView(views.APIView):
         length = int(m.group(2) or size) - offset + 1
 
         data = None
-        with open(path, "rb") as f:
+        with timed("fs"), open(path, "rb") as f:
             f.seek(offset)
             data = f.read(length)
+        count("fs_bytes", len(data))
+        FILE_BYTES_SERVED.labels("igv").inc(len(data))
+        IGV_RANGE_SIZE.observe(len(data))
 
         response = HttpResponse(
             data,
@@ -333,33 +675,179 @@ class IGVDataView(views.APIView):
         if decoded_path.endswith(".bai"):
             return FileViewSet().download(request, b64_string)
 
-        file_path = convert_file_relative_path_to_absolute_path(decoded_path)
+        file_path = get_accessible_file_path(request, decoded_path)
 
-        if not os.path.exists(file_path):
-            raise Http404
+        try:
+            if not file_path or not ensure_file_available(file_path):
+                raise Http404
+        except RestorePending:
+            return restore_pending_response()
 
         range_header = request.headers.get("Range")
         return self.ranged_data_response(range_header, file_path)
 
 
-class ActionViewSet(viewsets.ModelViewSet):
+class MetricsView(views.APIView):
+    """
+    Prometheus metrics of this process, or of all worker processes when
+    PROMETHEUS_MULTIPROC_DIR is set, followed by gauges read at scrape time.
+
+    Served to scrapers sending METRICS_TOKEN, to addresses in
+    METRICS_ALLOWED_IPS and to staff users.
+    """
+
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    # Seconds the values read from the database and the broker are reused,
+    # so frequent or parallel scrapes do not repeat them
+    scrape_cache_timeout = 10
+
+    def has_access(self, request):
+        keyword, _, key = request.headers.get("Authorization", "").partition(" ")
+        key = key.strip()
+        metrics_token = settings.METRICS_TOKEN
+        if (
+            metrics_token
+            and keyword == "Bearer"
+            and hmac.compare_digest(key.encode(), metrics_token.encode())
+        ):
+            return True
+
+        if request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS:
+            return True
+
+        token = get_token(key) if keyword in ("Token", "Bearer") and key else None
+        return token is not None and token.user.is_active and token.user.is_staff
+
+    def get_registry(self):
+        if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+            return REGISTRY
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+
+    def get_scrape_values(self):
+        values = shared_cache_get("metrics:scrape")
+        if values is None:
+            values = {
+                "status_counts": dict(
+                    Project.objects.values_list("status")
+                    .annotate(Count("id"))
+                    .order_by()
+                ),
+                "queue_depth": get_cosap_queue_depth(),
+            }
+            shared_cache_set("metrics:scrape", values, self.scrape_cache_timeout)
+        return values
+
+    def get_scrape_registry(self):
+        registry = CollectorRegistry()
+        values = self.get_scrape_values()
+
+        projects = Gauge(
+            "cosap_projects",
+            "Projects by status.",
+            ["status"],
+            registry=registry,
+        )
+        status_counts = values["status_counts"]
+        for status_value, _ in Project.PROJECT_STATUS_CHOICES:
+            projects.labels(status_value).set(status_counts.get(status_value, 0))
+
+        queue_depth = values["queue_depth"]
+        if queue_depth is not None:
+            Gauge(
+                "cosap_worker_queue_depth",
+                "Pipeline tasks waiting in the worker queue.",
+                registry=registry,
+            ).set(queue_depth)
+
+        return registry
+
+    def get(self, request):
+        if not self.has_access(request):
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+
+        output = generate_latest(self.get_registry()) + generate_latest(
+            self.get_scrape_registry()
+        )
+        return HttpResponse(output, content_type=CONTENT_TYPE_LATEST)
+
+
+class ActionViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
-    queryset = Action.objects.order_by("-created_at")
+    queryset = Action.objects.select_related("associated_user").order_by(
+        "-created_at", "-id"
+    )
     serializer_class = serializers.ActionSerializer
+    pagination_class = ActionCursorPagination
 
     def get_queryset(self):
         """
         Get the list of items for this view.
 
-        Overridden to only return projects where the requesting user
-        is the creator of the project or a collaborator in the project.
+        Overridden to only return actions of the requesting user.
+        If `since` is given, only actions created after it are returned.
         """
         queryset = self.queryset
 
         if isinstance(queryset, QuerySet):
             user = self.request.user
             queryset = queryset.filter(Q(associated_user=user))
+
+            since = self.request.query_params.get("since")
+            if since:
+                since_datetime = parse_datetime(since)
+                if since_datetime is None:
+                    raise ValidationError({"since": "Invalid datetime."})
+                queryset = queryset.filter(created_at__gt=since_datetime)
+        return queryset
+
+
+class FileCatalogViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    View to browse the files of the requesting user and demo files, page by page.
+
+    Supports `search` (name prefix, or similar names with `search_mode=fuzzy`),
+    `file_type`, `sample_type`, `uploaded_after` and `uploaded_before` filters.
+    """
+
+    permission_classes = [permissions.IsAuthenticated]
+
+    queryset = File.objects.only(*serializers.FileCatalogSerializer.Meta.fields)
+    serializer_class = serializers.FileCatalogSerializer
+    pagination_class = FileCatalogCursorPagination
+
+    def get_queryset(self):
+        params = self.request.query_params
+        queryset = self.queryset.filter(Q(user=self.request.user) | Q(is_demo=True))
+
+        search = params.get("search")
+        if search:
+            if params.get("search_mode") == "fuzzy":
+                queryset = queryset.filter(name__trigram_similar=search)
+            else:
+                queryset = queryset.filter(name__istartswith=search)
+
+        if params.get("file_type"):
+            queryset = queryset.filter(file_type=params["file_type"].upper())
+
+        if params.get("sample_type"):
+            queryset = queryset.filter(sample_type=params["sample_type"].upper())
+
+        for param, lookup in (
+            ("uploaded_after", "uploaded_at__gte"),
+            ("uploaded_before", "uploaded_at__lt"),
+        ):
+            if params.get(param):
+                value = parse_datetime(params[param])
+                if value is None:
+                    raise ValidationError({param: "Invalid datetime."})
+                queryset = queryset.filter(**{lookup: value})
+
         return queryset
 
 
@@ -382,42 +870,69 @@ class FileViewSet(ProcessView, PatchView, viewsets.ViewSet):
         )
 
         if return_type and (return_type == "projectFileMap"):
-            project = Project.objects.get(id=project_id)
-
-            if not project:
+            if not has_project_access(request, project_id):
                 return Response(status=status.HTTP_404_NOT_FOUND)
 
+            project = get_object_or_404(Project, id=project_id)
+
             project_dir = get_project_dir(project)
-            files = create_chonky_filemap(project_dir, project.name)
+            touch_project(project.id)
+            with timed("filemap"):
+                files = create_chonky_filemap(project_dir, project.name)
+                files = apply_manifest(files, project_dir)
             return Response(files)
 
+        def get_files(**filters):
+            # Demo files come from the shared demo cache, not the database
+            user_files = File.objects.filter(
+                user=request.user, is_demo=False, **filters
+            ).values("id", "uuid", "name")
+            demo_files = [
+                file
+                for file in get_demo_files()
+                if all(file[field] == value for field, value in filters.items())
+            ]
+            return sorted([*user_files, *demo_files], key=lambda file: file["id"])
+
         if sample_type:
-            files = File.objects.filter((Q(user=request.user) | Q(is_demo=True)), Q(sample_type=sample_type))
             files = {
-                files[i].uuid: f"{i+1} - {files[i].name}" for i in range(len(files))
+                file["uuid"]: f"{i+1} - {file['name']}"
+                for i, file in enumerate(get_files(sample_type=sample_type))
             }
             return Response(files)
 
         if file_type:
             files = {
-                file.uuid: f"{file.project.name} - {file.name}"
-                for file in File.objects.filter((Q(user=request.user) | Q(is_demo=True)), Q(file_type=file_type))
+                file["uuid"]: file["name"] for file in get_files(file_type=file_type)
             }
             return Response(files)
 
-        files = [file.filename for file in File.objects.filter(Q(user=request.user) | Q(is_demo=True))]
+        files = [file["name"] for file in get_files()]
         return Response(files)
 
     def create(self, request, *args, **kwargs):
+        upload_size = (
+            request.FILES["file"].size
+            if request.FILES.get("file")
+            else int(request.headers.get("Upload-Length") or 0)
+        )
+        if exceeds_quota(request.user, upload_size):
+            return Response(
+                "Storage quota exceeded.",
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+
         if request.FILES.get("file"):
             filename = request.FILES.get("file").name
             sample_type = request.POST.get("sample_type")
             file = request.FILES.get("file")
             user = request.user
+            UPLOAD_BYTES.inc(file.size)
             f = File.objects.create(
                 name=filename, user=user, file=file, sample_type=sample_type
             )
             f.save()
+            add_user_files_usage(user, file.size, 1)
             return Response(str(f.uuid))
         else:
             response = super().post(request, *args, **kwargs)
@@ -431,10 +946,13 @@ class FileViewSet(ProcessView, PatchView, viewsets.ViewSet):
 
     def download(self, request, b64_string):
         decoded_path = base64.b64decode(b64_string).decode("utf-8")
-        file_path = convert_file_relative_path_to_absolute_path(decoded_path)
+        file_path = get_accessible_file_path(request, decoded_path)
 
-        if not os.path.exists(file_path):
-            raise Http404
+        try:
+            if not file_path or not ensure_file_available(file_path):
+                raise Http404
+        except RestorePending:
+            return restore_pending_response()
 
         filename = os.path.basename(file_path)
         response = StreamingHttpResponse(
@@ -443,9 +961,14 @@ class FileViewSet(ProcessView, PatchView, viewsets.ViewSet):
             ),
             content_type="application/octet-stream",
         )
-        response["Content-Length"] = os.path.getsize(file_path)
+        file_size = os.path.getsize(file_path)
+        response["Content-Length"] = file_size
+        count("fs_bytes", file_size)
+        FILE_BYTES_SERVED.labels("download").inc(file_size)
         response["Content-Disposition"] = f"attachment; filename={filename}"
         return response
 
     def patch(self, request, *args, **kwargs):
+        UPLOAD_CHUNKS.inc()
+        UPLOAD_BYTES.inc(int(request.headers.get("Content-Length") or 0))
         return super().patch(request, *args, **kwargs)
@@ -9,8 +9,54 @@ https://docs.djangoproject.com/en/4.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "cosapweb.settings")
+# Connections are kept per thread, and the threads that run sync code under
+# ASGI are not the ones where request_finished closes old connections, so
+# persistent connections pile up. Every request then opens a connection, so
+# connect through a pooler such as the pgbouncer service of docker-compose.
+os.environ.setdefault("COSAP_DB_CONN_MAX_AGE", "0")
 
-application = get_asgi_application()
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    ASGI handler that sends responses providing `aiter_chunks` without
+    blocking the event loop. Django 4.0 iterates streaming responses
+    synchronously, which would stall every request of the process while
+    a file is read.
+    """
+
+    async def send_response(self, response, send):
+        if not hasattr(response, "aiter_chunks"):
+            return await super().send_response(response, send)
+
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode("ascii")
+            if isinstance(value, str):
+                value = value.encode("latin1")
+            response_headers.append((bytes(header), bytes(value)))
+        for c in response.cookies.values():
+            response_headers.append(
+                (b"Set-Cookie", c.output(header="").encode("ascii").strip())
+            )
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": response.status_code,
+                "headers": response_headers,
+            }
+        )
+        async for chunk in response.aiter_chunks():
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body"})
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+django.setup(set_prefix=False)
+application = StreamingASGIHandler()
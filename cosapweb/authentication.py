@@ -1,7 +1,78 @@
-from django.contrib.auth.models import User
+from django.conf import settings
 from rest_framework import authentication, exceptions
 from rest_framework.authtoken.models import Token
 
+from .common.cache import (TTLCache, bump_cache_version, get_cache_version,
+                           shared_cache_get, shared_cache_set)
+from .common.instrumentation import timed
 
-class BearerAuthentication(authentication.TokenAuthentication):
+# Tokens are cached in two tiers: a small LRU in every process and the shared
+# cache. Both are keyed by a version of the token kept in the shared cache,
+# which is checked on every lookup, so invalidating a token reaches all
+# processes at once.
+_local_token_cache = TTLCache(
+    "auth_token_local",
+    maxsize=settings.AUTH_TOKEN_CACHE_SIZE,
+    ttl=settings.AUTH_TOKEN_CACHE_LOCAL_TTL,
+)
+
+
+def _get_token_cache_name(key):
+    return f"auth_token:{key}"
+
+
+def get_token(key):
+    """
+    Returns the `Token` with its user for the given key, or None if the key
+    does not exist.
+    """
+    name = _get_token_cache_name(key)
+    # Unknown keys get no version, so invalid tokens do not fill the cache
+    version = get_cache_version(name, create=False)
+    token = None
+    if version is not None:
+        cached = _local_token_cache.get(key)
+        if cached is not None and cached[1] == version:
+            return cached[0]
+        token = shared_cache_get(f"{name}:{version}")
+
+    if token is None:
+        try:
+            token = Token.objects.select_related("user").get(key=key)
+        except Token.DoesNotExist:
+            return None
+        if version is None:
+            version = bump_cache_version(name)
+        shared_cache_set(
+            f"{name}:{version}", token, settings.AUTH_TOKEN_CACHE_SHARED_TTL
+        )
+
+    _local_token_cache.set(key, (token, version))
+    return token
+
+
+def invalidate_token(key):
+    _local_token_cache.delete(key)
+    bump_cache_version(_get_token_cache_name(key))
+
+
+class CachedTokenAuthentication(authentication.TokenAuthentication):
+    """
+    Token authentication that looks tokens up in the token cache before
+    falling back to the database.
+    """
+
+    def authenticate_credentials(self, key):
+        with timed("auth"):
+            token = get_token(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed("Invalid token.")
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed("User inactive or deleted.")
+
+        return (token.user, token)
+
+
+class BearerAuthentication(CachedTokenAuthentication):
     keyword = "Bearer"
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from .metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    Thread-safe in-process LRU cache whose entries expire after `ttl` seconds.
+    Hits and misses are counted under `name` in the cache metrics.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 30):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[1] < time.monotonic():
+                del self._data[key]
+                item = None
+
+            if item is None:
+                CACHE_REQUESTS.labels(self.name, "miss").inc()
+                return default
+
+            self._data.move_to_end(key)
+            CACHE_REQUESTS.labels(self.name, "hit").inc()
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def shared_cache_get(key, default=None):
+    """
+    Reads from the shared cache, treating an unreachable cache as a miss.
+    Hits and misses are counted by the key prefix before the first colon.
+    """
+    try:
+        value = cache.get(key)
+    except Exception as e:
+        logger.warning(f"Shared cache unavailable: {e}")
+        value = None
+
+    CACHE_REQUESTS.labels(
+        key.split(":", 1)[0], "miss" if value is None else "hit"
+    ).inc()
+    return default if value is None else value
+
+
+def shared_cache_set(key, value, timeout=None):
+    try:
+        cache.set(key, value, timeout)
+    except Exception as e:
+        logger.warning(f"Shared cache unavailable: {e}")
+
+
+def shared_cache_delete(key):
+    try:
+        cache.delete(key)
+    except Exception as e:
+        logger.warning(f"Shared cache unavailable: {e}")
+
+
+def get_cache_version(name, create=True):
+    """
+    Returns the current version of a group of cached values. Versions are
+    nanosecond timestamps of the last invalidation. Without `create`, None
+    is returned for groups that have no version yet.
+    """
+    version = shared_cache_get(f"version:{name}")
+    if version is None and create:
+        version = bump_cache_version(name)
+    return version
+
+
+def get_cache_versions(names) -> dict:
+    """
+    Returns the current versions of several groups of cached values, read
+    from the shared cache at once.
+    """
+    keys = {f"version:{name}": name for name in names}
+    try:
+        found = cache.get_many(list(keys))
+    except Exception as e:
+        logger.warning(f"Shared cache unavailable: {e}")
+        found = {}
+
+    CACHE_REQUESTS.labels("version", "hit").inc(len(found))
+    CACHE_REQUESTS.labels("version", "miss").inc(len(keys) - len(found))
+    versions = {keys[key]: version for key, version in found.items()}
+    for name in names:
+        if name not in versions:
+            versions[name] = bump_cache_version(name)
+    return versions
+
+
+def bump_cache_version(name) -> int:
+    """
+    Invalidates every cached value keyed by the version of `name`.
+    """
+    version = time.time_ns()
+    shared_cache_set(f"version:{name}", version, None)
+    return version
@@ -0,0 +1,103 @@
+import contextvars
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_request_metrics = contextvars.ContextVar("request_metrics", default=None)
+
+
+class RequestMetrics:
+    """
+    Time spent and amounts counted while handling a single request.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+
+    def add_duration(self, name, seconds):
+        self.durations[name] += seconds
+        self.counts[name] += 1
+
+    def add_count(self, name, value=1):
+        self.counts[name] += value
+
+    def get_total_duration(self):
+        return time.perf_counter() - self.started_at
+
+    def as_server_timing(self):
+        timings = [
+            f"{name};dur={seconds * 1000:.2f}"
+            for name, seconds in self.durations.items()
+        ]
+        timings.append(f"total;dur={self.get_total_duration() * 1000:.2f}")
+        return ", ".join(timings)
+
+
+def _time_query(execute, sql, params, many, context):
+    metrics = _request_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_duration("db", time.perf_counter() - start)
+
+
+def _install_query_timing(connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def install_query_timing():
+    """
+    Times the queries of requests on every database connection, including
+    those opened later in other threads, such as the threads of sync views
+    under ASGI.
+    """
+    connection_created.connect(_install_query_timing)
+    for connection in connections.all():
+        _install_query_timing(connection)
+
+
+def start_request_metrics():
+    """
+    Starts collecting metrics for the current request and returns them with
+    the token to pass to `stop_request_metrics`.
+    """
+    metrics = RequestMetrics()
+    return metrics, _request_metrics.set(metrics)
+
+
+def stop_request_metrics(token):
+    _request_metrics.reset(token)
+
+
+def get_request_metrics():
+    return _request_metrics.get()
+
+
+@contextmanager
+def timed(name):
+    """
+    Adds the time spent in the block to the metrics of the current request.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = _request_metrics.get()
+        if metrics is not None:
+            metrics.add_duration(name, time.perf_counter() - start)
+
+
+def count(name, value=1):
+    metrics = _request_metrics.get()
+    if metrics is not None:
+        metrics.add_count(name, value)
@@ -0,0 +1,51 @@
+from prometheus_client import Counter, Histogram
+
+# Metrics are exported by `cosapweb.api.views.MetricsView`. When several
+# worker processes serve the API, set PROMETHEUS_MULTIPROC_DIR to a shared
+# empty directory before starting them so the values of all processes are
+# aggregated.
+
+REQUEST_LATENCY = Histogram(
+    "cosap_http_request_duration_seconds",
+    "Request latency by view and action.",
+    ["view", "action", "method"],
+)
+
+FILE_BYTES_SERVED = Counter(
+    "cosap_file_bytes_served_total",
+    "Bytes of project files sent to clients.",
+    ["endpoint"],
+)
+
+IGV_RANGE_SIZE = Histogram(
+    "cosap_igv_range_size_bytes",
+    "Size of ranges requested by IGV.",
+    buckets=[2**power for power in range(10, 28, 2)],
+)
+
+UPLOAD_BYTES = Counter(
+    "cosap_upload_bytes_total",
+    "Bytes received in file uploads.",
+)
+
+UPLOAD_CHUNKS = Counter(
+    "cosap_upload_chunks_total",
+    "Chunks received in chunked file uploads.",
+)
+
+PIPELINE_SUBMISSION_LATENCY = Histogram(
+    "cosap_pipeline_submission_duration_seconds",
+    "Time spent sending pipeline tasks to the broker.",
+    ["operation"],
+)
+
+STORAGE_RECLAIMED_BYTES = Counter(
+    "cosap_storage_reclaimed_bytes_total",
+    "Bytes freed by removing the directories of deleted projects.",
+)
+
+CACHE_REQUESTS = Counter(
+    "cosap_cache_requests_total",
+    "Cache lookups by cache and result.",
+    ["cache", "result"],
+)
@@ -0,0 +1,42 @@
+from django.test import SimpleTestCase
+
+from .tracing import AdaptiveTracesSampler
+
+ENDPOINT_RATES = [
+    ("*", r"^/(async/)?(igv|file)/", 0.001),
+    ("POST", r"^/projects/?$", 1.0),
+]
+
+
+def get_sampling_context(method, path):
+    return {"wsgi_environ": {"REQUEST_METHOD": method, "PATH_INFO": path}}
+
+
+class AdaptiveTracesSamplerTests(SimpleTestCase):
+    def setUp(self):
+        self.sampler = AdaptiveTracesSampler(
+            0.1, endpoint_rates=ENDPOINT_RATES, target_per_second=2
+        )
+
+    def sample(self, method, path, times=1):
+        for _ in range(times):
+            rate = self.sampler(get_sampling_context(method, path))
+        return rate
+
+    def test_igv_traffic_does_not_throttle_other_endpoints(self):
+        # 300 IGV requests per second are expected to send 0.3 traces
+        self.sample("GET", "/igv/cGF0aA==", times=3000)
+
+        self.assertEqual(self.sample("POST", "/projects/"), 1.0)
+        self.assertEqual(self.sample("GET", "/projects/"), 0.1)
+        self.assertEqual(self.sample("GET", "/igv/cGF0aA=="), 0.001)
+
+    def test_sampled_endpoints_are_scaled_to_the_target(self):
+        rate = self.sample("GET", "/projects/", times=1000)
+        # 100 requests per second at 0.1 would send 10 traces per second
+        self.assertAlmostEqual(rate * 100, 2, places=1)
+        self.assertEqual(self.sample("POST", "/projects/"), 1.0)
+
+    def test_upstream_decisions_are_kept(self):
+        context = get_sampling_context("GET", "/projects/")
+        self.assertEqual(self.sampler({**context, "parent_sampled": False}), 0.0)
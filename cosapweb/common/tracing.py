@@ -0,0 +1,110 @@
+import re
+import threading
+import time
+
+
+class RequestRateWindow:
+    """
+    Thread-safe sum of weights, such as request counts, added in the last
+    `window` seconds, kept in one-second buckets.
+    """
+
+    def __init__(self, window: int = 10):
+        self.window = window
+        self._buckets = [0.0] * window
+        self._bucket_seconds = [0] * window
+        self._lock = threading.Lock()
+
+    def add(self, weight=1.0, now=None):
+        second = int(now if now is not None else time.monotonic())
+        index = second % self.window
+        with self._lock:
+            if self._bucket_seconds[index] != second:
+                self._bucket_seconds[index] = second
+                self._buckets[index] = 0.0
+            self._buckets[index] += weight
+
+    def get_rate(self, now=None):
+        """
+        Returns the average weight per second over the window.
+        """
+        second = int(now if now is not None else time.monotonic())
+        with self._lock:
+            total = sum(
+                weight
+                for weight, bucket_second in zip(self._buckets, self._bucket_seconds)
+                if second - bucket_second < self.window
+            )
+        return total / self.window
+
+
+class AdaptiveTracesSampler:
+    """
+    Sentry `traces_sampler` choosing the sample rate of a transaction from its
+    method and path.
+
+    `endpoint_rates` is a list of (method, path regex, rate) tried in order,
+    with "*" matching any method; other requests use `default_rate`. Busy
+    processes send about `target_per_second` transactions per second: when
+    the expected number of traced requests exceeds it, rates below 1.0 are
+    scaled down so that it is met. Endpoints with a rate of 1.0 are always
+    traced. Decisions of upstream services are kept.
+
+    Errors are reported by Sentry independently of trace sampling, and slow
+    requests that were not sampled are reported by
+    `cosapweb.middleware.RequestInstrumentationMiddleware`.
+    """
+
+    def __init__(self, default_rate, endpoint_rates=(), target_per_second=None):
+        self.default_rate = default_rate
+        self.endpoint_rates = [
+            (method, re.compile(pattern), rate)
+            for method, pattern, rate in endpoint_rates
+        ]
+        self.target_per_second = target_per_second
+        # Transactions per second of endpoints that are always traced, and
+        # expected transactions per second of the sampled ones
+        self.always_traced = RequestRateWindow()
+        self.sampled_traces = RequestRateWindow()
+
+    def get_endpoint_rate(self, method, path):
+        for rate_method, pattern, rate in self.endpoint_rates:
+            if rate_method in ("*", method) and pattern.search(path):
+                return rate
+        return self.default_rate
+
+    def __call__(self, sampling_context):
+        parent_sampled = sampling_context.get("parent_sampled")
+        if parent_sampled is not None:
+            return float(parent_sampled)
+
+        method, path = self.get_request(sampling_context)
+        if path is None:
+            return self.default_rate
+
+        rate = self.get_endpoint_rate(method, path)
+        if rate >= 1:
+            self.always_traced.add()
+            return rate
+
+        self.sampled_traces.add(rate)
+        if self.target_per_second:
+            expected = self.sampled_traces.get_rate()
+            budget = max(self.target_per_second - self.always_traced.get_rate(), 0)
+            if expected > budget:
+                rate *= budget / expected
+        return rate
+
+    def get_request(self, sampling_context):
+        """
+        Returns method and path of the WSGI or ASGI request being traced.
+        """
+        environ = sampling_context.get("wsgi_environ")
+        if environ is not None:
+            return environ.get("REQUEST_METHOD"), environ.get("PATH_INFO", "")
+
+        scope = sampling_context.get("asgi_scope")
+        if scope is not None and scope.get("type") == "http":
+            return scope.get("method"), scope.get("path", "")
+
+        return None, None
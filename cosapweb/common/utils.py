@@ -1,5 +1,6 @@
 import os
 import re
+import shutil
 from datetime import datetime
 
 from django.conf import settings
@@ -87,6 +88,45 @@ def get_project_dir(project):
     return os.path.join(get_user_dir(project.user), f"{project.id}_{project.name}")
 
 
+def clear_directory(dir_path):
+    """
+    Removes everything inside a directory while keeping the directory itself.
+    """
+    if not os.path.isdir(dir_path):
+        return
+
+    for entry in os.scandir(dir_path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+
+def get_directory_usage(dir_path):
+    """
+    Returns the total size in bytes and the number of files under a
+    directory. Symbolic links are counted but not followed.
+    """
+    total_size, file_count = 0, 0
+    pending = [dir_path]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                else:
+                    total_size += entry.stat(follow_symlinks=False).st_size
+                    file_count += 1
+            except FileNotFoundError:
+                continue
+    return total_size, file_count
+
+
 def convert_file_relative_path_to_absolute_path(file_path: str) -> str:
     """
     Converts relative path to absolute path.
@@ -0,0 +1,36 @@
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL backend that checks a persistent connection before its first
+    use in each request and reconnects if the server dropped it, instead of
+    failing the request.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if (
+            self.connection is not None
+            and not self.health_check_done
+            and not self.in_atomic_block
+        ):
+            self.health_check_done = True
+            if not self.is_usable():
+                self.close()
+
+        super().ensure_connection()
+
+    def connect(self):
+        # A fresh connection does not need to be checked. Checking it while
+        # connecting would also open a transaction before autocommit is set.
+        self.health_check_done = True
+        super().connect()
+
+    def close_if_unusable_or_obsolete(self):
+        # Called when a request starts and finishes
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
@@ -0,0 +1,84 @@
+import contextvars
+import time
+from contextlib import contextmanager, nullcontext
+
+from django.conf import settings
+
+from .common.cache import shared_cache_get, shared_cache_set
+
+REPLICA_DB = "replica"
+
+_read_db = contextvars.ContextVar("read_db", default=None)
+
+
+def replica_available() -> bool:
+    return REPLICA_DB in settings.DATABASES
+
+
+@contextmanager
+def use_replica():
+    """
+    Routes reads inside the block to the read replica, if one is configured.
+    """
+    token = _read_db.set(REPLICA_DB if replica_available() else None)
+    try:
+        yield
+    finally:
+        _read_db.reset(token)
+
+
+@contextmanager
+def use_primary():
+    token = _read_db.set(None)
+    try:
+        yield
+    finally:
+        _read_db.reset(token)
+
+
+def primary_if_recent(version):
+    """
+    Reads from the primary while a cache version is younger than the replica
+    lag window, so values cached under it never come from a lagging replica.
+    """
+    age = time.time_ns() - version
+    if age < settings.REPLICA_READ_YOUR_WRITES_SECONDS * 10**9:
+        return use_primary()
+    return nullcontext()
+
+
+def _get_primary_pin_key(user):
+    return f"primary_pin:{user.id}"
+
+
+def pin_to_primary(user):
+    """
+    Sends the reads of a user to the primary for a while after they write,
+    so they always see their own changes.
+    """
+    shared_cache_set(
+        _get_primary_pin_key(user), True, settings.REPLICA_READ_YOUR_WRITES_SECONDS
+    )
+
+
+def is_pinned_to_primary(user) -> bool:
+    return bool(shared_cache_get(_get_primary_pin_key(user)))
+
+
+class ReplicaRouter:
+    """
+    Sends writes to the primary database. Reads go to the primary unless
+    they run inside `use_replica`.
+    """
+
+    def db_for_read(self, model, **hints):
+        return _read_db.get() or "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
@@ -0,0 +1,235 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import time
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.permissions import SAFE_METHODS
+
+from .common.instrumentation import (install_query_timing,
+                                     start_request_metrics,
+                                     stop_request_metrics)
+from .common.metrics import REQUEST_LATENCY
+from .db_routers import pin_to_primary, replica_available
+
+request_logger = logging.getLogger("cosapweb.requests")
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Measures wall time, database queries and the time spent in instrumented
+    blocks (see `cosapweb.common.instrumentation.timed`) of every request.
+
+    Results are logged as JSON, and sent in the `Server-Timing` header to
+    staff users or when DEBUG is on. A sample of requests is profiled, and
+    profiles of slow requests are saved to REQUEST_PROFILE_DIR.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        install_query_timing()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        metrics, token, profiler = self.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            self.stop_request(token, profiler)
+        return self.finish_request(request, response, metrics, profiler)
+
+    async def __acall__(self, request):
+        metrics, token, profiler = self.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            self.stop_request(token, profiler)
+        return self.finish_request(request, response, metrics, profiler)
+
+    def start_request(self):
+        metrics, token = start_request_metrics()
+        profiler = None
+        if random.random() < settings.REQUEST_PROFILE_SAMPLE_RATE:
+            profiler = self.start_profiler()
+        return metrics, token, profiler
+
+    def stop_request(self, token, profiler):
+        stop_request_metrics(token)
+        if profiler is not None:
+            self.stop_profiler(profiler)
+
+    def finish_request(self, request, response, metrics, profiler):
+        duration = metrics.get_total_duration()
+        if self.can_see_timings(request):
+            response["Server-Timing"] = metrics.as_server_timing()
+        REQUEST_LATENCY.labels(*self.get_view_labels(request)).observe(duration)
+
+        profile_path = None
+        if duration * 1000 >= settings.SLOW_REQUEST_MS:
+            if profiler is not None:
+                profile_path = self.save_profile(profiler, request)
+            self.report_slow_request(request, response, metrics, duration)
+
+        request_logger.info(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.path,
+                    "status": response.status_code,
+                    "duration_ms": round(duration * 1000, 2),
+                    "db_queries": metrics.counts.get("db", 0),
+                    "timings_ms": {
+                        name: round(seconds * 1000, 2)
+                        for name, seconds in metrics.durations.items()
+                    },
+                    "counts": dict(metrics.counts),
+                    "profile": profile_path,
+                }
+            )
+        )
+        return response
+
+    def can_see_timings(self, request):
+        """
+        Timings are shown in DEBUG and to staff users. Users that were not
+        loaded while handling the request are not loaded for this.
+        """
+        if settings.DEBUG:
+            return True
+
+        user = getattr(request, "user", None)
+        if isinstance(user, SimpleLazyObject) and user._wrapped is empty:
+            return False
+        return user is not None and user.is_staff
+
+    def get_view_labels(self, request):
+        """
+        Returns view name, action and method, e.g. ProjectViewSet, list, GET.
+        """
+        resolver_match = getattr(request, "resolver_match", None)
+        if resolver_match is None:
+            return "unmatched", "", request.method
+
+        view = resolver_match.func
+        view_name = getattr(view, "cls", view).__name__
+        actions = getattr(view, "actions", None) or {}
+        action = actions.get(request.method.lower(), request.method.lower())
+        return view_name, action, request.method
+
+    def report_slow_request(self, request, response, metrics, duration):
+        """
+        Sends a slow request to Sentry as a message unless it is traced.
+        """
+        if not settings.SENTRY_DSN:
+            return
+
+        import sentry_sdk
+
+        span = sentry_sdk.get_current_span()
+        if span is not None and span.sampled:
+            return
+
+        view, action, method = self.get_view_labels(request)
+        sentry_sdk.capture_message(
+            f"Slow request: {method} {view}.{action}",
+            level="warning",
+            tags={"view": view, "action": action},
+            contexts={
+                "request_timing": {
+                    "status": response.status_code,
+                    "duration_ms": round(duration * 1000, 2),
+                    "timings_ms": {
+                        name: round(seconds * 1000, 2)
+                        for name, seconds in metrics.durations.items()
+                    },
+                }
+            },
+        )
+
+    def start_profiler(self):
+        if settings.REQUEST_PROFILER == "pyinstrument":
+            from pyinstrument import Profiler
+
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop_profiler(self, profiler):
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        else:
+            profiler.stop()
+
+    def save_profile(self, profiler, request):
+        os.makedirs(settings.REQUEST_PROFILE_DIR, exist_ok=True)
+        name = re.sub(r"[^0-9a-zA-Z]+", "_", request.path).strip("_")[:100]
+        path = os.path.join(
+            settings.REQUEST_PROFILE_DIR,
+            f"{time.time_ns()}_{request.method}_{name}",
+        )
+
+        if isinstance(profiler, cProfile.Profile):
+            path += ".prof"
+            profiler.dump_stats(path)
+        else:
+            path += ".html"
+            with open(path, "w") as f:
+                f.write(profiler.output_html())
+
+        return path
+
+
+class ReadYourWritesMiddleware:
+    """
+    Pins users that have just written something to the primary database.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        response = self.get_response(request)
+        if self.is_write(request):
+            self.pin_user(request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.is_write(request):
+            # Loading a session user queries the database
+            await sync_to_async(self.pin_user)(request)
+        return response
+
+    def is_write(self, request):
+        return replica_available() and request.method not in SAFE_METHODS
+
+    def pin_user(self, request):
+        # DRF sets the token authenticated user on the Django request
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            pin_to_primary(user)
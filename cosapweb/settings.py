@@ -11,13 +11,10 @@ https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
 import os
+import sys
 import tempfile
 from pathlib import Path
 
-import sentry_sdk
-from sentry_sdk.integrations.django import DjangoIntegration
-from sentry_sdk.integrations.logging import ignore_logger
-
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -49,6 +46,7 @@ CORS_ALLOW_HEADERS = [
     "x-csrf-token",
 ]
 CORS_ALLOW_CREDENTIALS = True
+CORS_EXPOSE_HEADERS = ["server-timing"]
 
 # Application definition
 INSTALLED_APPS = [
@@ -58,6 +56,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "rest_framework.authtoken",
     "corsheaders",
     "rest_framework",
@@ -66,12 +65,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "cosapweb.middleware.RequestInstrumentationMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "cosapweb.middleware.ReadYourWritesMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -100,28 +101,136 @@ SESSION_ENGINE = "django.contrib.sessions.backends.signed_cookies"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "cosapweb.authentication.CachedTokenAuthentication",
         "cosapweb.authentication.BearerAuthentication",
     ],
 }
 
+# True when running the test suite with "manage.py test"
+TESTING = sys.argv[1:2] == ["test"]
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+
+# Tests use a local cache, so they do not share it with running servers
+if TESTING or os.environ.get("COSAP_CACHE_BACKEND") == "locmem":
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.environ.get("COSAP_CACHE_URL", "redis://redis:6379/1"),
+        }
+    }
+
+# Authentication tokens are cached per process for AUTH_TOKEN_CACHE_LOCAL_TTL
+# seconds and in the shared cache for AUTH_TOKEN_CACHE_SHARED_TTL seconds.
+# Every lookup checks the version of the token in the shared cache, so
+# deleted tokens and deactivated users are rejected at once everywhere.
+AUTH_TOKEN_CACHE_SIZE = 4096
+AUTH_TOKEN_CACHE_LOCAL_TTL = int(os.environ.get("COSAP_AUTH_TOKEN_LOCAL_TTL", 30))
+AUTH_TOKEN_CACHE_SHARED_TTL = int(os.environ.get("COSAP_AUTH_TOKEN_SHARED_TTL", 300))
+
+# Actions created by signals are written in batches of at most
+# ACTION_LOG_BATCH_SIZE, at the latest ACTION_LOG_FLUSH_INTERVAL seconds
+# after the transaction that created them commits.
+ACTION_LOG_FLUSH_INTERVAL = 1.0
+ACTION_LOG_BATCH_SIZE = 500
+
+# Deleted projects are hidden at once, and their directories are removed by
+# a background thread at most RECLAIM_BYTES_PER_SECOND and
+# RECLAIM_FILES_PER_SECOND. Set COSAP_RECLAIM_IN_BACKGROUND=False to leave
+# this to the reclaim_deleted_projects command instead.
+RECLAIM_IN_BACKGROUND = os.environ.get("COSAP_RECLAIM_IN_BACKGROUND") != "False"
+RECLAIM_BYTES_PER_SECOND = int(
+    os.environ.get("COSAP_RECLAIM_BYTES_PER_SECOND", 100 * 1024 * 1024)
+)
+RECLAIM_FILES_PER_SECOND = int(os.environ.get("COSAP_RECLAIM_FILES_PER_SECOND", 200))
+
+# Disk space per user for uploads and project outputs, unlimited if unset.
+# Usage is tracked incrementally and corrected by the reconcile_storage
+# command, which should run periodically.
+STORAGE_QUOTA_BYTES = (
+    int(float(os.environ["COSAP_STORAGE_QUOTA_GB"]) * 1024**3)
+    if os.environ.get("COSAP_STORAGE_QUOTA_GB")
+    else None
+)
+
+# Finished projects whose files were not read for TIERING_COLD_AFTER_DAYS
+# are compacted by the compact_cold_projects command. Output files matching
+# TIERING_COMPRESS_PATTERNS are compressed with zstd, BAMs are converted to
+# CRAM if TIERING_CRAM_REFERENCE is set, and files whose path in the project
+# matches TIERING_DROP_PATTERNS are deleted. Compacted files are restored
+# when they are read again: zstd files of up to TIERING_INLINE_RESTORE_BYTES
+# in the request, others in the background while requests get a 503.
+TIERING_COLD_AFTER_DAYS = int(os.environ.get("COSAP_TIERING_COLD_AFTER_DAYS", 30))
+TIERING_CRAM_REFERENCE = os.environ.get("COSAP_TIERING_CRAM_REFERENCE")
+TIERING_COMPRESS_PATTERNS = os.environ.get(
+    "COSAP_TIERING_COMPRESS_PATTERNS",
+    "*.vcf,*.sam,*.pileup,*.mpileup,*.bed,*.tsv,*.csv,*.txt,*.log",
+).split(",")
+TIERING_DROP_PATTERNS = [
+    pattern
+    for pattern in os.environ.get("COSAP_TIERING_DROP_PATTERNS", "").split(",")
+    if pattern
+]
+TIERING_INLINE_RESTORE_BYTES = int(
+    os.environ.get("COSAP_TIERING_INLINE_RESTORE_BYTES", 64 * 1024 * 1024)
+)
+
+# Largest number of projects whose variants can be compared at once
+COHORT_MAX_PROJECTS = int(os.environ.get("COSAP_COHORT_MAX_PROJECTS", 200))
+
 # Substitute User Model
 AUTH_USER_MODEL = "api.CustomUser"
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+# Connections are kept open for COSAP_DB_CONN_MAX_AGE seconds and checked
+# before their first use in each request (see cosapweb.db.postgresql).
+# Under ASGI it defaults to 0 (see cosapweb.asgi), so every request opens a
+# connection and ASGI workers must connect through a pooler: PgBouncer in
+# transaction pooling mode, with COSAP_DB_POOLER=pgbouncer, as the pgbouncer
+# service of docker-compose.yaml.
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql",
+        "ENGINE": "cosapweb.db.postgresql",
         "NAME": os.environ.get("COSAP_POSTGRES_NAME", "postgres"),
         "USER": os.environ.get("COSAP_POSTGRES_USER", "postgres"),
         "PASSWORD": os.environ.get("COSAP_POSTGRES_PASSWORD", "postgres"),
-        "HOST": "db",
-        "PORT": "5432",
+        "HOST": os.environ.get("COSAP_POSTGRES_HOST", "db"),
+        "PORT": os.environ.get("COSAP_POSTGRES_PORT", "5432"),
+        "CONN_MAX_AGE": int(os.environ.get("COSAP_DB_CONN_MAX_AGE", 60)),
+        "DISABLE_SERVER_SIDE_CURSORS": os.environ.get("COSAP_DB_POOLER")
+        == "pgbouncer",
     }
 }
 
+# Optional read replica for heavy read-only endpoints, see cosapweb.db_routers
+if os.environ.get("COSAP_POSTGRES_REPLICA_HOST"):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": os.environ["COSAP_POSTGRES_REPLICA_HOST"],
+        "PORT": os.environ.get("COSAP_POSTGRES_REPLICA_PORT", "5432"),
+        "TEST": {"MIRROR": "default"},
+    }
+elif TESTING:
+    # Tests check replica routing against a mirror of the default database
+    DATABASES["replica"] = {**DATABASES["default"], "TEST": {"MIRROR": "default"}}
+
+DATABASE_ROUTERS = ["cosapweb.db_routers.ReplicaRouter"]
+
+# Users read from the primary for this many seconds after they write,
+# which should exceed the replication lag.
+REPLICA_READ_YOUR_WRITES_SECONDS = int(
+    os.environ.get("COSAP_REPLICA_READ_YOUR_WRITES_SECONDS", 10)
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -188,17 +297,74 @@ CELERY_TASK_ROUTES = {
 CELERY_ACCEPT_CONTENT = ["pickle", "json", "msgpack", "yaml"]
 CELERY_SEND_TASK = True
 
-sentry_sdk.init(
-    dsn=os.environ.get("SENTRY_DSN"),
-    integrations=[
-        DjangoIntegration(),
-    ],
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    # We recommend adjusting this value in production.
-    traces_sample_rate=1.0,
-    # If you wish to associate users to errors (assuming you are using
-    # django.contrib.auth) you may enable sending PII data.
-    send_default_pii=True
+# Request instrumentation, see cosapweb.middleware.RequestInstrumentationMiddleware.
+# REQUEST_PROFILE_SAMPLE_RATE of requests are profiled with REQUEST_PROFILER
+# ("cprofile" or "pyinstrument"); profiles of requests slower than
+# SLOW_REQUEST_MS are saved to REQUEST_PROFILE_DIR.
+REQUEST_PROFILE_SAMPLE_RATE = float(os.environ.get("COSAP_PROFILE_SAMPLE_RATE", 0))
+REQUEST_PROFILER = os.environ.get("COSAP_REQUEST_PROFILER", "cprofile")
+SLOW_REQUEST_MS = float(os.environ.get("COSAP_SLOW_REQUEST_MS", 1000))
+REQUEST_PROFILE_DIR = os.environ.get(
+    "COSAP_REQUEST_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "cosap_profiles")
 )
-ignore_logger("django.security.DisallowedHost")
+
+# Prometheus metrics are served at /metrics to scrapers sending
+# "Authorization: Bearer <COSAP_METRICS_TOKEN>", to the comma separated
+# addresses in COSAP_METRICS_ALLOWED_IPS and to staff users.
+METRICS_TOKEN = os.environ.get("COSAP_METRICS_TOKEN")
+METRICS_ALLOWED_IPS = [
+    address
+    for address in os.environ.get("COSAP_METRICS_ALLOWED_IPS", "").split(",")
+    if address
+]
+
+# Performance tracing, see cosapweb.common.tracing.AdaptiveTracesSampler.
+# Requests are traced at TRACES_SAMPLE_RATE unless they match one of
+# TRACES_ENDPOINT_SAMPLE_RATES (method, path regex, rate), and each process
+# sends about TRACES_PER_SECOND transactions per second at most, besides
+# those of endpoints with a rate of 1.0, which are always traced. Slow
+# requests that were not traced are reported to Sentry as messages.
+TRACES_SAMPLE_RATE = float(os.environ.get("COSAP_TRACES_SAMPLE_RATE", 0.1))
+TRACES_ENDPOINT_SAMPLE_RATES = [
+    ("*", r"^/(async/)?(igv|file)/", 0.001),
+    ("PATCH", r"^/files/patch/", 0.001),
+    ("*", r"^/metrics", 0),
+    ("POST", r"^/projects/?$", 1.0),
+    ("POST", r"^/projects/\d+/(rerun_project|cancel_project)/?$", 1.0),
+]
+TRACES_PER_SECOND = float(os.environ.get("COSAP_TRACES_PER_SECOND", 2))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "cosapweb": {"handlers": ["console"], "level": "INFO"},
+    },
+}
+
+# Sentry is only imported and initialized when SENTRY_DSN is set, which
+# keeps it out of the startup of local runs and management commands.
+SENTRY_DSN = os.environ.get("SENTRY_DSN")
+if SENTRY_DSN:
+    import sentry_sdk
+    from sentry_sdk.integrations.django import DjangoIntegration
+    from sentry_sdk.integrations.logging import ignore_logger
+
+    from cosapweb.common.tracing import AdaptiveTracesSampler
+
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        integrations=[
+            DjangoIntegration(),
+        ],
+        traces_sampler=AdaptiveTracesSampler(
+            TRACES_SAMPLE_RATE, TRACES_ENDPOINT_SAMPLE_RATES, TRACES_PER_SECOND
+        ),
+        # If you wish to associate users to errors (assuming you are using
+        # django.contrib.auth) you may enable sending PII data.
+        send_default_pii=True
+    )
+    ignore_logger("django.security.DisallowedHost")